@@ -1,19 +1,63 @@
+import argparse
+import hashlib
+import json
 import os
-from PIL import Image  # To get image dimensions
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+MANIFEST_NAME = ".conversion_manifest.json"
+
+
+def _jpeg_dimensions(f):
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code == 0xFF:  # Fill byte before the real marker
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:  # Markers without a length field
+            continue
+        length = struct.unpack(">H", f.read(2))[0]
+        # SOF0-SOF15 carry the frame size, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">xHH", f.read(5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
 
 def get_image_dimensions(image_path):
     """
     Get the dimensions (width, height) of an image.
 
+    Reads only the JPEG/PNG header, never the pixel data. Other formats fall back to PIL,
+    which also stops at the header when only the size is requested.
+
     Args:
         image_path (str): Path to the image file.
     Returns:
         tuple: (width, height) of the image.
     """
+    with open(image_path, "rb") as f:
+        head = f.read(24)
+        if head[:8] == b"\x89PNG\r\n\x1a\n":
+            return struct.unpack(">II", head[16:24])
+        if head[:2] == b"\xff\xd8":
+            dimensions = _jpeg_dimensions(f)
+            if dimensions:
+                return dimensions
+
+    from PIL import Image
+
     with Image.open(image_path) as img:
         return img.width, img.height
 
-def convert_to_yolo(annotation_path, image_dir, output_path):
+
+def convert_to_yolo(annotation_path, image_dir, output_path, verbose: bool = False):
     """
     Convert a single annotation file to YOLO format using dynamic image dimensions.
 
@@ -21,6 +65,9 @@ def convert_to_yolo(annotation_path, image_dir, output_path):
         annotation_path (str): Path to the input annotation file.
         image_dir (str): Directory containing the corresponding images.
         output_path (str): Path to save the converted YOLO annotation file.
+        verbose (bool): Print a line per converted file. Default is False.
+    Returns:
+        int: Number of boxes written, or None if the image is missing.
     """
     # Get corresponding image filename
     annotation_filename = os.path.basename(annotation_path)
@@ -30,61 +77,147 @@ def convert_to_yolo(annotation_path, image_dir, output_path):
     # Get image dimensions
     if not os.path.exists(image_path):
         print(f"Image not found for annotation: {annotation_path}")
-        return
+        return None
     image_width, image_height = get_image_dimensions(image_path)
 
-    # Read annotation file
-    with open(annotation_path, 'r') as file:
-        lines = file.readlines()
+    # Read annotation file; the text after the 8 quad coordinates may itself contain commas
+    with open(annotation_path, 'r', encoding='utf-8', errors='ignore') as file:
+        quads = []
+        for line in file:
+            parts = line.strip().split(',', 8)
+            if len(parts) < 9:
+                continue
+            try:
+                quads.append([int(value) for value in parts[:8]])
+            except ValueError:
+                continue
 
     yolo_annotations = []
-    for line in lines:
-        parts = line.strip().split(',')
-        if len(parts) < 9:
-            continue
-
-        # Extract bounding box coordinates
-        x1, y1 = int(parts[0]), int(parts[1])
-        x2, y2 = int(parts[2]), int(parts[3])
-        x3, y3 = int(parts[4]), int(parts[5])
-        x4, y4 = int(parts[6]), int(parts[7])
-
-        # Calculate YOLO bounding box format
-        x_center = (x1 + x2 + x3 + x4) / (4 * image_width)
-        y_center = (y1 + y2 + y3 + y4) / (4 * image_height)
-        width = (max(x1, x2, x3, x4) - min(x1, x2, x3, x4)) / image_width
-        height = (max(y1, y2, y3, y4) - min(y1, y2, y3, y4)) / image_height
-
-        # Append the YOLO annotation with class ID 0
-        yolo_annotations.append(f"0 {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}")
+    if quads:
+        # Calculate YOLO bounding boxes for the whole file at once
+        quads = np.asarray(quads, dtype=np.float64)
+        xs, ys = quads[:, 0::2], quads[:, 1::2]
+        x_center = xs.sum(axis=1) / (4 * image_width)
+        y_center = ys.sum(axis=1) / (4 * image_height)
+        width = (xs.max(axis=1) - xs.min(axis=1)) / image_width
+        height = (ys.max(axis=1) - ys.min(axis=1)) / image_height
+
+        # All boxes get class ID 0
+        yolo_annotations = [
+            f"0 {row[0]:.6f} {row[1]:.6f} {row[2]:.6f} {row[3]:.6f}"
+            for row in np.stack([x_center, y_center, width, height], axis=1).tolist()
+        ]
 
     # Write YOLO annotations to file
     with open(output_path, 'w') as output_file:
         output_file.write("\n".join(yolo_annotations))
+    if verbose:
         print(f"Converted annotations saved to: {output_path}")
+    return len(yolo_annotations)
+
 
-def batch_convert(input_annotations_dir, image_dir, output_annotations_dir):
+def _file_state(path):
+    stat = os.stat(path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _input_state(annotation_path, image_path, previous=None):
+    """
+    Fingerprint the inputs of one conversion. Content hashes are only recomputed when mtime or size changed.
+    """
+    state = {"annotation": _file_state(annotation_path)}
+    if os.path.exists(image_path):
+        state["image"] = _file_state(image_path)
+    for key, path in (("annotation", annotation_path), ("image", image_path)):
+        if key not in state:
+            continue
+        old = (previous or {}).get(key)
+        if old and old["mtime_ns"] == state[key]["mtime_ns"] and old["size"] == state[key]["size"]:
+            state[key]["sha1"] = old["sha1"]
+        else:
+            state[key]["sha1"] = _file_hash(path)
+    return state
+
+
+def _same_content(state, previous):
+    if not previous or state.keys() != previous.keys():
+        return False
+    return all(state[key]["sha1"] == previous[key]["sha1"] for key in state)
+
+
+def _convert_job(job):
+    annotation_path, image_dir, output_path, previous, force = job
+    image_path = os.path.join(image_dir, os.path.basename(annotation_path).replace('.txt', '.jpg'))
+    state = _input_state(annotation_path, image_path, previous)
+    if not force and os.path.exists(output_path) and _same_content(state, previous):
+        return os.path.basename(annotation_path), state, "unchanged"
+    boxes = convert_to_yolo(annotation_path, image_dir, output_path)
+    return os.path.basename(annotation_path), state, "missing_image" if boxes is None else "converted"
+
+
+def batch_convert(input_annotations_dir, image_dir, output_annotations_dir, workers: int = None,
+                  force: bool = False):
     """
     Loop through all annotation files and convert them to YOLO format using dynamic image dimensions.
 
+    Files are converted in parallel across processes. A manifest of input mtimes, sizes and hashes is kept
+    in the output directory so that re-runs only convert annotations (or images) that changed.
+
     Args:
         input_annotations_dir (str): Directory containing input annotation files.
         image_dir (str): Directory containing the corresponding images.
         output_annotations_dir (str): Directory to save converted YOLO annotation files.
+        workers (int, optional): Number of worker processes. Default is the number of CPU cores.
+        force (bool): Reconvert every file regardless of the manifest. Default is False.
+    Returns:
+        dict: Number of files per outcome ("converted", "unchanged", "missing_image").
     """
     os.makedirs(output_annotations_dir, exist_ok=True)
-
-    for annotation_filename in os.listdir(input_annotations_dir):
+    manifest_path = os.path.join(output_annotations_dir, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as file:
+            manifest = json.load(file)
+
+    jobs = []
+    for annotation_filename in sorted(os.listdir(input_annotations_dir)):
         if annotation_filename.endswith('.txt'):
-            annotation_path = os.path.join(input_annotations_dir, annotation_filename)
-            output_path = os.path.join(output_annotations_dir, annotation_filename)
-            print(f"Processing {annotation_filename}...")
-            convert_to_yolo(annotation_path, image_dir, output_path)
-
-# Define paths
-input_annotations_dir = "C:/Users/USER/Desktop/YOLO/archive/SROIE2019/train/annotations"  # Directory with input annotation files
-image_dir = "C:/Users/USER/Desktop/YOLO/archive/SROIE2019/train/img" # Directory containing corresponding images
-output_annotations_dir = "C:/Users/USER/Desktop/YOLO/archive/SROIE2019/train/annotations_2"  # Directory for YOLO annotations
-
-# Run batch conversion
-batch_convert(input_annotations_dir, image_dir, output_annotations_dir)
+            jobs.append((
+                os.path.join(input_annotations_dir, annotation_filename),
+                image_dir,
+                os.path.join(output_annotations_dir, annotation_filename),
+                manifest.get(annotation_filename),
+                force,
+            ))
+
+    counts = {"converted": 0, "unchanged": 0, "missing_image": 0}
+    new_manifest = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for annotation_filename, state, outcome in executor.map(_convert_job, jobs, chunksize=64):
+            counts[outcome] += 1
+            if outcome != "missing_image":
+                new_manifest[annotation_filename] = state
+
+    with open(manifest_path, 'w') as file:
+        json.dump(new_manifest, file)
+    print(f"Converted {counts['converted']}, unchanged {counts['unchanged']}, "
+          f"missing image {counts['missing_image']} -> {output_annotations_dir}")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert SROIE quad annotations to YOLO format.")
+    parser.add_argument("annotations", help="Directory with input annotation files")
+    parser.add_argument("images", help="Directory containing corresponding images")
+    parser.add_argument("output", help="Directory for YOLO annotations")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Reconvert everything, ignoring the manifest")
+    args = parser.parse_args()
+
+    # Run batch conversion
+    batch_convert(args.annotations, args.images, args.output, workers=args.workers, force=args.force)
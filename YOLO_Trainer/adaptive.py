@@ -0,0 +1,195 @@
+"""
+Adaptive-resolution detection with early exit.
+
+A cheap low-resolution pass (320 px by default) runs first. Its detections are checked against an
+EscalationPolicy; only when they fall short (a required class such as TotalPrice is missing, too few
+boxes, low or uncertain confidences) is the receipt run again at full resolution or tiled.
+
+Every call reports through the instrumentation counters:
+    adaptive_images_total{final_pass}        images finished at each pass ("low", "full", "tiled")
+    adaptive_escalations_total{reason}       why images were escalated
+    adaptive_input_pixels_total{kind}        model input pixels actually run ("run") and what always running
+                                             the full pass would have cost ("baseline")
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+from instrumentation import get_instrumentation
+from tiling import detect_tiled, plan_tiles
+
+# Spellings of the receipt total across the label files: train15 layout model, itemized model
+TOTAL_LABELS = ("TotalPrice", "Total Price")
+
+
+class EscalationPolicy(NamedTuple):
+    """
+    When a low-resolution result is not good enough.
+
+    Attributes:
+        required_labels (tuple, optional): Labels that must be present, e.g. ("TotalPrice",). Each must be one
+            of the model's labels. Default is None: the model's total label, whichever of TOTAL_LABELS it has.
+        min_detections (int): Minimum number of detections.
+        min_mean_confidence (float): Minimum mean confidence over all detections.
+        uncertain_below (float): Detections under this confidence count as uncertain.
+        max_uncertain_fraction (float): Maximum fraction of uncertain detections.
+        escalate_to (str): "full" (model input size), "tiled", or "auto" (tiled for receipts longer than
+            1.5:1, full otherwise).
+    """
+    required_labels: tuple = None
+    min_detections: int = 1
+    min_mean_confidence: float = 0.5
+    uncertain_below: float = 0.3
+    max_uncertain_fraction: float = 0.3
+    escalate_to: str = "auto"
+
+    def check(self, detections, labels):
+        """
+        Return the reason to escalate, or None when the low-resolution result can be kept.
+        """
+        if len(detections) < self.min_detections:
+            return "too_few_detections"
+        found = {labels[class_id] for class_id in detections.class_ids.tolist() if class_id < len(labels)}
+        missing = [label for label in self.required(labels) if label not in found]
+        if missing:
+            return "missing_" + missing[0]
+        if len(detections) and float(detections.scores.mean()) < self.min_mean_confidence:
+            return "low_confidence"
+        if len(detections) and float((detections.scores < self.uncertain_below).mean()) > self.max_uncertain_fraction:
+            return "uncertain"
+        return None
+
+    def required(self, labels):
+        """
+        Resolve required_labels against the model's labels.
+
+        Raises:
+            ValueError: A required label is not one of the labels, so every image would be escalated.
+        """
+        if self.required_labels is None:
+            return tuple(label for label in TOTAL_LABELS if label in labels)
+        unknown = [label for label in self.required_labels if label not in labels]
+        if unknown:
+            raise ValueError(f"Required labels {unknown} are not among the model's labels {list(labels)}")
+        return tuple(self.required_labels)
+
+    def target(self, image_size):
+        """
+        Resolve "auto" to "full" or "tiled" for an image of the given (width, height).
+        """
+        if self.escalate_to != "auto":
+            return self.escalate_to
+        return "tiled" if len(plan_tiles(image_size)) > 1 else "full"
+
+
+class AdaptiveDecision(NamedTuple):
+    """
+    How one image was detected.
+
+    Attributes:
+        final_pass (str): "low", "full" or "tiled".
+        reason (str): Why the low-resolution result was rejected, or None.
+        input_pixels (int): Model input pixels run for this image.
+        baseline_pixels (int): Model input pixels of a single full-resolution pass.
+    """
+    final_pass: str
+    reason: str
+    input_pixels: int
+    baseline_pixels: int
+
+
+def record_decision(decision):
+    """
+    Report an AdaptiveDecision through the instrumentation counters.
+    """
+    metrics = get_instrumentation()
+    metrics.count("adaptive_images_total", final_pass=decision.final_pass)
+    if decision.reason:
+        metrics.count("adaptive_escalations_total", reason=decision.reason)
+    metrics.count("adaptive_input_pixels_total", decision.input_pixels, kind="run")
+    metrics.count("adaptive_input_pixels_total", decision.baseline_pixels, kind="baseline")
+
+
+def _dynamic_spatial(detector):
+    height, width = detector.input_shape[2:4]
+    return not (isinstance(height, int) and isinstance(width, int))
+
+
+def detect_adaptive(detector, image, labels, policy=None, low_size=(320, 320), low_detector=None,
+                    conf_threshold=0.1, iou_threshold=0.5):
+    """
+    Detect with a low-resolution pass first and escalate only when the policy asks for it.
+
+    Args:
+        detector (ReceiptDetector): Full-resolution detector.
+        image (PIL.Image): Full-resolution grayscale, contrast-enhanced receipt image.
+        labels (list): List of class labels.
+        policy (EscalationPolicy, optional): Escalation rules. Default is EscalationPolicy().
+        low_size (tuple): Low-resolution input size (width, height). Default is (320, 320).
+        low_detector (ReceiptDetector, optional): Model for the low-resolution pass. Default is detector itself,
+            which then needs dynamic spatial axes (export with dynamic=True).
+        conf_threshold (float): Confidence threshold for filtering detections.
+        iou_threshold (float): IOU threshold for NMS.
+    Returns:
+        Detections: Detections in image coordinates.
+        AdaptiveDecision: Which pass produced them and what it cost.
+    """
+    policy = policy or EscalationPolicy()
+    low_detector = low_detector or detector
+    if low_detector is detector and not _dynamic_spatial(detector):
+        raise ValueError("The low-resolution pass needs a model with dynamic spatial axes or a low_detector")
+    if not _dynamic_spatial(low_detector):
+        low_size = low_detector.input_size
+
+    width, height = low_size
+    low_input = np.empty((1, 3, height, width), dtype=np.float32)
+    np.divide(np.asarray(image.resize(low_size)), np.float32(255), out=low_input[0], casting="unsafe")
+    detections = low_detector.detect(low_input, image_size=image.size, num_classes=len(labels),
+                                     conf_threshold=conf_threshold, iou_threshold=iou_threshold)
+
+    full_width, full_height = detector.input_size
+    baseline_pixels = full_width * full_height
+    input_pixels = width * height
+    reason = policy.check(detections, labels)
+    final_pass = "low"
+    if reason:
+        final_pass = policy.target(image.size)
+        if final_pass == "tiled":
+            detections, tiles = detect_tiled(detector, image, len(labels), conf_threshold, iou_threshold)
+            input_pixels += len(tiles) * baseline_pixels
+        else:
+            full_input = np.empty((1, 3, full_height, full_width), dtype=np.float32)
+            np.divide(np.asarray(image.resize(detector.input_size)), np.float32(255), out=full_input[0],
+                      casting="unsafe")
+            detections = detector.detect(full_input, image_size=image.size, num_classes=len(labels),
+                                         conf_threshold=conf_threshold, iou_threshold=iou_threshold)
+            input_pixels += baseline_pixels
+
+    decision = AdaptiveDecision(final_pass, reason, input_pixels, baseline_pixels)
+    record_decision(decision)
+    return detections, decision
+
+
+def summarize_decisions(decisions):
+    """
+    Escalation rate and compute saved over a list of AdaptiveDecision.
+
+    Returns:
+        dict: Counts per final pass and reason, escalation rate and the fraction of model input pixels saved
+        compared with always running the full pass.
+    """
+    count = len(decisions)
+    run = sum(decision.input_pixels for decision in decisions)
+    baseline = sum(decision.baseline_pixels for decision in decisions)
+    passes, reasons = {}, {}
+    for decision in decisions:
+        passes[decision.final_pass] = passes.get(decision.final_pass, 0) + 1
+        if decision.reason:
+            reasons[decision.reason] = reasons.get(decision.reason, 0) + 1
+    return {
+        "images": count,
+        "passes": passes,
+        "reasons": reasons,
+        "escalation_rate": (count - passes.get("low", 0)) / count if count else 0.0,
+        "compute_saved": 1 - run / baseline if baseline else 0.0,
+    }
@@ -0,0 +1,414 @@
+"""
+Streaming batch processing of receipt images.
+
+Decode/preprocess, ONNX inference, OCR and parsing run as concurrent stages connected by bounded
+queues, so a slow stage applies backpressure instead of letting work pile up in memory. Results are
+appended to a JSONL file as they complete, and that file doubles as the checkpoint: re-running the
+same command skips every source already recorded without an error. With --parquet the parsed
+receipts are also written to a partitioned Parquet dataset (see receipt_sink); the sink is flushed
+every --parquet-flush-every receipts, and a receipt reaches the checkpoint only after that flush, so
+a killed run never records a receipt whose Parquet rows were lost.
+
+Usage (from the YOLO_Trainer directory):
+    python batch_pipeline.py receipts/ --model model/train15/weights/best.onnx --output results.jsonl
+    python batch_pipeline.py "uploads/*.jpg" receipts.zip archive.tar.gz --output results.jsonl
+    python batch_pipeline.py receipts/ --output results.jsonl --parquet results/
+"""
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+from instrumentation import enable_instrumentation
+from main_prediction import extract_text_from_regions, parse_receipt_data, preprocess_image
+from ocr_backend import pool_settings
+from receipt_detector import ReceiptDetector, get_detector
+from result_cache import ResultCache, bytes_digest, detection_key, model_digest, ocr_key
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+_DONE = object()
+
+
+def iter_sources(inputs):
+    """
+    Enumerate receipt images from directories, globs and tar/zip archives.
+
+    Args:
+        inputs (list): Directory paths, glob patterns, image paths or .tar/.tar.gz/.tgz/.zip archives.
+    Yields:
+        tuple: (key, read) where key uniquely names the image and read() returns its bytes.
+    """
+    for source in inputs:
+        lower = source.lower()
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        path = os.path.join(root, name)
+                        yield path, _file_reader(path)
+        elif lower.endswith(".zip"):
+            with zipfile.ZipFile(source) as archive:
+                for name in archive.namelist():
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield f"{source}::{name}", _zip_reader(archive, name)
+        elif lower.endswith((".tar", ".tar.gz", ".tgz")):
+            with tarfile.open(source) as archive:
+                # Sequential member access keeps compressed tarballs streamable
+                for member in archive:
+                    if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield f"{source}::{member.name}", _tar_reader(archive, member)
+        else:
+            for path in sorted(glob.glob(source)):
+                if path.lower().endswith(IMAGE_EXTENSIONS):
+                    yield path, _file_reader(path)
+
+
+def _file_reader(path):
+    def read():
+        with open(path, "rb") as f:
+            return f.read()
+    return read
+
+
+def _zip_reader(archive, name):
+    return lambda: archive.read(name)
+
+
+def _tar_reader(archive, member):
+    return lambda: archive.extractfile(member).read()
+
+
+def load_checkpoint(output_path):
+    """
+    Read the sources already completed in a previous run and drop a partially written last line.
+
+    Args:
+        output_path (str): JSONL results file.
+    Returns:
+        set: Keys of the sources recorded without an error.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    valid_bytes = 0
+    with open(output_path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # Truncated by a crash mid-write
+            if not line.endswith(b"\n"):
+                break
+            valid_bytes += len(line)
+            if "error" not in record:
+                completed.add(record["source"])
+    if valid_bytes != os.path.getsize(output_path):
+        with open(output_path, "r+b") as f:
+            f.truncate(valid_bytes)
+    return completed
+
+
+class ReceiptPipeline:
+    def __init__(self, detection_model, labels, conf_threshold=0.1, batch_size=8, batch_timeout=0.05,
+                 preprocess_workers=2, ocr_workers=2, queue_size=32, ocr_mode="crop", fast_preprocess=False,
+                 cache=None, sink=None, ocr_pool=None, sink_flush_every=1000):
+        """
+        Bounded-queue pipeline over the receipt processing stages.
+
+        Args:
+            detection_model (str | ReceiptDetector): Path to the ONNX object detection model, or a detector instance.
+            labels (list): List of class labels.
+            conf_threshold (float): Confidence threshold for filtering detections.
+            batch_size (int): Maximum number of images per inference call. Default is 8.
+            batch_timeout (float): Seconds to wait for a partial inference batch. Default is 0.05.
+            preprocess_workers (int): Decode/preprocess threads. Default is 2.
+            ocr_workers (int): OCR/parse threads, each fanning crops out to the OCR pool. Default is 2.
+            queue_size (int): Capacity of each inter-stage queue. Default is 32.
+            ocr_mode (str): "crop" or "page", see extract_text_from_regions. Default is "crop".
+            fast_preprocess (bool): Use the fast grayscale decode of preprocess_image. Default is False.
+            cache (ResultCache, optional): Content-addressed cache; receipts with cached OCR text skip
+                decode, inference and OCR, and cached detections skip inference. Default is None.
+            sink (ReceiptSink, optional): Columnar sink that also receives every written record; closed by the
+                caller. Default is None.
+            ocr_pool (OCREnginePool, optional): OCR engines to use; their settings are part of the OCR cache key.
+                Default is the shared pool.
+            sink_flush_every (int): Records between sink flushes. Records are appended to the JSONL checkpoint
+                only once the flush after them has made their Parquet rows durable. Default is 1000.
+        """
+        if not isinstance(detection_model, ReceiptDetector):
+            detection_model = get_detector(detection_model)
+        self.detector = detection_model
+        self.labels = labels
+        self.conf_threshold = conf_threshold
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.preprocess_workers = preprocess_workers
+        self.ocr_workers = ocr_workers
+        self.queue_size = queue_size
+        self.ocr_mode = ocr_mode
+        self.fast_preprocess = fast_preprocess
+        self.cache = cache
+        self.sink = sink
+        self.ocr_pool = ocr_pool
+        self.sink_flush_every = sink_flush_every
+        self._model_hash = model_digest(self.detector.model_path) if cache is not None else None
+        self._ocr_settings = pool_settings(ocr_pool)
+
+    def run(self, sources, output_path, completed=()):
+        """
+        Process sources and append one JSON line per receipt to output_path.
+
+        Args:
+            sources (iterable): (key, read) pairs as produced by iter_sources.
+            output_path (str): JSONL results file, appended to.
+            completed (set): Keys to skip, e.g. from load_checkpoint.
+        Returns:
+            dict: Counts of processed, failed and skipped sources, plus the "error" that stopped iterating
+            the sources early, if any.
+        """
+        read_queue = queue.Queue(self.queue_size)
+        infer_queue = queue.Queue(self.queue_size)
+        ocr_queue = queue.Queue(self.queue_size)
+        write_queue = queue.Queue(self.queue_size)
+        stats = {"processed": 0, "failed": 0, "skipped": 0}
+
+        threads = [threading.Thread(target=self._read, args=(sources, completed, read_queue, stats), name="read")]
+        threads += self._stage(self._preprocess, read_queue, infer_queue, self.preprocess_workers, "preprocess")
+        threads.append(threading.Thread(target=self._infer, args=(infer_queue, ocr_queue), name="infer"))
+        threads += self._stage(self._ocr, ocr_queue, write_queue, self.ocr_workers, "ocr")
+        for thread in threads:
+            thread.start()
+
+        self._write(write_queue, output_path, stats)
+        for thread in threads:
+            thread.join()
+        return stats
+
+    def _stage(self, func, inbox, outbox, workers, name):
+        """
+        Start worker threads applying func to every record, plus a closer that signals the next stage.
+        """
+        def work():
+            while True:
+                record = inbox.get()
+                if record is _DONE:
+                    inbox.put(_DONE)  # Let sibling workers see it too
+                    return
+                if "error" not in record:
+                    try:
+                        func(record)
+                    except Exception as exc:
+                        record["error"] = f"{name}: {exc!r}"
+                outbox.put(record)
+
+        worker_threads = [threading.Thread(target=work, name=f"{name}-{i}") for i in range(workers)]
+
+        def close():
+            for thread in worker_threads:
+                thread.start()
+            for thread in worker_threads:
+                thread.join()
+            outbox.put(_DONE)
+
+        return [threading.Thread(target=close, name=f"{name}-closer")]
+
+    def _read(self, sources, completed, outbox, stats):
+        try:
+            for key, read in sources:
+                if key in completed:
+                    stats["skipped"] += 1
+                    continue
+                record = {"source": key}
+                try:
+                    record["data"] = read()
+                except Exception as exc:
+                    record["error"] = f"read: {exc!r}"
+                outbox.put(record)
+        except Exception as exc:  # e.g. a corrupt archive: keep what was read, report the rest as not listed
+            stats["error"] = f"sources: {exc!r}"
+        finally:
+            outbox.put(_DONE)  # Always, or every later stage waits forever
+
+    def _preprocess(self, record):
+        data = record.pop("data")
+        if self.cache is not None:
+            record["detections_key"] = detection_key(
+                bytes_digest(data), self._model_hash, self.labels, self.conf_threshold, 0.5,
+                self.detector.input_size, self.fast_preprocess,
+            )
+            record["ocr_key"] = ocr_key(record["detections_key"], self.ocr_mode, self._ocr_settings)
+            extracted_data = self.cache.get("ocr", record["ocr_key"])
+            regions = self.cache.get("detections", record["detections_key"])
+            if regions is not None:
+                record["regions"] = regions
+                if extracted_data is not None:
+                    record["extracted"] = extracted_data
+                    return  # Nothing left to compute but the parse
+
+        input_data, image = preprocess_image(
+            io.BytesIO(data), input_size=self.detector.input_size, fast=self.fast_preprocess
+        )
+        record["input"] = input_data[0]
+        record["image"] = image
+
+    def _infer(self, inbox, outbox):
+        finished = False
+        while not finished:
+            first = inbox.get()
+            if first is _DONE:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.batch_timeout
+            while len(batch) < self.batch_size:
+                try:
+                    record = inbox.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if record is _DONE:
+                    finished = True
+                    break
+                batch.append(record)
+
+            ready = [record for record in batch if "error" not in record and "regions" not in record]
+            if ready:
+                try:
+                    batch_detections = self.detector.detect_batch(
+                        np.stack([record.pop("input") for record in ready]),
+                        image_sizes=[record["image"].size for record in ready],
+                        num_classes=len(self.labels),
+                        conf_threshold=self.conf_threshold,
+                    )
+                    for record, detections in zip(ready, batch_detections):
+                        record["regions"] = detections.to_regions(self.labels)
+                        if self.cache is not None:
+                            self.cache.put("detections", record["detections_key"], record["regions"])
+                except Exception as exc:
+                    for record in ready:
+                        record["error"] = f"infer: {exc!r}"
+            for record in batch:
+                outbox.put(record)
+        outbox.put(_DONE)
+
+    def _ocr(self, record):
+        extracted_data = record.pop("extracted", None)
+        if extracted_data is None:
+            image = record.pop("image")
+            extracted_data = extract_text_from_regions(image, record["regions"], self.ocr_pool, mode=self.ocr_mode)
+            if self.cache is not None:
+                self.cache.put("ocr", record["ocr_key"], extracted_data)
+        record["receipt"] = parse_receipt_data(extracted_data)
+
+    def _write(self, inbox, output_path, stats):
+        pending = []  # Checkpoint lines waiting for the sink flush that makes their rows durable
+        with open(output_path, "a", encoding="utf-8") as f:
+            while True:
+                record = inbox.get()
+                if record is _DONE:
+                    break
+                for transient in ("data", "input", "image", "extracted", "detections_key", "ocr_key"):
+                    record.pop(transient, None)
+                stats["failed" if "error" in record else "processed"] += 1
+                if self.sink is None:
+                    f.write(json.dumps(record) + "\n")
+                    f.flush()
+                    continue
+                self.sink.write(record)
+                pending.append(json.dumps(record) + "\n")
+                if len(pending) >= self.sink_flush_every:
+                    self._checkpoint(f, pending)
+            if pending:
+                self._checkpoint(f, pending)
+
+    def _checkpoint(self, f, pending):
+        self.sink.flush()
+        f.writelines(pending)
+        f.flush()
+        pending.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="Directories, glob patterns or .tar/.tar.gz/.zip archives")
+    parser.add_argument("--model", default="model/train15/weights/best.onnx", help="ONNX detection model")
+    # main.py writes the label files crosswise: labels_item.txt holds the classes of the train15 model above
+    parser.add_argument("--labels", default="labels_item.txt", help="Class labels of the model")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL results file (also the checkpoint)")
+    parser.add_argument("--conf", type=float, default=0.1, help="Confidence threshold")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per inference call")
+    parser.add_argument("--preprocess-workers", type=int, default=2, help="Decode/preprocess threads")
+    parser.add_argument("--ocr-workers", type=int, default=2, help="OCR/parse threads")
+    parser.add_argument("--queue-size", type=int, default=32, help="Capacity of each inter-stage queue")
+    parser.add_argument("--ocr-mode", choices=("crop", "page"), default="crop", help="OCR strategy")
+    parser.add_argument("--fast-decode", action="store_true", help="Use the fast grayscale JPEG decode")
+    parser.add_argument("--cache", default=None, help="SQLite file caching detections and OCR text across runs")
+    parser.add_argument("--parquet", default=None,
+                        help="Also write parsed receipts to this partitioned Parquet dataset (needs pyarrow)")
+    parser.add_argument("--parquet-flush-every", type=int, default=1000,
+                        help="Receipts between Parquet flushes (each flush finalizes one file per partition)")
+    parser.add_argument("--metrics-output", default=None, help="Write stage timings and counters to this file")
+    parser.add_argument("--metrics-format", choices=("prometheus", "jsonl"), default="prometheus",
+                        help="Metrics file format")
+    parser.add_argument("--log-level", default="WARNING", help="Logging level, e.g. DEBUG for per-region OCR text")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper())
+    metrics = enable_instrumentation() if args.metrics_output else None
+
+    with open(args.labels, "r") as f:
+        labels = f.read().splitlines()
+
+    completed = load_checkpoint(args.output)
+    if completed:
+        print(f"Resuming: {len(completed)} receipts already in {args.output}")
+
+    sink = None
+    if args.parquet:
+        from receipt_sink import ReceiptSink  # Optional: pyarrow is only needed for the Parquet output
+
+        sink = ReceiptSink(args.parquet)
+
+    pipeline = ReceiptPipeline(
+        args.model,
+        labels,
+        conf_threshold=args.conf,
+        batch_size=args.batch_size,
+        preprocess_workers=args.preprocess_workers,
+        ocr_workers=args.ocr_workers,
+        queue_size=args.queue_size,
+        ocr_mode=args.ocr_mode,
+        fast_preprocess=args.fast_decode,
+        cache=ResultCache(args.cache) if args.cache else None,
+        sink=sink,
+        sink_flush_every=args.parquet_flush_every,
+    )
+    start = time.perf_counter()
+    try:
+        stats = pipeline.run(iter_sources(args.inputs), args.output, completed)
+    finally:
+        if sink is not None:
+            sink.close()
+    elapsed = time.perf_counter() - start
+    print(f"Processed {stats['processed']}, failed {stats['failed']}, skipped {stats['skipped']} "
+          f"in {elapsed:.1f}s ({stats['processed'] / max(elapsed, 1e-9):.1f} receipts/s)")
+    if "error" in stats:
+        print(f"Stopped reading inputs early: {stats['error']}")
+    if metrics is not None:
+        metrics.write(args.metrics_output, args.metrics_format)
+        print(f"Metrics written to {args.metrics_output}")
+    if sink is not None:
+        print(f"Parquet dataset written to {args.parquet} ({sink.rows_written} rows)")
+
+
+if __name__ == "__main__":
+    main()
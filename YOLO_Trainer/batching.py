@@ -0,0 +1,100 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class MicroBatcher:
+    def __init__(self, process_batch, batch_size: int = 8, timeout: float = 0.05):
+        """
+        Collect individually submitted items into batches for a batch-processing function.
+
+        A batch is flushed as soon as it holds batch_size items, or once timeout seconds have passed
+        since its first item arrived, so a partial batch never waits indefinitely.
+
+        Args:
+            process_batch (callable): Takes a list of items and returns a list of results in the same order.
+            batch_size (int): Maximum number of items per batch. Default is 8.
+            timeout (float): Seconds to wait for a partial batch to fill up. Default is 0.05.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.process_batch = process_batch
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()  # Orders submits against close, so nothing is queued behind _STOP
+        self._worker = threading.Thread(target=self._run, name="MicroBatcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        """
+        Queue an item for the next batch.
+
+        Returns:
+            Future: Resolves to the item's result, or raises the exception its batch raised.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._queue.put((item, future))
+        return future
+
+    def close(self):
+        """
+        Flush pending items and stop the worker thread.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.timeout
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    entry = self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        try:
+            results = self.process_batch(items)
+        except Exception as exc:
+            for future in futures:
+                future.set_exception(exc)
+            return
+        results = list(results)
+        if len(results) != len(futures):
+            error = RuntimeError(f"process_batch returned {len(results)} results for {len(futures)} items")
+            for future in futures:
+                future.set_exception(error)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
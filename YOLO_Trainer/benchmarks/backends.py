@@ -0,0 +1,343 @@
+"""
+Cross-backend benchmark of one trained run.
+
+Exports <run>/weights/best.pt to every requested format (the same export YOLOTrainer.export_model does,
+plus the reduced-precision ONNX variants of model_quantization) from a copy in <report>_models, so the
+run's deployed exports (e.g. weights/best.onnx) are never overwritten, then runs every format over the same
+receipts through ultralytics predict with the receipt preprocessing. Each format runs in its own
+interpreter so peak memory is not shared. Reports per-format load time, p50/p95 latency, throughput,
+peak RSS and agreement with the PyTorch reference: reference boxes matched by class and IOU, mean IOU
+of the matches and the score drift. Formats whose exporter is not installed are listed as skipped.
+
+Run from the YOLO_Trainer directory:
+    python -m benchmarks.backends model/train15 --images dataset/valid/images --data dataset/data.yaml
+    python -m benchmarks.backends model/train15 --formats pytorch onnx onnx_dynamic --max-images 20
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import yaml
+
+from threshold_sweep import box_iou
+
+# format: (ultralytics export format, modules the exporter needs)
+EXPORT_FORMATS = {
+    "torchscript": ("torchscript", ()),
+    "onnx": ("onnx", ("onnx",)),
+    "openvino": ("openvino", ("openvino",)),
+    "tflite": ("tflite", ("tensorflow",)),
+}
+# Built from the ONNX export by model_quantization.build_variants
+QUANTIZED_FORMATS = {"onnx_int8": "int8", "onnx_dynamic": "dynamic", "onnx_fp16": "fp16"}
+ALL_FORMATS = ("pytorch",) + tuple(EXPORT_FORMATS) + tuple(QUANTIZED_FORMATS)
+
+
+def export_formats(weights, formats, export_dir, imgsz=640, data_yaml=None):
+    """
+    Export the weights to every requested format.
+
+    Args:
+        weights (str): The run's best.pt; it is copied into export_dir and exported from there, since
+            ultralytics writes every export next to the weights.
+        formats (list): Names from ALL_FORMATS.
+        export_dir (str): Directory receiving the copy and all exports.
+        imgsz (int): Export image size. Default is 640.
+        data_yaml (str, optional): Dataset YAML; the static INT8 variant calibrates on its train split.
+    Returns:
+        dict: {format: model path}.
+        dict: {format: reason} for the formats that could not be built.
+    """
+    from model_quantization import build_variants
+    from yolo_trainer import YOLOTrainer
+
+    os.makedirs(export_dir, exist_ok=True)
+    weights = shutil.copy2(weights, os.path.join(export_dir, os.path.basename(weights)))
+    paths, skipped = {"pytorch": weights}, {}
+    trainer = YOLOTrainer(weights)
+    needs_onnx = "onnx" in formats or any(name in QUANTIZED_FORMATS for name in formats)
+    for name, (export_format, requirements) in EXPORT_FORMATS.items():
+        if name not in formats and not (name == "onnx" and needs_onnx):
+            continue
+        missing = [module for module in requirements if importlib.util.find_spec(module) is None]
+        if missing:
+            skipped[name] = f"exporter needs {', '.join(missing)}"
+            continue
+        try:
+            paths[name] = str(trainer.export_model(export_format=export_format, img_size=imgsz))
+        except Exception as error:  # One broken exporter should not end the whole matrix
+            skipped[name] = f"export failed: {error}"
+
+    variants = [QUANTIZED_FORMATS[name] for name in formats if name in QUANTIZED_FORMATS]
+    if "int8" in variants and not data_yaml:
+        skipped["onnx_int8"] = "static INT8 needs --data for calibration images"
+        variants.remove("int8")
+    if variants and "onnx" in paths:
+        variant_paths, _ = build_variants(paths["onnx"], data_yaml, variants, imgsz=imgsz, validate=False)
+        for name, variant in QUANTIZED_FORMATS.items():
+            if variant in variant_paths:
+                paths[name] = variant_paths[variant]
+    elif variants:
+        for name, variant in QUANTIZED_FORMATS.items():
+            if variant in variants:
+                skipped[name] = "no ONNX export to quantize"
+    return {name: path for name, path in paths.items() if name in formats}, skipped
+
+
+def _peak_rss_mb():
+    if sys.platform == "win32":
+        import psutil
+
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    if os.path.exists("/proc/self/status"):
+        # VmHWM starts fresh at exec; ru_maxrss would carry over the parent's peak
+        with open("/proc/self/status", "r") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    import resource  # POSIX only
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024  # Bytes on macOS, KiB elsewhere
+
+
+def run_worker(model_path, image_paths, imgsz=640, conf=0.25, warmup=2):
+    """
+    Time one model over the images (called in a fresh interpreter by run_format).
+
+    Returns:
+        dict: Load time, per-image latencies (ms), peak RSS and the detections of every image.
+    """
+    from ultralytics import YOLO
+
+    from yolo_trainer import YOLOTrainer
+
+    images = [YOLOTrainer.preprocess_image(path) for path in image_paths]
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
+    model = YOLO(model_path, task="detect")
+    for _ in range(warmup):
+        model.predict(images[0], imgsz=imgsz, conf=conf, verbose=False)
+    load_seconds = time.perf_counter() - start
+
+    latencies, detections = [], []
+    for image in images:
+        start = time.perf_counter()
+        result = model.predict(image, imgsz=imgsz, conf=conf, verbose=False)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        detections.append({
+            "boxes": result.boxes.xyxy.cpu().numpy().tolist(),
+            "scores": result.boxes.conf.cpu().numpy().tolist(),
+            "class_ids": result.boxes.cls.cpu().numpy().astype(int).tolist(),
+        })
+    peak = _peak_rss_mb()
+    return {"load_seconds": load_seconds, "latencies_ms": latencies, "peak_rss_mb": peak,
+            "model_rss_mb": peak - rss_before, "detections": detections}
+
+
+def run_format(model_path, image_paths, imgsz=640, conf=0.25):
+    """
+    Run run_worker in its own interpreter so each format's peak memory is measured alone.
+    """
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as workdir:
+        job_path, output_path = os.path.join(workdir, "job.json"), os.path.join(workdir, "result.json")
+        with open(job_path, "w") as f:
+            json.dump({"model": model_path, "images": image_paths, "imgsz": imgsz, "conf": conf}, f)
+        subprocess.run([sys.executable, "-m", "benchmarks.backends", "--worker", job_path, output_path],
+                       cwd=cwd, check=True, env=dict(os.environ, YOLO_AUTOINSTALL="false"))
+        with open(output_path, "r") as f:
+            return json.load(f)
+
+
+def agreement(reference, candidate, iou_threshold=0.5):
+    """
+    Compare the detections of a format with the reference, image by image.
+
+    Reference boxes are matched greedily (highest score first) to the best unmatched candidate box of the
+    same class with IOU at or above iou_threshold.
+
+    Returns:
+        dict: "recall" (reference boxes matched), "precision" (candidate boxes matched), "mean_iou" of the
+        matches, "mean_score_diff" and "max_score_diff" (absolute) and "mean_box_diff_px" (mean absolute
+        corner offset).
+    """
+    matched, reference_total, candidate_total = 0, 0, 0
+    ious, score_diffs, box_diffs = [], [], []
+    for ref, cand in zip(reference, candidate):
+        ref_boxes, cand_boxes = np.asarray(ref["boxes"]).reshape(-1, 4), np.asarray(cand["boxes"]).reshape(-1, 4)
+        reference_total += len(ref_boxes)
+        candidate_total += len(cand_boxes)
+        if not len(ref_boxes) or not len(cand_boxes):
+            continue
+        iou = box_iou(ref_boxes, cand_boxes)
+        iou[np.asarray(ref["class_ids"])[:, None] != np.asarray(cand["class_ids"])[None, :]] = 0
+        taken = np.zeros(len(cand_boxes), dtype=bool)
+        for i in np.argsort(-np.asarray(ref["scores"]), kind="stable"):
+            overlaps = np.where(taken, 0, iou[i])
+            j = overlaps.argmax()
+            if overlaps[j] < iou_threshold:
+                continue
+            taken[j] = True
+            matched += 1
+            ious.append(overlaps[j])
+            score_diffs.append(abs(ref["scores"][i] - cand["scores"][j]))
+            box_diffs.append(np.abs(ref_boxes[i] - cand_boxes[j]).mean())
+    return {
+        "recall": matched / reference_total if reference_total else 1.0,
+        "precision": matched / candidate_total if candidate_total else 1.0,
+        "mean_iou": float(np.mean(ious)) if ious else 0.0,
+        "mean_score_diff": float(np.mean(score_diffs)) if score_diffs else 0.0,
+        "max_score_diff": float(np.max(score_diffs)) if score_diffs else 0.0,
+        "mean_box_diff_px": float(np.mean(box_diffs)) if box_diffs else 0.0,
+    }
+
+
+def run_matrix(run_dir, image_paths, formats=ALL_FORMATS, imgsz=None, conf=0.25, data_yaml=None, export_dir=None):
+    """
+    Export a run to every format and benchmark them on the same images.
+
+    Args:
+        run_dir (str): Training run directory with weights/best.pt (e.g. model/train15).
+        image_paths (list): Receipt images.
+        formats (tuple): Names from ALL_FORMATS; "pytorch" is always run as the reference.
+        imgsz (int, optional): Image size. Default is the run's args.yaml imgsz, else 640.
+        conf (float): Confidence threshold. Default is 0.25.
+        data_yaml (str, optional): Dataset YAML for the static INT8 calibration.
+        export_dir (str, optional): Where the exported models are written. Default is
+            <run_dir>/backend_report_models.
+    Returns:
+        dict: One entry per format with metrics, or the reason it was skipped.
+    """
+    weights = os.path.join(run_dir, "weights", "best.pt")
+    if imgsz is None:
+        args_path = os.path.join(run_dir, "args.yaml")
+        imgsz = 640
+        if os.path.exists(args_path):
+            with open(args_path, "r") as f:
+                imgsz = yaml.safe_load(f).get("imgsz", 640)
+    formats = ("pytorch",) + tuple(name for name in formats if name != "pytorch")
+    export_dir = export_dir or os.path.join(run_dir, "backend_report_models")
+    paths, skipped = export_formats(weights, formats, export_dir, imgsz, data_yaml)
+
+    report, reference = {}, None
+    for name in formats:
+        if name in skipped:
+            report[name] = {"error": skipped[name]}
+            continue
+        print(f"Running {name}: {paths[name]}")
+        try:
+            result = run_format(paths[name], image_paths, imgsz, conf)
+        except subprocess.CalledProcessError as error:
+            report[name] = {"error": f"run failed (exit {error.returncode})"}
+            continue
+        latencies = np.asarray(result["latencies_ms"])
+        entry = {
+            "path": paths[name],
+            "size_mb": _path_size(paths[name]) / 2 ** 20,
+            "load_seconds": result["load_seconds"],
+            "latency_ms_p50": float(np.percentile(latencies, 50)),
+            "latency_ms_p95": float(np.percentile(latencies, 95)),
+            "throughput_ips": len(latencies) / (latencies.sum() / 1000),
+            "peak_rss_mb": result["peak_rss_mb"],
+            "model_rss_mb": result["model_rss_mb"],
+        }
+        if name == "pytorch":
+            reference = result["detections"]
+        if reference is None:
+            entry["agreement_error"] = "no reference: the pytorch run failed"
+        else:
+            entry.update(agreement(reference, result["detections"]))
+        report[name] = entry
+    return report
+
+
+def _path_size(path):
+    if os.path.isdir(path):  # openvino and saved_model exports are directories
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+    return os.path.getsize(path)
+
+
+def write_report(report, path_stem):
+    """
+    Write the report as JSON and as a Markdown table, and print the table.
+    """
+    with open(f"{path_stem}.json", "w") as f:
+        json.dump(report, f, indent=2)
+
+    columns = [("size_mb", "Size (MB)", "{:.1f}"), ("load_seconds", "Load (s)", "{:.2f}"),
+               ("latency_ms_p50", "p50 (ms)", "{:.1f}"), ("latency_ms_p95", "p95 (ms)", "{:.1f}"),
+               ("throughput_ips", "img/s", "{:.1f}"), ("peak_rss_mb", "Peak RSS (MB)", "{:.0f}"),
+               ("recall", "Ref. matched", "{:.1%}"), ("precision", "Boxes matched", "{:.1%}"),
+               ("mean_iou", "Mean IOU", "{:.3f}"), ("max_score_diff", "Max Δscore", "{:.3f}")]
+    lines = ["| Format | " + " | ".join(title for _, title, _ in columns) + " | Notes |",
+             "|---" * (len(columns) + 2) + "|"]
+    for name, entry in report.items():
+        cells = [fmt.format(entry[key]) if key in entry else "-" for key, _, fmt in columns]
+        lines.append(f"| {name} | " + " | ".join(cells) + f" | {entry.get('error', entry.get('agreement_error', ''))} |")
+    table = "\n".join(lines) + "\n"
+    with open(f"{path_stem}.md", "w", encoding="utf-8") as f:
+        f.write(table)
+    print(table)
+    print(f"Backend report saved to: {path_stem}.json")
+
+
+def _collect_images(sources, max_images):
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths += sorted(glob.glob(os.path.join(source, "*.jpg")) + glob.glob(os.path.join(source, "*.png")))
+        else:
+            paths += sorted(glob.glob(source))
+    return paths[:max_images]
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--worker":
+        with open(sys.argv[2], "r") as f:
+            job = json.load(f)
+        result = run_worker(job["model"], job["images"], job["imgsz"], job["conf"])
+        with open(sys.argv[3], "w") as f:
+            json.dump(result, f)
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("run_dir", help="Training run directory containing weights/best.pt")
+    parser.add_argument("--images", nargs="*", default=None,
+                        help="Image directories or globs (default: synthetic receipts)")
+    parser.add_argument("--max-images", type=int, default=50, help="Images per format")
+    parser.add_argument("--formats", nargs="+", default=list(ALL_FORMATS), choices=ALL_FORMATS,
+                        help="Formats to benchmark")
+    parser.add_argument("--imgsz", type=int, default=None, help="Image size (default: the run's args.yaml)")
+    parser.add_argument("--conf", type=float, default=0.25, help="Confidence threshold")
+    parser.add_argument("--data", default=None, help="Dataset YAML for static INT8 calibration")
+    parser.add_argument("--output", default=None, help="Report path stem (default: <run_dir>/backend_report)")
+    args = parser.parse_args()
+
+    os.environ["YOLO_AUTOINSTALL"] = "false"  # Report missing exporters instead of pip-installing them
+    output = args.output or os.path.join(args.run_dir, "backend_report")
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.images:
+            image_paths = _collect_images(args.images, args.max_images)
+        else:
+            from benchmarks.synthetic import make_receipts
+
+            receipts = make_receipts(os.path.join(workdir, "receipts"), args.max_images)
+            image_paths = [path for path, _ in receipts]
+        if not image_paths:
+            parser.error("no images found")
+        report = run_matrix(args.run_dir, image_paths, args.formats, args.imgsz, args.conf, args.data,
+                            export_dir=f"{output}_models")
+    write_report(report, output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Cold-start budget of the inference-only entry point.
+
+Each module is imported in a fresh interpreter several times; the median import time and the
+resident memory after the import (VmRSS, and its growth over a bare interpreter) are reported, along
+with any heavy dependency the import pulled in. receipt_inference is checked against the budget and
+must not load any of FORBIDDEN_MODULES; the other modules are measured for comparison. Exits non-zero
+when the check fails, so it can gate CI like benchmarks.pipeline --baseline.
+
+Run from the YOLO_Trainer directory:
+    python -m benchmarks.import_budget
+    python -m pytest tests/test_import_budget.py
+    python -m benchmarks.import_budget --max-seconds 0.3 --max-rss-mb 80 --compare main_prediction yolo_trainer
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BUDGETED_MODULE = "receipt_inference"
+FORBIDDEN_MODULES = ("PIL", "cv2", "pytesseract", "tesserocr", "torch", "ultralytics", "matplotlib", "yaml",
+                     "sqlite3")
+MAX_SECONDS = 0.5
+MAX_RSS_MB = 100
+
+_PROBE = """
+import json, sys, time
+
+def rss_mb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+before = rss_mb()
+start = time.perf_counter()
+if sys.argv[1]:
+    __import__(sys.argv[1])
+seconds = time.perf_counter() - start
+after = rss_mb()
+heavy = sorted(name for name in json.loads(sys.argv[2]) if name in sys.modules)
+print(json.dumps({"seconds": seconds, "rss_mb": after, "rss_growth_mb": after - before, "loaded": heavy}))
+"""
+
+
+def measure(module, runs=5):
+    """
+    Import a module in fresh interpreters.
+
+    Args:
+        module (str): Module name, or "" for a bare interpreter.
+        runs (int): Number of interpreters; the medians are reported. Default is 5.
+    Returns:
+        dict: Median "seconds", "rss_mb" and "rss_growth_mb", plus the heavy modules that were "loaded".
+    """
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE, module, json.dumps(FORBIDDEN_MODULES)],
+            cwd=cwd, capture_output=True, text=True, check=True,
+        ).stdout
+        samples.append(json.loads(output.splitlines()[-1]))
+    return {
+        "seconds": statistics.median(sample["seconds"] for sample in samples),
+        "rss_mb": statistics.median(sample["rss_mb"] for sample in samples),
+        "rss_growth_mb": statistics.median(sample["rss_growth_mb"] for sample in samples),
+        "loaded": samples[-1]["loaded"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-seconds", type=float, default=MAX_SECONDS, help="Import time budget of receipt_inference")
+    parser.add_argument("--max-rss-mb", type=float, default=MAX_RSS_MB, help="RSS budget after importing receipt_inference")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module")
+    parser.add_argument("--compare", nargs="*", default=["main_prediction"], help="Other modules to measure")
+    parser.add_argument("--output", default=None, help="Write the measurements as JSON")
+    args = parser.parse_args()
+
+    results = {"interpreter": measure("", args.runs), BUDGETED_MODULE: measure(BUDGETED_MODULE, args.runs)}
+    for module in args.compare:
+        try:
+            results[module] = measure(module, args.runs)
+        except subprocess.CalledProcessError as error:
+            print(f"{module}: import failed ({error.stderr.strip().splitlines()[-1]})")
+
+    print(f"{'Module':<20}{'import s':>10}{'RSS MB':>10}{'growth MB':>11}  heavy modules loaded")
+    for module, result in results.items():
+        print(f"{module:<20}{result['seconds']:>10.3f}{result['rss_mb']:>10.1f}{result['rss_growth_mb']:>11.1f}  "
+              f"{', '.join(result['loaded']) or '-'}")
+
+    budget = results[BUDGETED_MODULE]
+    failures = []
+    if budget["seconds"] > args.max_seconds:
+        failures.append(f"import took {budget['seconds']:.3f}s > {args.max_seconds}s")
+    if budget["rss_mb"] > args.max_rss_mb:
+        failures.append(f"RSS {budget['rss_mb']:.1f} MB > {args.max_rss_mb} MB")
+    if budget["loaded"]:
+        failures.append(f"loaded {', '.join(budget['loaded'])}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if failures:
+        print(f"{BUDGETED_MODULE} over budget: " + "; ".join(failures))
+        sys.exit(1)
+    print(f"{BUDGETED_MODULE} within budget ({args.max_seconds}s, {args.max_rss_mb} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Compare per-crop OCR against single-pass full-page OCR on one receipt.
+
+Run from the YOLO_Trainer directory:
+    python -m benchmarks.ocr_modes --model model/train15/weights/best.onnx --image receipt.jpg
+"""
+import argparse
+import statistics
+import time
+
+from main_prediction import detect_regions_with_nms, extract_text_from_regions
+from ocr_backend import OCREnginePool
+
+
+def time_mode(image, regions, ocr_pool, mode, repeats):
+    timings = []
+    extracted_data = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        extracted_data = extract_text_from_regions(image, regions, ocr_pool, mode=mode)
+        timings.append(time.perf_counter() - start)
+    return timings, extracted_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="model/train15/weights/best.onnx", help="ONNX detection model")
+    parser.add_argument("--image", default="receipt.jpg", help="Receipt image")
+    # main.py writes the label files crosswise: labels_item.txt holds the classes of the train15 model above
+    parser.add_argument("--labels", default="labels_item.txt", help="Class labels of the model")
+    parser.add_argument("--conf", type=float, default=0.1, help="Confidence threshold")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per mode")
+    parser.add_argument("--workers", type=int, default=None, help="OCR engines in the pool")
+    args = parser.parse_args()
+
+    with open(args.labels, "r") as f:
+        labels = f.read().splitlines()
+    detections, image = detect_regions_with_nms(args.image, args.model, labels, args.conf)
+    regions = detections.to_regions(labels)
+    print(f"{len(regions)} regions detected in {args.image}")
+
+    with OCREnginePool(size=args.workers) as ocr_pool:
+        extract_text_from_regions(image, regions[:1], ocr_pool)  # Warm up the engines
+        results = {mode: time_mode(image, regions, ocr_pool, mode, args.repeats) for mode in ("crop", "page")}
+
+    print(f"{'mode':<6} {'OCR calls':>10} {'median ms':>10} {'mean ms':>10}")
+    for mode, (timings, _) in results.items():
+        calls = len(regions) if mode == "crop" else 1
+        print(f"{mode:<6} {calls:>10} {statistics.median(timings) * 1000:>10.1f} {statistics.mean(timings) * 1000:>10.1f}")
+
+    speedup = statistics.median(results["crop"][0]) / statistics.median(results["page"][0])
+    crop_data, page_data = results["crop"][1], results["page"][1]
+    same_items = sum(" ".join(a.split()) == " ".join(b.split()) for a, b in zip(crop_data["Items"], page_data["Items"]))
+    print(f"Page mode speedup: {speedup:.2f}x")
+    print(f"Identical item text: {same_items}/{len(crop_data['Items'])}")
+
+
+if __name__ == "__main__":
+    main()
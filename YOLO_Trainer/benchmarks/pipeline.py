@@ -0,0 +1,175 @@
+"""
+Stage-level benchmark of the receipt pipeline, fully offline.
+
+Generates synthetic receipts and a stand-in ONNX model with the train15 output shape, then times
+preprocess_image, the ONNX forward pass, decode/NMS, extract_text_from_regions, parse_receipt_data
+and the end-to-end process_receipt call. Reports p50/p95/p99 latency and throughput per stage and
+writes them as JSON. With --baseline, exits non-zero when a stage's p50 regresses past --tolerance.
+
+Run from the YOLO_Trainer directory:
+    python -m benchmarks.pipeline --output bench.json
+    python -m benchmarks.pipeline --output bench_new.json --baseline bench.json --tolerance 0.15
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import TRAIN15_LABELS, make_receipts, make_standin_model
+from main_prediction import extract_text_from_regions, parse_receipt_data, preprocess_image, process_receipt
+from ocr_backend import OCREnginePool
+from postprocess import postprocess
+from receipt_detector import ReceiptDetector
+
+
+def summarize(timings):
+    """
+    Latency percentiles (ms) and throughput (calls/s) for a list of durations in seconds.
+    """
+    values = np.asarray(timings) * 1000
+    return {
+        "count": len(values),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+        "throughput_per_s": float(1000 / values.mean()) if values.mean() > 0 else None,
+    }
+
+
+def open_ocr_pool(workers):
+    """
+    Return an OCR pool if a working tesseract setup exists, otherwise None.
+    """
+    try:
+        pool = OCREnginePool(size=workers)
+        pool.recognize([np.full((32, 32), 255, dtype=np.uint8)])
+        return pool
+    except Exception as exc:
+        print(f"OCR stages skipped: {exc}")
+        return None
+
+
+def run_benchmark(receipts, detector, labels, repeats, fast_preprocess, ocr_pool):
+    timings = {name: [] for name in ("preprocess", "inference", "decode_nms", "ocr", "parse", "end_to_end")}
+    for _ in range(repeats):
+        for image_path, printed_text in receipts:
+            start = time.perf_counter()
+            input_data, original_img = preprocess_image(image_path, detector.input_size, fast=fast_preprocess)
+            timings["preprocess"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            outputs = detector.run(input_data)
+            timings["inference"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            detections = postprocess(
+                outputs[0],
+                num_classes=len(labels),
+                input_size=detector.input_size,
+                image_size=original_img.size,
+            )
+            timings["decode_nms"].append(time.perf_counter() - start)
+
+            extracted_data = printed_text
+            if ocr_pool is not None:
+                start = time.perf_counter()
+                extracted_data = extract_text_from_regions(original_img, detections.to_regions(labels), ocr_pool)
+                timings["ocr"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            parse_receipt_data(extracted_data)
+            timings["parse"].append(time.perf_counter() - start)
+
+            if ocr_pool is not None:
+                start = time.perf_counter()
+                process_receipt(image_path, detector, labels, fast_preprocess=fast_preprocess)
+                timings["end_to_end"].append(time.perf_counter() - start)
+
+    if ocr_pool is None:
+        # Without OCR, end to end is the sum of the measured stages per receipt
+        stages = [timings[name] for name in ("preprocess", "inference", "decode_nms", "parse")]
+        timings["end_to_end"] = [sum(values) for values in zip(*stages)]
+    return {name: summarize(values) for name, values in timings.items() if values}
+
+
+def check_regressions(results, baseline, tolerance):
+    """
+    Compare p50 latencies with a baseline run.
+
+    Returns:
+        list: Human-readable descriptions of the stages that regressed.
+    """
+    regressions = []
+    for stage, stats in results["stages"].items():
+        reference = baseline.get("stages", {}).get(stage)
+        if reference and stats["p50_ms"] > reference["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{stage}: p50 {stats['p50_ms']:.2f} ms vs baseline {reference['p50_ms']:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=20, help="Number of synthetic receipts")
+    parser.add_argument("--items", type=int, default=20, help="Item lines per receipt")
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over the receipts")
+    parser.add_argument("--model", default=None, help="ONNX model to use instead of the stand-in")
+    parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime intra-op threads (0 = default)")
+    parser.add_argument("--fast-preprocess", action="store_true", help="Use the reduced-resolution decode")
+    parser.add_argument("--ocr-workers", type=int, default=None, help="OCR engines (default: CPU count)")
+    parser.add_argument("--no-ocr", action="store_true", help="Skip the OCR stages")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", default=None, help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative p50 slowdown")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        model_path = args.model or make_standin_model(os.path.join(workdir, "standin.onnx"))
+        receipts = make_receipts(os.path.join(workdir, "receipts"), args.receipts, num_items=args.items)
+        detector = ReceiptDetector(model_path, intra_op_num_threads=args.threads)
+        ocr_pool = None if args.no_ocr else open_ocr_pool(args.ocr_workers)
+        try:
+            stages = run_benchmark(receipts, detector, TRAIN15_LABELS, args.repeats, args.fast_preprocess, ocr_pool)
+        finally:
+            if ocr_pool is not None:
+                ocr_pool.close()
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "model": args.model or "standin",
+            "receipts": args.receipts,
+            "items": args.items,
+            "repeats": args.repeats,
+            "fast_preprocess": args.fast_preprocess,
+        },
+        "stages": stages,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{'stage':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'per s':>9}")
+    for stage, stats in stages.items():
+        print(f"{stage:<12} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} "
+              f"{stats['throughput_per_s']:>9.1f}")
+    print(f"Results saved to: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = check_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions found:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Per-stage timings and memory of the default and fast preprocess_image paths.
+
+Run from the YOLO_Trainer directory:
+    python -m benchmarks.preprocess --image receipt.jpg --upscale 4000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from main_prediction import preprocess_image
+
+
+def default_stages(image_path, input_size):
+    img = Image.open(image_path)
+    img.load()
+    yield "decode", img
+    img = img.convert("L")
+    yield "grayscale", img
+    img = ImageEnhance.Contrast(img).enhance(2)
+    yield "contrast", img
+    img_resized = img.resize(input_size)
+    yield "resize", img_resized
+    img_np = np.asarray(img_resized, dtype="float32") / 255.0
+    img_np = np.expand_dims(np.transpose(np.stack([img_np, img_np, img_np], axis=-1), (2, 0, 1)), axis=0)
+    yield "tensor", img_np
+
+
+def fast_stages(image_path, input_size, out):
+    img = Image.open(image_path)
+    img.draft("L", img.size)
+    img.load()
+    yield "decode", img
+    img = img.convert("L")
+    yield "grayscale", img
+    factor = max(min(img.width // input_size[0], img.height // input_size[1]), 1)
+    small = img.reduce(factor) if factor > 1 else img
+    img_resized = ImageEnhance.Contrast(small).enhance(2).resize(input_size)
+    yield "resize", img_resized
+    np.divide(np.asarray(img_resized), np.float32(255), out=out[0], casting="unsafe")
+    yield "tensor", out
+    img = ImageEnhance.Contrast(img).enhance(2)
+    yield "contrast", img
+
+
+def nbytes(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    return obj.width * obj.height * len(obj.getbands())
+
+
+def profile(stages, repeats):
+    """
+    Time each stage and record the size of the buffer it produces.
+    """
+    timings, sizes = {}, {}
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for name, result in stages():
+            now = time.perf_counter()
+            timings.setdefault(name, []).append(now - start)
+            sizes[name] = nbytes(result)
+            start = time.perf_counter()
+    return {name: statistics.median(values) for name, values in timings.items()}, sizes
+
+
+def peak_numpy_memory(func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", default="receipt.jpg", help="Receipt image")
+    parser.add_argument("--upscale", type=int, default=4000,
+                        help="Upscale the image to this height first to mimic a phone photo (0 to disable)")
+    parser.add_argument("--size", type=int, default=640, help="Model input size")
+    parser.add_argument("--repeats", type=int, default=10, help="Timed runs per mode")
+    args = parser.parse_args()
+
+    input_size = (args.size, args.size)
+    image_path = args.image
+    temp_path = None
+    if args.upscale:
+        with Image.open(args.image) as img:
+            width = round(img.width * args.upscale / img.height)
+            large = img.convert("RGB").resize((width, args.upscale), Image.BICUBIC)
+        temp_path = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg").name
+        large.save(temp_path, quality=92)
+        image_path = temp_path
+    print(f"Image: {Image.open(image_path).size} px")
+
+    out = np.empty((1, 3, args.size, args.size), dtype=np.float32)
+    results = {
+        "default": profile(lambda: default_stages(image_path, input_size), args.repeats),
+        "fast": profile(lambda: fast_stages(image_path, input_size, out), args.repeats),
+    }
+
+    print(f"{'stage':<10} {'default ms':>11} {'fast ms':>9} {'default MB':>11} {'fast MB':>9}")
+    for stage in results["default"][0]:
+        print(f"{stage:<10} "
+              f"{results['default'][0][stage] * 1000:>11.2f} {results['fast'][0][stage] * 1000:>9.2f} "
+              f"{results['default'][1][stage] / 1e6:>11.2f} {results['fast'][1][stage] / 1e6:>9.2f}")
+    totals = {mode: sum(stage_times.values()) for mode, (stage_times, _) in results.items()}
+    print(f"{'total':<10} {totals['default'] * 1000:>11.2f} {totals['fast'] * 1000:>9.2f}")
+
+    default_peak = peak_numpy_memory(lambda: preprocess_image(image_path, input_size))
+    fast_peak = peak_numpy_memory(lambda: preprocess_image(image_path, input_size, fast=True, out=out))
+    print(f"Peak NumPy allocations: default {default_peak / 1e6:.2f} MB, fast {fast_peak / 1e6:.2f} MB")
+    print(f"Speedup: {totals['default'] / totals['fast']:.2f}x")
+
+    if temp_path:
+        os.remove(temp_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Synthetic receipts and a stand-in ONNX detector for offline benchmarks.
+
+The stand-in model has the same interface as an ultralytics YOLOv8/11 export of train15:
+input "images" [N, 3, H, W] and output "output0" [N, 4 + nc, anchors] (8400 anchors at 640 px),
+with a dynamic batch and spatial size. Its weights are random, so only its cost is meaningful.
+"""
+import os
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+TRAIN15_LABELS = ["Address", "Date", "Item", "OrderId", "Subtotal", "Tax", "Title", "TotalPrice"]
+
+ITEM_NAMES = ["Nasi Lemak", "Teh Tarik", "Roti Canai", "Mee Goreng", "Milo Ais", "Kopi O", "Chicken Rice",
+              "Mineral Water", "Curry Puff", "Kuih Lapis", "Bread", "Eggs 10pcs", "Sugar 1kg", "Rice 5kg"]
+
+
+def make_standin_model(path, num_classes=len(TRAIN15_LABELS), seed=0):
+    """
+    Write a small ONNX model with the output layout of a YOLOv8/11 detection export.
+
+    Three strided convolutions (strides 8, 16, 32) stand in for the detection heads; their outputs are
+    flattened and concatenated to [N, 4 + nc, anchors], then scaled so boxes land in input pixel space.
+
+    Args:
+        path (str): Output .onnx path.
+        num_classes (int): Number of classes. Default is the 8 train15 classes.
+        seed (int): Seed for the random weights.
+    Returns:
+        str: The model path.
+    """
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    channels = 4 + num_classes
+    rng = np.random.default_rng(seed)
+    nodes, initializers, heads = [], [], []
+    for i, stride in enumerate((8, 16, 32)):
+        weight = rng.normal(0, 0.05, (channels, 3, stride, stride)).astype(np.float32)
+        initializers.append(numpy_helper.from_array(weight, f"head{i}.weight"))
+        initializers.append(numpy_helper.from_array(np.array([0, channels, -1], dtype=np.int64), f"head{i}.shape"))
+        nodes.append(
+            helper.make_node("Conv", ["images", f"head{i}.weight"], [f"head{i}.conv"], strides=[stride, stride])
+        )
+        nodes.append(helper.make_node("Reshape", [f"head{i}.conv", f"head{i}.shape"], [f"head{i}.flat"]))
+        heads.append(f"head{i}.flat")
+
+    # Box channels: centers anywhere in the 640 px frame, receipt-line-like widths and heights.
+    # Class logits are biased down so only a small fraction of anchors clears conf=0.1, like a trained model.
+    bias = np.array([0, 0, 0, 0] + [-5] * num_classes, dtype=np.float32).reshape(1, channels, 1)
+    scale = np.array([640, 640, 160, 32] + [1] * num_classes, dtype=np.float32).reshape(1, channels, 1)
+    initializers.append(numpy_helper.from_array(bias, "bias"))
+    initializers.append(numpy_helper.from_array(scale, "scale"))
+    nodes.append(helper.make_node("Concat", heads, ["concat"], axis=2))
+    nodes.append(helper.make_node("Add", ["concat", "bias"], ["logits"]))
+    nodes.append(helper.make_node("Sigmoid", ["logits"], ["sigmoid"]))
+    nodes.append(helper.make_node("Mul", ["sigmoid", "scale"], ["output0"]))
+
+    graph = helper.make_graph(
+        nodes,
+        "receipt_standin",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, ["batch", 3, "height", "width"])],
+        [helper.make_tensor_value_info("output0", TensorProto.FLOAT, ["batch", channels, "anchors"])],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
+
+
+def make_receipt(seed=0, num_items=20, width=800):
+    """
+    Draw a synthetic receipt.
+
+    Args:
+        seed (int): Seed for the layout and contents.
+        num_items (int): Number of item lines.
+        width (int): Image width in pixels; the height grows with the number of lines.
+    Returns:
+        PIL.Image: RGB receipt image.
+        dict: The printed text in the extract_text_from_regions output format.
+    """
+    rng = random.Random(seed)
+    line_height = 36
+    height = line_height * (num_items + 10)
+    image = Image.new("RGB", (width, height), (250, 250, 245))
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=22)
+    except TypeError:  # Pillow < 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+
+    address = f"{rng.randint(1, 99)} Jalan {rng.choice(['Ampang', 'Bukit Bintang', 'Tun Razak'])}, Kuala Lumpur"
+    draw.text((40, 20), "MAHB STORE", fill=(0, 0, 0), font=font)
+    draw.text((40, 20 + line_height), address, fill=(0, 0, 0), font=font)
+
+    items, total = [], 0.0
+    y = 20 + 3 * line_height
+    for _ in range(num_items):
+        name = rng.choice(ITEM_NAMES)
+        price = round(rng.uniform(0.5, 40), 2)
+        total += price
+        draw.text((40, y), name, fill=(0, 0, 0), font=font)
+        draw.text((width - 140, y), f"{price:.2f}", fill=(0, 0, 0), font=font)
+        items.append(f"{name} {price:.2f}")
+        y += line_height
+
+    total_text = f"{total:.2f}"
+    draw.text((40, y + line_height), "TOTAL", fill=(0, 0, 0), font=font)
+    draw.text((width - 140, y + line_height), total_text, fill=(0, 0, 0), font=font)
+    return image, {"Items": items, "Total": total_text, "Address": address}
+
+
+def make_receipts(out_dir, count=20, seed=0, num_items=20):
+    """
+    Write count synthetic receipts as JPEGs.
+
+    Returns:
+        list: (image path, printed text) pairs.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    receipts = []
+    for i in range(count):
+        image, text = make_receipt(seed + i, num_items=num_items)
+        path = os.path.join(out_dir, f"receipt_{i:04d}.jpg")
+        image.save(path, quality=90)
+        receipts.append((path, text))
+    return receipts
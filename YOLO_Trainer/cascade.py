@@ -0,0 +1,217 @@
+"""
+Two-stage cascade over the whole-receipt (layout) model and the itemized model.
+
+1. The layout model (Address/Date/Item/.../TotalPrice) runs on the whole receipt at a low resolution.
+2. Only its Item regions are cropped, in memory, from the full-resolution image.
+3. The itemized model (Item/Price/Quantity/Sub Price/Total Price) runs on those crops, in one batched
+   call, and its boxes are mapped back to full-image coordinates.
+
+The itemized model never sees the whole page, so its cost scales with the item area instead of the
+image size. The merged output keeps every layout field plus the itemized boxes.
+
+Usage (from the YOLO_Trainer directory):
+    python cascade.py receipt.jpg --layout-model model/train15/weights/best.onnx --item-model item_best.onnx
+"""
+import argparse
+import json
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from main_prediction import extract_text_from_regions, ocr_crops, parse_receipt_data, preprocess_image
+from ocr_backend import get_ocr_pool
+from postprocess import Detections
+from receipt_detector import ReceiptDetector, get_detector
+from row_assembly import assemble_rows, rows_to_item_lines
+
+
+class CascadeResult(NamedTuple):
+    """
+    Output of CascadeEngine.detect.
+
+    Attributes:
+        layout (Detections): Layout-model detections in image coordinates.
+        items (Detections): Itemized-model detections in image coordinates.
+        item_parents (np.ndarray): int64 [len(items)], index into layout of the Item region each came from.
+        regions (list): Merged regions: every layout region except the Item blocks, then the itemized regions.
+            Each region has "label", "confidence", "box" and "source" ("layout" or "item").
+        image (PIL.Image): The full-resolution (grayscale, contrast-enhanced) image the boxes refer to.
+    """
+    layout: Detections
+    items: Detections
+    item_parents: np.ndarray
+    regions: list
+    image: Image.Image
+
+
+def _model_size(detector, requested):
+    # Models exported with dynamic spatial axes accept any size; static ones only their own
+    height, width = detector.input_shape[2:4]
+    if isinstance(height, int) and isinstance(width, int):
+        return detector.input_size
+    return requested
+
+
+class CascadeEngine:
+    def __init__(self, layout_model, layout_labels, item_model, item_labels, layout_size=(320, 320),
+                 item_size=(640, 640), layout_conf=0.1, item_conf=0.1, iou_threshold=0.5, crop_label="Item",
+                 crop_padding=0.02):
+        """
+        Cascade inference engine.
+
+        Args:
+            layout_model (str | ReceiptDetector): Whole-receipt ONNX model, or a detector instance.
+            layout_labels (list): Class labels of the layout model.
+            item_model (str | ReceiptDetector): Itemized ONNX model, or a detector instance. Export it with
+                dynamic=True so all crops of a receipt run in one call.
+            item_labels (list): Class labels of the itemized model.
+            layout_size (tuple): Layout input size (width, height) when the model has dynamic spatial axes.
+                Default is (320, 320).
+            item_size (tuple): Crop input size (width, height) when the model has dynamic spatial axes.
+                Default is (640, 640).
+            layout_conf (float): Confidence threshold of the layout model. Default is 0.1.
+            item_conf (float): Confidence threshold of the itemized model. Default is 0.1.
+            iou_threshold (float): IOU threshold for NMS in both stages. Default is 0.5.
+            crop_label (str): Layout label whose regions are passed to the itemized model. Default is "Item".
+            crop_padding (float): Crop margin as a fraction of the region's width and height, so item boxes
+                on the edge of a loose layout box are not cut. Default is 0.02.
+        """
+        self.layout = layout_model if isinstance(layout_model, ReceiptDetector) else get_detector(layout_model)
+        self.items = item_model if isinstance(item_model, ReceiptDetector) else get_detector(item_model)
+        self.layout_labels = layout_labels
+        self.item_labels = item_labels
+        self.layout_size = _model_size(self.layout, layout_size)
+        self.item_size = _model_size(self.items, item_size)
+        self.layout_conf = layout_conf
+        self.item_conf = item_conf
+        self.iou_threshold = iou_threshold
+        self.crop_class = layout_labels.index(crop_label)
+        self.crop_padding = crop_padding
+
+    def detect(self, image_path):
+        """
+        Run both stages on one receipt.
+
+        Args:
+            image_path (str): Path to the receipt image (or a file-like object).
+        Returns:
+            CascadeResult: Layout and itemized detections in full-image coordinates.
+        """
+        # Full-resolution decode for the crops; only the model input is downscaled
+        input_data, image = preprocess_image(image_path, input_size=self.layout_size)
+        layout = self.layout.detect(
+            input_data,
+            image_size=image.size,
+            num_classes=len(self.layout_labels),
+            conf_threshold=self.layout_conf,
+            iou_threshold=self.iou_threshold,
+        )
+
+        parents = np.flatnonzero(layout.class_ids == self.crop_class)
+        pixels = np.asarray(image)
+        origins, crops = [], []
+        for box in layout.boxes[parents]:
+            x1, y1, x2, y2 = self._padded_box(box, image.size)
+            crops.append(pixels[y1:y2, x1:x2])  # View into the decoded image, no copy
+            origins.append((x1, y1))
+
+        items, item_parents = self._detect_items(crops, origins, parents)
+        regions = [dict(region, source="layout") for region, class_id
+                   in zip(layout.to_regions(self.layout_labels), layout.class_ids.tolist())
+                   if class_id != self.crop_class]
+        regions += [dict(region, source="item") for region in items.to_regions(self.item_labels)]
+        return CascadeResult(layout, items, item_parents, regions, image)
+
+    def _padded_box(self, box, image_size):
+        width, height = image_size
+        pad_x = (box[2] - box[0]) * self.crop_padding
+        pad_y = (box[3] - box[1]) * self.crop_padding
+        return (max(int(box[0] - pad_x), 0), max(int(box[1] - pad_y), 0),
+                min(int(np.ceil(box[2] + pad_x)), width), min(int(np.ceil(box[3] + pad_y)), height))
+
+    def _detect_items(self, crops, origins, parents):
+        keep = [i for i, crop in enumerate(crops) if crop.size]
+        if not keep:
+            return Detections.empty(), np.zeros(0, dtype=np.int64)
+
+        # All crops go into one stacked input and one session call
+        width, height = self.item_size
+        batch = np.empty((len(keep), 3, height, width), dtype=np.float32)
+        for row, i in enumerate(keep):
+            resized = Image.fromarray(crops[i]).resize(self.item_size)
+            np.divide(np.asarray(resized), np.float32(255), out=batch[row], casting="unsafe")
+        batch_detections = self.items.detect_batch(
+            batch,
+            image_sizes=[(crops[i].shape[1], crops[i].shape[0]) for i in keep],
+            num_classes=len(self.item_labels),
+            conf_threshold=self.item_conf,
+            iou_threshold=self.iou_threshold,
+        )
+
+        boxes, scores, class_ids, item_parents = [], [], [], []
+        for i, detections in zip(keep, batch_detections):
+            x, y = origins[i]
+            boxes.append(detections.boxes + np.array([x, y, x, y], dtype=np.float32))
+            scores.append(detections.scores)
+            class_ids.append(detections.class_ids)
+            item_parents.append(np.full(len(detections), parents[i], dtype=np.int64))
+        items = Detections(np.concatenate(boxes), np.concatenate(scores), np.concatenate(class_ids))
+        return items, np.concatenate(item_parents)
+
+    def process(self, image_path, ocr_pool=None, ocr_mode="crop"):
+        """
+        Cascade detection followed by OCR and parsing. Layout fields are read as in process_receipt; item lines
+        are assembled from the itemized boxes row by row (name plus price), or read from the layout model's Item
+        blocks when the itemized model finds no rows.
+
+        Returns:
+            dict: Parsed receipt data.
+            CascadeResult: The detections the data was read from.
+        """
+        result = self.detect(image_path)
+        # Item lines come from the itemized boxes, paired into rows before OCR text is joined
+        rows = assemble_rows(result.items.boxes, result.items.class_ids, self.item_labels)
+        layout_regions = [region for region in result.regions if region["source"] == "layout"]
+        if not rows:
+            # The itemized model found nothing: read the layout model's Item blocks instead, as process_receipt does
+            layout_regions += [region for region, class_id
+                               in zip(result.layout.to_regions(self.layout_labels), result.layout.class_ids.tolist())
+                               if class_id == self.crop_class]
+        extracted_data = extract_text_from_regions(result.image, layout_regions, ocr_pool=ocr_pool, mode=ocr_mode)
+
+        if rows:
+            item_regions = result.items.to_regions(self.item_labels)
+            texts = ocr_crops(np.asarray(result.image), item_regions, ocr_pool or get_ocr_pool())
+            extracted_data["Items"] = rows_to_item_lines(rows, texts)
+        return parse_receipt_data(extracted_data), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", help="Receipt image")
+    parser.add_argument("--layout-model", default="model/train15/weights/best.onnx", help="Whole-receipt ONNX model")
+    # main.py writes the label files crosswise: labels_item.txt holds the whole-receipt classes
+    parser.add_argument("--layout-labels", default="labels_item.txt", help="Class labels of the layout model")
+    parser.add_argument("--item-model", required=True, help="Itemized ONNX model")
+    parser.add_argument("--item-labels", default="labels.txt", help="Class labels of the itemized model")
+    parser.add_argument("--layout-size", type=int, default=320, help="Layout input size for dynamic models")
+    parser.add_argument("--no-ocr", action="store_true", help="Only print the merged regions")
+    args = parser.parse_args()
+
+    with open(args.layout_labels, "r") as f:
+        layout_labels = f.read().splitlines()
+    with open(args.item_labels, "r") as f:
+        item_labels = f.read().splitlines()
+
+    engine = CascadeEngine(args.layout_model, layout_labels, args.item_model, item_labels,
+                           layout_size=(args.layout_size, args.layout_size))
+    if args.no_ocr:
+        print(json.dumps(engine.detect(args.image).regions, indent=2))
+    else:
+        receipt_data, _ = engine.process(args.image)
+        print(json.dumps(receipt_data, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Compile a YOLO dataset once into a training-ready form.
+
+For every split the images are letterboxed to imgsz a single time and stored as:
+    <out>/<split>/images/*.jpg   small pre-resized copies that ultralytics can read directly
+    <out>/<split>/labels/*.txt   labels mapped into the letterboxed frame
+    <out>/<split>/images.npy     uint8 [N, imgsz, imgsz, 3] BGR array, memory-mappable
+    <out>/<split>/index.npz      all labels in flat arrays, per-class counts and original image sizes
+and <out>/data.yaml points ultralytics at the compiled splits.
+
+Usage (from the YOLO_Trainer directory):
+    python dataset_compiler.py dataset/data.yaml dataset/compiled --imgsz 640
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import yaml
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+PAD_VALUE = 114  # Same gray ultralytics uses for letterbox padding
+
+
+def resolve_split_dir(yaml_path, value):
+    """
+    Resolve a split path from a dataset YAML the way ultralytics does, including the Roboflow "../" convention.
+    """
+    if os.path.isabs(value):
+        return value
+    yaml_dir = os.path.dirname(os.path.abspath(yaml_path))
+    candidate = os.path.normpath(os.path.join(yaml_dir, value))
+    if not os.path.exists(candidate) and value.startswith("../"):
+        candidate = os.path.normpath(os.path.join(yaml_dir, value[3:]))
+    return candidate
+
+
+def label_path(image_path):
+    """
+    YOLO label file of an image: the last "images" directory of its path becomes "labels", the extension ".txt".
+    """
+    head, _, tail = image_path.rpartition(f"{os.sep}images{os.sep}")
+    return os.path.splitext(os.path.join(f"{head}{os.sep}labels", tail))[0] + ".txt"
+
+
+def letterbox(image, imgsz):
+    """
+    Resize the long side to imgsz and pad to a square.
+
+    Returns:
+        np.ndarray: [imgsz, imgsz, 3] uint8 image.
+        float: Scale factor applied to the original image.
+        tuple: (pad_x, pad_y) offset of the resized image inside the square.
+    """
+    height, width = image.shape[:2]
+    scale = imgsz / max(height, width)
+    new_w, new_h = max(round(width * scale), 1), max(round(height * scale), 1)
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    resized = cv2.resize(image, (new_w, new_h), interpolation=interpolation)
+    pad_x, pad_y = (imgsz - new_w) // 2, (imgsz - new_h) // 2
+    canvas = np.full((imgsz, imgsz, 3), PAD_VALUE, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+    return canvas, scale, (pad_x, pad_y)
+
+
+def read_labels(path):
+    """
+    Read a YOLO label file.
+
+    Returns:
+        np.ndarray: [N, 5] float32 rows of class id and normalized xywh; empty if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return np.zeros((0, 5), dtype=np.float32)
+    rows = []
+    with open(path, "r") as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 5:  # Boxes only; polygon labels are skipped
+                rows.append([float(value) for value in parts])
+    return np.asarray(rows, dtype=np.float32).reshape(-1, 5)
+
+
+def compiled_name(image_path, image_dir):
+    """
+    Path of an image's compiled JPEG relative to the compiled images directory, e.g. "store_a/0001.jpg".
+
+    Relative paths (not basenames) keep images with the same name in different subdirectories apart.
+    """
+    return os.path.splitext(os.path.relpath(image_path, image_dir))[0] + ".jpg"
+
+
+def _compile_image(job):
+    row, image_path, image_dir, out_dir, images_path, imgsz = job
+    image = cv2.imread(image_path)
+    if image is None:
+        return row, None
+    height, width = image.shape[:2]
+    canvas, scale, (pad_x, pad_y) = letterbox(image, imgsz)
+
+    images = np.load(images_path, mmap_mode="r+")
+    images[row] = canvas
+    images.flush()
+    del images
+
+    name = compiled_name(image_path, image_dir)
+    compiled_image_path = os.path.join(out_dir, "images", name)
+    compiled_label_path = os.path.join(out_dir, "labels", os.path.splitext(name)[0] + ".txt")
+    os.makedirs(os.path.dirname(compiled_image_path), exist_ok=True)
+    os.makedirs(os.path.dirname(compiled_label_path), exist_ok=True)
+    cv2.imwrite(compiled_image_path, canvas, [cv2.IMWRITE_JPEG_QUALITY, 95])
+
+    # Map normalized xywh from the original frame into the letterboxed frame
+    labels = read_labels(label_path(image_path))
+    boxes = labels[:, 1:].copy()
+    boxes[:, 0] = (boxes[:, 0] * width * scale + pad_x) / imgsz
+    boxes[:, 1] = (boxes[:, 1] * height * scale + pad_y) / imgsz
+    boxes[:, 2] *= width * scale / imgsz
+    boxes[:, 3] *= height * scale / imgsz
+    with open(compiled_label_path, "w") as file:
+        file.write("\n".join(
+            f"{int(class_id)} {x:.6f} {y:.6f} {w:.6f} {h:.6f}"
+            for class_id, (x, y, w, h) in zip(labels[:, 0].tolist(), boxes.tolist())
+        ))
+    return row, (height, width, scale, pad_x, pad_y, labels[:, 0].astype(np.int64), boxes)
+
+
+def compile_split(image_dir, out_dir, imgsz=640, num_classes=None, workers=None):
+    """
+    Compile one split (e.g. train/images) into out_dir.
+
+    Args:
+        image_dir (str): Directory with the split's images; labels are expected in the sibling labels directory.
+        out_dir (str): Output directory for the compiled split.
+        imgsz (int): Square training size. Default is 640.
+        num_classes (int, optional): Number of classes for the per-class counts. Default is inferred.
+        workers (int, optional): Worker processes. Default is the number of CPU cores.
+    Returns:
+        str: Path to the compiled images directory.
+    """
+    image_paths = sorted(
+        os.path.join(root, name)
+        for root, _, files in os.walk(image_dir)
+        for name in files
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    os.makedirs(os.path.join(out_dir, "images"), exist_ok=True)
+    os.makedirs(os.path.join(out_dir, "labels"), exist_ok=True)
+
+    images_path = os.path.join(out_dir, "images.npy")
+    images = np.lib.format.open_memmap(images_path, mode="w+", dtype=np.uint8,
+                                       shape=(len(image_paths), imgsz, imgsz, 3))
+    del images  # Workers open their own writable maps
+
+    jobs = [(row, path, image_dir, out_dir, images_path, imgsz) for row, path in enumerate(image_paths)]
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for row, result in executor.map(_compile_image, jobs, chunksize=16):
+            results[row] = result
+
+    files, orig_hw, scales, pads, label_image, label_class, label_boxes = [], [], [], [], [], [], []
+    for row, (path, result) in enumerate(zip(image_paths, results)):
+        files.append(compiled_name(path, image_dir))
+        if result is None:
+            print(f"Unreadable image skipped: {path}")
+            orig_hw.append((0, 0))
+            scales.append(0.0)
+            pads.append((0, 0))
+            continue
+        height, width, scale, pad_x, pad_y, class_ids, boxes = result
+        orig_hw.append((height, width))
+        scales.append(scale)
+        pads.append((pad_x, pad_y))
+        label_image.append(np.full(len(class_ids), row, dtype=np.int64))
+        label_class.append(class_ids)
+        label_boxes.append(boxes)
+
+    label_class = np.concatenate(label_class) if label_class else np.zeros(0, dtype=np.int64)
+    num_classes = num_classes or (int(label_class.max()) + 1 if len(label_class) else 0)
+    np.savez(
+        os.path.join(out_dir, "index.npz"),
+        files=np.asarray(files),
+        orig_hw=np.asarray(orig_hw, dtype=np.int32).reshape(-1, 2),
+        scale=np.asarray(scales, dtype=np.float32),
+        pad=np.asarray(pads, dtype=np.int32).reshape(-1, 2),
+        label_image=np.concatenate(label_image) if label_image else np.zeros(0, dtype=np.int64),
+        label_class=label_class,
+        label_boxes=np.concatenate(label_boxes) if label_boxes else np.zeros((0, 4), dtype=np.float32),
+        class_counts=np.bincount(label_class, minlength=num_classes),
+        imgsz=np.int32(imgsz),
+    )
+    print(f"Compiled {len(image_paths)} images ({len(label_class)} labels) into {out_dir}")
+    return os.path.join(out_dir, "images")
+
+
+def compile_dataset(yaml_path, out_dir, imgsz=640, workers=None, splits=("train", "val", "test")):
+    """
+    Compile every split of a dataset YAML and write a YAML pointing at the compiled dataset.
+
+    Args:
+        yaml_path (str): Path to the dataset YAML (train/val/test/names).
+        out_dir (str): Output directory for the compiled dataset.
+        imgsz (int): Square training size. Default is 640.
+        workers (int, optional): Worker processes. Default is the number of CPU cores.
+        splits (tuple): Split keys to compile when present in the YAML.
+    Returns:
+        str: Path to the compiled dataset YAML.
+    """
+    with open(yaml_path, "r") as file:
+        yaml_data = yaml.safe_load(file)
+    names = yaml_data["names"]
+
+    data_config = {"names": names, "nc": len(names), "compiled": {"imgsz": imgsz, "source": os.path.abspath(yaml_path)}}
+    for split in splits:
+        if not yaml_data.get(split):
+            continue
+        image_dir = resolve_split_dir(yaml_path, yaml_data[split])
+        if not os.path.isdir(image_dir):
+            print(f"Skipping {split}: {image_dir} not found")
+            continue
+        split_dir = os.path.join(os.path.abspath(out_dir), split)
+        data_config[split] = compile_split(image_dir, split_dir, imgsz, len(names), workers)
+
+    compiled_yaml_path = os.path.join(out_dir, "data.yaml")
+    with open(compiled_yaml_path, "w") as file:
+        yaml.dump(data_config, file)
+    print(f"Compiled dataset YAML saved to: {compiled_yaml_path}")
+    return compiled_yaml_path
+
+
+def is_compiled(yaml_path):
+    """
+    Whether a dataset YAML was written by compile_dataset.
+    """
+    with open(yaml_path, "r") as file:
+        return "compiled" in (yaml.safe_load(file) or {})
+
+
+def load_split_cache(images_dir):
+    """
+    Open a compiled split's memory-mapped images and map file paths to rows.
+
+    Args:
+        images_dir (str): The compiled split's images directory (as listed in the compiled YAML).
+    Returns:
+        tuple: (images memmap, {path relative to images_dir: row}) or (None, {}) if the split was not compiled.
+            The compiled imgsz is images.shape[1].
+    """
+    split_dir = os.path.dirname(os.path.normpath(images_dir))
+    images_path = os.path.join(split_dir, "images.npy")
+    index_path = os.path.join(split_dir, "index.npz")
+    if not (os.path.exists(images_path) and os.path.exists(index_path)):
+        return None, {}
+    with np.load(index_path) as index:
+        rows = {os.path.normpath(name): row for row, name in enumerate(index["files"].tolist())}
+    return np.load(images_path, mmap_mode="r"), rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("yaml_path", help="Dataset YAML to compile")
+    parser.add_argument("out_dir", help="Output directory")
+    parser.add_argument("--imgsz", type=int, default=640, help="Square training size")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
+    compile_dataset(args.yaml_path, args.out_dir, args.imgsz, args.workers)
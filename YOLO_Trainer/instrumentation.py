@@ -0,0 +1,214 @@
+"""
+Pluggable metrics for the receipt pipeline.
+
+The pipeline reports through the object returned by get_instrumentation(). By default that is a
+NullInstrumentation whose methods do nothing, so instrumented code costs one attribute lookup and a
+no-op call. enable_instrumentation() swaps in a collecting Instrumentation with per-stage spans,
+counters and histograms that can be exported as Prometheus text or JSON lines.
+"""
+import bisect
+import json
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullInstrumentation:
+    """
+    Instrumentation that records nothing.
+    """
+    enabled = False
+
+    def span(self, name, **labels):
+        return _NULL_SPAN
+
+    def count(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+
+class _Span:
+    __slots__ = ("instrumentation", "name", "labels", "start")
+
+    def __init__(self, instrumentation, name, labels):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.instrumentation.observe("stage_seconds", elapsed, stage=self.name, **self.labels)
+        if exc_type is not None:
+            self.instrumentation.count("stage_errors_total", stage=self.name, **self.labels)
+        return False
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Instrumentation:
+    enabled = True
+
+    def __init__(self, prefix: str = "recscan", buckets: tuple = DEFAULT_BUCKETS):
+        """
+        Collecting instrumentation: spans, counters and histograms keyed by name and labels.
+
+        Args:
+            prefix (str): Prefix added to every exported metric name. Default is "recscan".
+            buckets (tuple): Upper bounds in seconds for the histogram buckets.
+        """
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, **labels):
+        """
+        Time a block of code; the duration goes to the stage_seconds histogram labelled with the stage name.
+        """
+        return _Span(self, name, labels)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def to_prometheus(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda entry: entry[0])
+            histograms = [(key, list(h.counts), h.sum, h.count) for key, h in histograms]
+
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+        for (name, labels), counts, total, count in histograms:
+            metric = f"{self.prefix}_{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} histogram")
+                declared.add(metric)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{metric}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self):
+        """
+        Render all metrics as one JSON object per line.
+        """
+        timestamp = time.time()
+        records = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                records.append({"time": timestamp, "type": "counter", "name": f"{self.prefix}_{name}",
+                                "labels": dict(labels), "value": value})
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda entry: entry[0]):
+                records.append({"time": timestamp, "type": "histogram", "name": f"{self.prefix}_{name}",
+                                "labels": dict(labels), "buckets": list(self.buckets), "counts": histogram.counts,
+                                "sum": histogram.sum, "count": histogram.count})
+        return "".join(json.dumps(record) + "\n" for record in records)
+
+    def write(self, path, export_format="prometheus"):
+        """
+        Write all metrics to a file as "prometheus" text or "jsonl" (appended).
+        """
+        if export_format == "prometheus":
+            with open(path, "w") as f:
+                f.write(self.to_prometheus())
+        elif export_format == "jsonl":
+            with open(path, "a") as f:
+                f.write(self.to_json_lines())
+        else:
+            raise ValueError(f"Unknown metrics format: {export_format}")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+_current = NullInstrumentation()
+
+
+def get_instrumentation():
+    """
+    Return the active instrumentation (a no-op NullInstrumentation unless enabled).
+    """
+    return _current
+
+
+def set_instrumentation(instrumentation):
+    global _current
+    _current = instrumentation or NullInstrumentation()
+    return _current
+
+
+def enable_instrumentation(**kwargs):
+    """
+    Install and return a collecting Instrumentation. Keyword arguments go to Instrumentation.
+    """
+    return set_instrumentation(Instrumentation(**kwargs))
+
+
+def disable_instrumentation():
+    set_instrumentation(None)
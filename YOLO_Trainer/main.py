@@ -2,6 +2,9 @@ from yolo_trainer import YOLOTrainer
 from ultralytics import YOLO
 import os
 import cv2
+import numpy as np
+
+from row_assembly import assemble_rows, row_crops
 
 def get_yaml_path(yaml_file_name:str):
     # Get the current working directory dynamically
@@ -88,83 +91,41 @@ def inference_item_receipt():
     # train_itemized_model(yaml_file_name="item_price_data.yaml")
     # inference_item_receipt()
 
-def organize_crop_receipt_bboxes():
-    # label - 0 (item), 3 (price)
-    # Example format: (label, [x_center, y_center, width, height])
-    # Initialize containers for items and prices
-    items = []
-    prices = []
-    # Open the file and parse line by line
-    with open("item_receipt.txt", "r") as file:
-        lines = file.readlines()
-        for line in lines:
-            parts = line.split()
-
-            # Ensure we are correctly unpacking the values
-            if len(parts) == 5:  # Make sure there are exactly 5 elements in each line
-                class_id = int(parts[0])
-                x_center, y_center, box_width, box_height = map(float, parts[1:])
-                
-                # Append the parsed data as a flat tuple
-                if class_id == 3:  # Price
-                    prices.append((class_id, x_center, y_center, box_width, box_height))
-                elif class_id == 0:  # Item
-                    items.append((class_id, x_center, y_center, box_width, box_height))
-
-    # Sort items and prices by y_center (vertical position)
-    sorted_items = sorted(items, key=lambda x: x[2])  # Sort by y_center (index 2)
-    sorted_prices = sorted(prices, key=lambda x: x[2])  # Sort by y_center (index 2)
-    # print(type(items))
-    # print("Items:", items)
-    # print("Prices:", prices)
+def organize_crop_receipt_bboxes(label_path: str = "item_receipt.txt", image_path: str = "item_receipt.png",
+                                 labels_path: str = "labels.txt"):
+    """
+    Group the itemized detections of a receipt into rows (item, quantity, price, sub price) and crop them
+    in memory so the rows can go straight to OCR.
+
+    Args:
+        label_path (str): YOLO-format detections (class x_center y_center width height, normalized).
+        image_path (str): The receipt image the detections belong to.
+        labels_path (str): Class labels of the itemized model.
+    Returns:
+        list: Rows from top to bottom, see row_assembly.assemble_rows.
+        list: Per row, a dict mapping each label to array views of its crops.
+    """
+    with open(labels_path, "r") as file:
+        labels = file.read().splitlines()
+
+    # Parse the detections in one go: rows of (class_id, x_center, y_center, width, height)
+    detections = np.loadtxt(label_path, ndmin=2, usecols=range(5)).reshape(-1, 5)
 
     # Load the receipt image
-    image_path = "item_receipt.png"  # Replace with your receipt image path
     image = cv2.imread(image_path)
     height, width, _ = image.shape
 
-    # Parse the bounding box data
-    bounding_boxes = []
-    bounding_boxes.extend(sorted_items)
-    bounding_boxes.extend(sorted_prices)
-
-    # Debug print to ensure bounding_boxes is correct
-    print("Bounding Boxes:", bounding_boxes)
-    # Create folders to save cropped items and prices
-    import os
-    os.makedirs("cropped_items", exist_ok=True)
-    os.makedirs("cropped_prices", exist_ok=True)
-
-    # Crop items and prices
-    item_count = 1
-    price_count = 1
-
-    # Iterate through bounding boxes and crop
-    for class_id, x_center, y_center, box_width, box_height in bounding_boxes:
-        # Convert normalized coordinates to pixel values
-        x_center_pixel = int(x_center * width)
-        y_center_pixel = int(y_center * height)
-        box_width_pixel = int(box_width * width)
-        box_height_pixel = int(box_height * height)
-
-        # Calculate top-left and bottom-right corners
-        x1 = max(0, x_center_pixel - box_width_pixel // 2)
-        y1 = max(0, y_center_pixel - box_height_pixel // 2)
-        x2 = min(width, x_center_pixel + box_width_pixel // 2)
-        y2 = min(height, y_center_pixel + box_height_pixel // 2)
-
-        # Crop the region
-        cropped_region = image[y1:y2, x1:x2]
-
-        # Save the cropped region based on class ID
-        if class_id == 0:  # Item
-            cv2.imwrite(f"cropped_items/Item_{item_count}.jpg", cropped_region)
-            item_count += 1
-        elif class_id == 3:  # Price
-            cv2.imwrite(f"cropped_prices/Price_{price_count}.jpg", cropped_region)
-            price_count += 1
-
-    print("Cropping completed. Check 'cropped_items' and 'cropped_prices' folders.")
+    # Convert normalized xywh to pixel xyxy
+    centers = detections[:, 1:3] * (width, height)
+    sizes = detections[:, 3:5] * (width, height)
+    boxes = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=1)
+
+    rows = assemble_rows(boxes, detections[:, 0].astype(np.int64), labels)
+    crops = row_crops(image, boxes, rows)
+    for number, row in enumerate(rows, 1):
+        fields = ", ".join(f"{label} x{len(indices)}" for label, indices in row.items() if label != "box")
+        print(f"Row {number}: {fields}")
+    return rows, crops
 
 #organize_crop_receipt_bboxes()
 train_entire_receipt_model()
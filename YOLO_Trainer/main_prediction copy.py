@@ -11,4 +11,4 @@ if __name__ == "__main__":
     detection_model = fr"C:\Users\USER\Desktop\FINAL_PROJECT\project_recscan\YOLO_Trainer\model\train15\weights\best.onnx"
 
     model = YOLOTrainer(model_path=detection_model)
-    result=model.predict(image_path=image_path,save_results=True,save_crop=True)
+    result=model.predict(source=image_path,save_results=True,save_crop=True)
@@ -1,112 +1,246 @@
-import cv2
+import datetime
+import io
+import logging
+import re
+
 import numpy as np
-import pytesseract
 from PIL import Image, ImageDraw, ImageEnhance
-import onnxruntime as ort
 
+from adaptive import EscalationPolicy, detect_adaptive
+from batching import MicroBatcher
+from instrumentation import get_instrumentation
+from ocr_backend import get_ocr_pool, pool_settings
+from receipt_detector import ReceiptDetector, get_detector
+from result_cache import bytes_digest, detection_key, model_digest, ocr_key
+from spatial_index import assign_words_to_regions
+from tiling import detect_tiled
+
+logger = logging.getLogger(__name__)
 
-def preprocess_image(image_path, input_size=(640, 640)):
+
+def preprocess_image(image_path, input_size=(640, 640), fast=False, out=None):
     """
     Preprocess the image for RGB input.
     Args:
         image_path (str): Path to the receipt image.
         input_size (tuple): The size to resize the image to (width, height).
+        fast (bool): Decode JPEGs directly to grayscale, build the model input from an integer reduction of the
+            decode and write it into a float32 buffer without per-channel copies. The returned image is still
+            the full-resolution enhanced image, so detection boxes and OCR crops keep their resolution.
+            Default is False.
+        out (np.ndarray, optional): Preallocated [1, 3, H, W] float32 buffer reused by the fast mode.
     Returns:
         np.ndarray: Preprocessed image ready for model input.
         PIL.Image: Original image for later use.
     """
-    img = Image.open(image_path).convert("L")  # Convert to grayscale
-    enhancer = ImageEnhance.Contrast(img)
-    img = enhancer.enhance(2)  # Enhance contrast
-    img_resized = img.resize(input_size)  # Resize image to model input size
-
-    # Convert grayscale to 3-channel RGB by duplicating the single channel
-    img_np = np.asarray(img_resized, dtype="float32") / 255.0  # Normalize to [0, 1]
-    img_np = np.stack([img_np, img_np, img_np], axis=-1)  # Convert 1-channel to 3-channel RGB
-    img_np = np.transpose(img_np, (2, 0, 1))  # Convert HWC to CHW
-    img_np = np.expand_dims(img_np, axis=0)  # Add batch dimension
+    if fast:
+        return _preprocess_image_fast(image_path, input_size, out)
+
+    metrics = get_instrumentation()
+    with metrics.span("decode"):
+        img = Image.open(image_path).convert("L")  # Convert to grayscale
+    with metrics.span("preprocess"):
+        enhancer = ImageEnhance.Contrast(img)
+        img = enhancer.enhance(2)  # Enhance contrast
+        img_resized = img.resize(input_size)  # Resize image to model input size
+
+        # Convert grayscale to 3-channel RGB by duplicating the single channel
+        img_np = np.asarray(img_resized, dtype="float32") / 255.0  # Normalize to [0, 1]
+        img_np = np.stack([img_np, img_np, img_np], axis=-1)  # Convert 1-channel to 3-channel RGB
+        img_np = np.transpose(img_np, (2, 0, 1))  # Convert HWC to CHW
+        img_np = np.expand_dims(img_np, axis=0)  # Add batch dimension
 
     return img_np, img
 
 
-def detect_regions_with_nms(image_path, detection_model, labels, conf_threshold=0.1, iou_threshold=0.5):
+def _preprocess_image_fast(image_path, input_size, out):
+    width, height = input_size
+    if out is None or out.shape != (1, 3, height, width):
+        out = np.empty((1, 3, height, width), dtype=np.float32)
+
+    metrics = get_instrumentation()
+    with metrics.span("decode"):
+        img = Image.open(image_path)
+        # Decode JPEGs straight to grayscale at full scale (no RGB pass); OCR needs every pixel
+        img.draft("L", img.size)
+        img = img.convert("L")
+    with metrics.span("preprocess"):
+        # The model input comes from a cheap integer box-filter reduction that still covers input_size
+        factor = max(min(img.width // width, img.height // height), 1)
+        small = img.reduce(factor) if factor > 1 else img
+        img_resized = ImageEnhance.Contrast(small).enhance(2).resize(input_size)
+
+        # One pass: uint8 -> float32 [0, 1], the [H, W] plane broadcast into all 3 channels of the buffer
+        np.divide(np.asarray(img_resized), np.float32(255), out=out[0], casting="unsafe")
+        img = ImageEnhance.Contrast(img).enhance(2)  # Full-resolution image for OCR, as in the default path
+    return out, img
+
+
+def preprocess_batch(images, input_size=(640, 640), out=None):
+    """
+    Preprocess several images into one stacked model input.
+    Args:
+        images (list): Paths to the receipt images, or PIL images.
+        input_size (tuple): The size to resize the images to (width, height).
+        out (np.ndarray, optional): Preallocated float32 buffer of shape [M, 3, H, W] with M >= len(images),
+            reused across calls. A new buffer is allocated if omitted or too small.
+    Returns:
+        np.ndarray: [N, 3, H, W] view of the buffer, ready for model input.
+        list: Original (grayscale, contrast-enhanced) PIL images for later use.
+    """
+    width, height = input_size
+    count = len(images)
+    if out is None or out.shape[0] < count or out.shape[1:] != (3, height, width):
+        out = np.empty((count, 3, height, width), dtype=np.float32)
+
+    metrics = get_instrumentation()
+    originals = []
+    for i, image in enumerate(images):
+        with metrics.span("decode"):
+            img = image if isinstance(image, Image.Image) else Image.open(image)
+            img = img.convert("L")
+        with metrics.span("preprocess"):
+            img = ImageEnhance.Contrast(img).enhance(2)  # Grayscale + contrast, as in preprocess_image
+            img_resized = img.resize(input_size)
+
+            # Normalize straight into the buffer; the [H, W] plane broadcasts across all 3 channels
+            np.divide(np.asarray(img_resized), np.float32(255), out=out[i], casting="unsafe")
+        originals.append(img)
+
+    return out[:count], originals
+
+
+def detect_regions_with_nms(image_path, detection_model, labels, conf_threshold=0.1, iou_threshold=0.5,
+                            fast_preprocess=False, tiled=False, adaptive=False):
     """
     Detect regions of interest using the ONNX model with manual NMS.
     Args:
         image_path (str): Path to the receipt image.
-        detection_model (str): Path to the ONNX object detection model.
+        detection_model (str | ReceiptDetector): Path to the ONNX object detection model, or a detector instance.
         labels (list): List of class labels.
         conf_threshold (float): Confidence threshold for filtering detections.
         iou_threshold (float): IOU threshold for NMS.
+        fast_preprocess (bool): Use the reduced-resolution decode of preprocess_image. Default is False.
+        tiled (bool): Cut long receipts into overlapping square tiles, run them as one batch and merge the boxes
+            across tiles (see tiling.py). Receipts up to 1.5:1 still take a single pass. Ignores fast_preprocess.
+            Default is False.
+        adaptive (bool | EscalationPolicy): Run a 320 px pass first and escalate to the full input size (or tiles)
+            only when the policy rejects its result; see adaptive.py. True uses the default EscalationPolicy.
+            Needs a model exported with dynamic spatial axes. Default is False.
     Returns:
-        list: Detected regions with labels and bounding boxes.
+        Detections: Boxes, scores and class ids of the detected regions.
+        PIL.Image: Original image for later use.
     """
-    # Load the ONNX model
-    session = ort.InferenceSession(detection_model)
+    # Reuse the long-lived session for this model instead of rebuilding it per call
+    detector = detection_model if isinstance(detection_model, ReceiptDetector) else get_detector(detection_model)
+
+    if tiled or adaptive:
+        metrics = get_instrumentation()
+        with metrics.span("decode"):
+            img = Image.open(image_path).convert("L")
+        with metrics.span("preprocess"):
+            original_img = ImageEnhance.Contrast(img).enhance(2)  # Passes are resized from the full-resolution image
+        if adaptive:
+            policy = adaptive if isinstance(adaptive, EscalationPolicy) else None
+            detections, _ = detect_adaptive(detector, original_img, labels, policy, conf_threshold=conf_threshold,
+                                            iou_threshold=iou_threshold)
+        else:
+            detections, _ = detect_tiled(detector, original_img, len(labels), conf_threshold, iou_threshold)
+        return detections, original_img
 
     # Preprocess the image
-    input_data, original_img = preprocess_image(image_path)
-    input_name = session.get_inputs()[0].name
-    output_name = session.get_outputs()[0].name
-
-    # Run inference
-    detections = session.run([output_name], {input_name: input_data})[0]
-    print("Raw Detections Output Shape:", detections.shape)
-
-    # Process YOLO grid output (assuming no NMS applied)
-    boxes, confidences, class_ids = [], [], []
-    for detection in detections[0]:
-        x_center, y_center, width, height, conf = detection[:5]
-        scores = detection[5:]
-        class_id = np.argmax(scores)
-        confidence = scores[class_id] * conf
-
-        if confidence > conf_threshold:
-            x1 = int((x_center - width / 2) * original_img.width)
-            y1 = int((y_center - height / 2) * original_img.height)
-            x2 = int((x_center + width / 2) * original_img.width)
-            y2 = int((y_center + height / 2) * original_img.height)
-
-            boxes.append([x1, y1, x2, y2])
-            confidences.append(float(confidence))
-            class_ids.append(class_id)
-
-    # Apply Non-Maximum Suppression (NMS)
-    indices = cv2.dnn.NMSBoxes(boxes, confidences, conf_threshold, iou_threshold)
-    detected_regions = []
-    for i in indices.flatten():
-        detected_regions.append({
-            "label": labels[class_ids[i]],
-            "confidence": confidences[i],
-            "box": boxes[i]
-        })
-
-    return detected_regions, original_img
-
-
-def extract_text_from_regions(image, regions):
+    input_data, original_img = preprocess_image(image_path, input_size=detector.input_size, fast=fast_preprocess)
+
+    # Run inference, then decode the whole output at once and apply class-aware NMS
+    detections = detector.detect(
+        input_data,
+        image_size=original_img.size,
+        num_classes=len(labels),
+        conf_threshold=conf_threshold,
+        iou_threshold=iou_threshold,
+    )
+
+    return detections, original_img
+
+
+def ocr_crops(pixels, regions, ocr_pool):
+    """
+    Recognize the text of each region's crop.
+
+    Args:
+        pixels (np.ndarray): The receipt image as an array; crops are views of it, recognized in parallel.
+        regions (list): Regions with a "box" [x1, y1, x2, y2] in pixel coordinates.
+        ocr_pool (OCREnginePool): Pool of persistent OCR engines.
+    Returns:
+        list: Text of each region, "" for empty boxes.
+    """
+    crops = [pixels[box[1]:box[3], box[0]:box[2]] for box in (region["box"] for region in regions)]
+    non_empty = [i for i, crop in enumerate(crops) if crop.size]
+    texts = [""] * len(crops)
+    for i, text in zip(non_empty, ocr_pool.recognize([crops[i] for i in non_empty])):
+        texts[i] = text
+    return texts
+
+
+def _ocr_page(pixels, regions, ocr_pool):
+    # One OCR pass over the whole page, then each word goes to the region covering most of it
+    words = ocr_pool.recognize_page(pixels)
+    assignments = assign_words_to_regions(words.boxes, [region["box"] for region in regions])
+    region_words = [[] for _ in regions]
+    for word_index, region_index in enumerate(assignments.tolist()):
+        if region_index >= 0:
+            region_words[region_index].append(word_index)
+
+    texts = []
+    for word_indices in region_words:
+        lines = []
+        previous_line = None
+        for word_index in word_indices:  # Already in tesseract reading order
+            line_id = words.line_ids[word_index]
+            if line_id != previous_line:
+                lines.append([])
+                previous_line = line_id
+            lines[-1].append(words.texts[word_index])
+        texts.append("\n".join(" ".join(line) for line in lines))
+    return texts
+
+
+def extract_text_from_regions(image, regions, ocr_pool=None, mode="crop"):
     """
     Extract text from detected regions using OCR.
     Args:
         image (PIL.Image): The original receipt image.
         regions (list): Detected regions with bounding boxes and labels.
+        ocr_pool (OCREnginePool, optional): Pool of persistent OCR engines. Default is the shared pool.
+        mode (str): "crop" runs OCR once per region in parallel; "page" runs OCR once on the whole image and
+            assigns the words to regions, so overlapping regions never OCR the same pixels twice. Default is "crop".
     Returns:
         dict: Extracted text for each region.
     """
-    extracted_data = {"Items": [], "Total": None, "Address": None}
+    extracted_data = {"Items": [], "Total": None, "Address": None, "Date": None, "Title": None}
+    ocr_pool = ocr_pool or get_ocr_pool()
+
+    pixels = np.asarray(image)
+    if mode == "crop":
+        texts = ocr_crops(pixels, regions, ocr_pool)
+    elif mode == "page":
+        texts = _ocr_page(pixels, regions, ocr_pool)
+    else:
+        raise ValueError(f"Unknown OCR mode: {mode}")
 
-    for region in regions:
-        box = region["box"]
-        cropped_img = image.crop((box[0], box[1], box[2], box[3]))
-        text = pytesseract.image_to_string(cropped_img).strip()
-        print(f"Extracted Text for {region['label']}: {text}")  # Debugging
+    metrics = get_instrumentation()
+    for region, text in zip(regions, texts):
+        logger.debug("Extracted Text for %s: %s", region["label"], text)
+        metrics.count("detections_total", label=region["label"])
+        if not text:
+            metrics.count("ocr_failures_total", label=region["label"], reason="empty")
 
         if region["label"] == "Item":
             extracted_data["Items"].append(text)
-        elif region["label"] == "Total":
+        elif region["label"] in ("Total", "TotalPrice"):
             extracted_data["Total"] = text
-        elif region["label"] == "Address":
-            extracted_data["Address"] = text
+        elif region["label"] in ("Address", "Date", "Title"):
+            extracted_data[region["label"]] = text
 
     return extracted_data
 
@@ -122,57 +256,196 @@ def parse_receipt_data(extracted_data):
     items = []
     total = None
 
-    # Process items
-    for item_text in extracted_data["Items"]:
-        try:
-            name, price = item_text.rsplit(" ", 1)  # Split text into name and price
-            price = float(price.replace(",", "."))
-            items.append({"name": name, "price": price})
-        except ValueError:
-            continue  # Skip invalid items
-
-    # Process total
-    if extracted_data["Total"]:
-        try:
-            total = float(extracted_data["Total"].replace(",", "."))
-        except ValueError:
-            pass
-
-    return {"items": items, "total": total, "address": extracted_data["Address"]}
-
-
-def process_receipt(image_path, detection_model, labels, conf_threshold=0.1):
+    metrics = get_instrumentation()
+    with metrics.span("parse"):
+        # Process items
+        for item_text in extracted_data["Items"]:
+            try:
+                name, price = item_text.rsplit(" ", 1)  # Split text into name and price
+                price = float(price.replace(",", "."))
+                items.append({"name": name, "price": price})
+            except ValueError:
+                metrics.count("parse_failures_total", field="item")
+                continue  # Skip invalid items
+
+        # Process total
+        if extracted_data["Total"]:
+            try:
+                total = float(extracted_data["Total"].replace(",", "."))
+            except ValueError:
+                metrics.count("parse_failures_total", field="total")
+
+        # Cached OCR results from before Date/Title were extracted lack those keys
+        date = _parse_date(extracted_data.get("Date"))
+        if extracted_data.get("Date") and date is None:
+            metrics.count("parse_failures_total", field="date")
+
+    return {"items": items, "total": total, "address": extracted_data["Address"], "date": date,
+            "store": extracted_data.get("Title") or None}
+
+
+_DATE_PATTERNS = (
+    (re.compile(r"(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})"), ("year", "month", "day")),
+    (re.compile(r"(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})"), ("day", "month", "year")),
+    (re.compile(r"(\d{1,2})[-/.](\d{1,2})[-/.](\d{2})(?!\d)"), ("day", "month", "year")),
+)
+
+
+def _parse_date(text):
+    """
+    Read the first day-first (or ISO) date in an OCR string, e.g. "Date: 12/03/2024 14:05", as "YYYY-MM-DD".
+    Returns None when there is no valid date.
+    """
+    if not text:
+        return None
+    for pattern, fields in _DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            parts = dict(zip(fields, (int(value) for value in match.groups())))
+            if parts["year"] < 100:
+                parts["year"] += 2000
+            try:
+                return datetime.date(**parts).isoformat()
+            except ValueError:
+                continue
+    return None
+
+
+def process_receipt(image_path, detection_model, labels, conf_threshold=0.1, ocr_mode="crop", fast_preprocess=False,
+                    cache=None, ocr_pool=None):
     """
     Full receipt processing pipeline: detection, OCR, and parsing.
     Args:
         image_path (str): Path to the receipt image.
-        detection_model (str): Path to the ONNX object detection model.
+        detection_model (str | ReceiptDetector): Path to the ONNX object detection model, or a detector instance.
         labels (list): List of class labels.
         conf_threshold (float): Confidence threshold for filtering detections.
+        ocr_mode (str): "crop" or "page", see extract_text_from_regions. Default is "crop".
+        fast_preprocess (bool): Use the reduced-resolution decode of preprocess_image. Default is False.
+        cache (ResultCache, optional): Content-addressed cache for the detections and OCR text. Parsing always
+            runs, so parser changes take effect on cached receipts. Default is None.
+        ocr_pool (OCREnginePool, optional): Pool of persistent OCR engines; its settings are part of the cache
+            key. Default is the shared pool.
     Returns:
         dict: Parsed receipt data.
     """
+    if cache is not None:
+        extracted_data = _cached_extract(image_path, detection_model, labels, conf_threshold, ocr_mode,
+                                         fast_preprocess, cache, ocr_pool=ocr_pool)
+        return parse_receipt_data(extracted_data)
+
     # Step 1: Detect regions
-    detected_regions, original_img = detect_regions_with_nms(image_path, detection_model, labels, conf_threshold)
-    print("Detected Regions:", detected_regions)
+    detections, original_img = detect_regions_with_nms(
+        image_path, detection_model, labels, conf_threshold, fast_preprocess=fast_preprocess
+    )
+    detected_regions = detections.to_regions(labels)
+    logger.debug("Detected Regions: %s", detected_regions)
 
     # Step 2: Extract text from regions
-    extracted_data = extract_text_from_regions(original_img, detected_regions)
-    print("Extracted Text:", extracted_data)
+    extracted_data = extract_text_from_regions(original_img, detected_regions, ocr_pool, mode=ocr_mode)
+    logger.debug("Extracted Text: %s", extracted_data)
 
     # Step 3: Parse receipt data
     receipt_data = parse_receipt_data(extracted_data)
     return receipt_data
 
 
+def _cached_extract(image_path, detection_model, labels, conf_threshold, ocr_mode, fast_preprocess, cache,
+                    iou_threshold=0.5, ocr_pool=None):
+    detector = detection_model if isinstance(detection_model, ReceiptDetector) else get_detector(detection_model)
+    if isinstance(image_path, (bytes, bytearray)):
+        data = bytes(image_path)
+    elif hasattr(image_path, "read"):
+        data = image_path.read()
+    else:
+        with open(image_path, "rb") as f:
+            data = f.read()
+
+    detections_key = detection_key(bytes_digest(data), model_digest(detector.model_path), labels, conf_threshold,
+                                   iou_threshold, detector.input_size, fast_preprocess)
+    text_key = ocr_key(detections_key, ocr_mode, pool_settings(ocr_pool))
+    extracted_data = cache.get("ocr", text_key)
+    if extracted_data is not None:
+        return extracted_data
+
+    detected_regions = cache.get("detections", detections_key)
+    if detected_regions is None:
+        detections, original_img = detect_regions_with_nms(
+            io.BytesIO(data), detector, labels, conf_threshold, iou_threshold, fast_preprocess=fast_preprocess
+        )
+        detected_regions = detections.to_regions(labels)
+        cache.put("detections", detections_key, detected_regions)
+    else:
+        # Cached boxes refer to the image preprocess_image returns, so decode it the same way
+        _, original_img = preprocess_image(io.BytesIO(data), input_size=detector.input_size, fast=fast_preprocess)
+    logger.debug("Detected Regions: %s", detected_regions)
+
+    extracted_data = extract_text_from_regions(original_img, detected_regions, ocr_pool, mode=ocr_mode)
+    cache.put("ocr", text_key, extracted_data)
+    logger.debug("Extracted Text: %s", extracted_data)
+    return extracted_data
+
+
+def process_receipts(image_paths, detection_model, labels, conf_threshold=0.1, batch_size=8, ocr_mode="crop"):
+    """
+    Batched receipt processing pipeline: one session call per batch of images, then OCR and parsing per image.
+    Args:
+        image_paths (list): Paths to the receipt images, or PIL images.
+        detection_model (str | ReceiptDetector): Path to the ONNX object detection model, or a detector instance.
+            Export with YOLOTrainer.export_model(dynamic=True) so a whole batch runs in a single call.
+        labels (list): List of class labels.
+        conf_threshold (float): Confidence threshold for filtering detections.
+        batch_size (int): Number of images stacked into one inference call. Default is 8.
+        ocr_mode (str): "crop" or "page", see extract_text_from_regions. Default is "crop".
+    Returns:
+        list: Parsed receipt data for each image, in input order.
+    """
+    detector = detection_model if isinstance(detection_model, ReceiptDetector) else get_detector(detection_model)
+    width, height = detector.input_size
+    buffer = np.empty((min(batch_size, len(image_paths)), 3, height, width), dtype=np.float32)
+
+    receipts = []
+    for start in range(0, len(image_paths), batch_size):
+        input_data, originals = preprocess_batch(image_paths[start:start + batch_size], detector.input_size, buffer)
+        batch_detections = detector.detect_batch(
+            input_data,
+            image_sizes=[img.size for img in originals],
+            num_classes=len(labels),
+            conf_threshold=conf_threshold,
+        )
+        for detections, original_img in zip(batch_detections, originals):
+            extracted_data = extract_text_from_regions(original_img, detections.to_regions(labels), mode=ocr_mode)
+            receipts.append(parse_receipt_data(extracted_data))
+    return receipts
+
+
+def create_receipt_batcher(detection_model, labels, conf_threshold=0.1, batch_size=8, timeout=0.05):
+    """
+    Create a MicroBatcher that groups individually submitted receipts into batched pipeline runs.
+    Args:
+        detection_model (str | ReceiptDetector): Path to the ONNX object detection model, or a detector instance.
+        labels (list): List of class labels.
+        conf_threshold (float): Confidence threshold for filtering detections.
+        batch_size (int): Maximum number of receipts per batch. Default is 8.
+        timeout (float): Seconds before a partial batch is flushed. Default is 0.05.
+    Returns:
+        MicroBatcher: Call submit(image_path) to get a Future of the parsed receipt data.
+    """
+    def run_batch(image_paths):
+        return process_receipts(image_paths, detection_model, labels, conf_threshold, batch_size)
+
+    return MicroBatcher(run_batch, batch_size=batch_size, timeout=timeout)
+
+
 # Example Usage
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)  # Use logging.DEBUG to see the detected regions and OCR text
+
     # Paths to resources
     image_path = "receipt.jpg"  # Replace with your receipt image path
     detection_model = fr"C:\Users\USER\Desktop\FINAL_PROJECT\project_recscan\YOLO_Trainer\model\train15\weights\best.onnx"
-
-    detection_model.pred
-    labels = ["Item", "Total", "Address"]  # Define your class labels
+    # main.py writes the label files crosswise: labels_item.txt holds the classes of the train15 receipt model
+    with open("labels_item.txt", "r") as f:
+        labels = f.read().splitlines()  # Class labels the model was trained with
 
     # Process the receipt
     receipt_data = process_receipt(image_path, detection_model, labels, conf_threshold=0.1)
@@ -0,0 +1,262 @@
+"""
+Reduced-precision variants of an exported ONNX detector, with an accuracy/latency report.
+
+Variants:
+    int8     static INT8 (QDQ) calibrated on images sampled from the dataset's train split
+    dynamic  dynamic INT8: weights quantized offline, activations quantized at run time
+    fp16     float16 weights and activations with float32 inputs/outputs (mostly useful on GPU;
+             on CPU ONNX Runtime often inserts casts and runs slower than FP32)
+
+The detection head's box decoding (DFL softmax, anchor arithmetic, final concat) is kept in FP32 for
+the INT8 variants: quantizing it collapses box coordinates and class scores into one range and costs far
+more mAP than it saves time.
+"""
+import json
+import os
+import random
+import re
+import time
+
+import numpy as np
+import yaml
+
+from dataset_compiler import IMAGE_EXTENSIONS, resolve_split_dir
+
+VARIANTS = ("int8", "dynamic", "fp16")
+
+
+def _calibration_images(yaml_path, split="train", num_images=100, seed=0):
+    with open(yaml_path, "r") as file:
+        yaml_data = yaml.safe_load(file)
+    image_dir = resolve_split_dir(yaml_path, yaml_data[split])
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, files in os.walk(image_dir)
+        for name in files
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if not paths:
+        raise FileNotFoundError(f"No calibration images found in {image_dir}")
+    random.Random(seed).shuffle(paths)
+    return paths[:num_images]
+
+
+def _make_calibration_reader(image_paths, input_name, input_size):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    from main_prediction import preprocess_image
+
+    class ReceiptCalibrationReader(CalibrationDataReader):
+        """
+        Feeds calibration images through the same preprocessing the receipt pipeline uses at inference.
+        """
+        def __init__(self):
+            self._paths = iter(image_paths)
+
+        def get_next(self):
+            path = next(self._paths, None)
+            if path is None:
+                return None
+            input_data, _ = preprocess_image(path, input_size=input_size)
+            return {input_name: input_data}
+
+        def rewind(self):
+            self._paths = iter(image_paths)
+
+    return ReceiptCalibrationReader()
+
+
+def detect_head_decode_nodes(model):
+    """
+    Names of the nodes that decode boxes in an ultralytics Detect head (everything in the last
+    /model.N/ block except its cv2/cv3 convolution branches).
+    """
+    indices = [int(match.group(1)) for match in (re.match(r"/model\.(\d+)/", node.name) for node in model.graph.node)
+               if match]
+    if not indices:
+        return []
+    prefix = f"/model.{max(indices)}/"
+    return [node.name for node in model.graph.node
+            if node.name.startswith(prefix) and not node.name.startswith(prefix + "cv")]
+
+
+def _input_spec(model_path):
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+    model_input = session.get_inputs()[0]
+    height, width = model_input.shape[2:4]
+    return model_input.name, (width if isinstance(width, int) else 640, height if isinstance(height, int) else 640)
+
+
+def quantize_static_int8(model_path, output_path, yaml_path, num_images=100, seed=0, per_channel=True):
+    """
+    Write a static INT8 (QDQ) model calibrated on images from the dataset.
+
+    Args:
+        model_path (str): FP32 ONNX model.
+        output_path (str): Path for the INT8 model.
+        yaml_path (str): Dataset YAML whose train split supplies the calibration images.
+        num_images (int): Number of calibration images sampled. Default is 100.
+        seed (int): Seed for sampling the calibration images. Default is 0.
+        per_channel (bool): Quantize convolution weights per output channel. Default is True.
+    Returns:
+        str: The output path.
+    """
+    import onnx
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+
+    input_name, input_size = _input_spec(model_path)
+    reader = _make_calibration_reader(_calibration_images(yaml_path, num_images=num_images, seed=seed),
+                                      input_name, input_size)
+    quantize_static(
+        model_path,
+        output_path,
+        reader,
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=per_channel,
+        calibrate_method=CalibrationMethod.MinMax,
+        nodes_to_exclude=detect_head_decode_nodes(onnx.load(model_path)),
+    )
+    return output_path
+
+
+def quantize_dynamic_int8(model_path, output_path):
+    """
+    Write a dynamically quantized INT8 model (no calibration data needed).
+    """
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(model_path, output_path, weight_type=QuantType.QUInt8,
+                     nodes_to_exclude=detect_head_decode_nodes(onnx.load(model_path)))
+    return output_path
+
+
+def convert_fp16(model_path, output_path):
+    """
+    Write a float16 model that still takes and returns float32 tensors.
+    """
+    import onnx
+    from onnxruntime.transformers.float16 import convert_float_to_float16
+
+    model = convert_float_to_float16(onnx.load(model_path), keep_io_types=True)
+    onnx.save(model, output_path)
+    return output_path
+
+
+def measure_latency(model_path, runs=20, intra_op_num_threads=0):
+    """
+    CPU latency of one forward pass at the model's input size.
+
+    Returns:
+        dict: Median and p95 latency in milliseconds.
+    """
+    from receipt_detector import ReceiptDetector
+
+    detector = ReceiptDetector(model_path, intra_op_num_threads=intra_op_num_threads, warmup_runs=3)
+    width, height = detector.input_size
+    input_data = np.random.default_rng(0).random((detector.fixed_batch or 1, 3, height, width), dtype=np.float32)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        detector.run(input_data)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"latency_ms_p50": float(np.percentile(timings, 50)), "latency_ms_p95": float(np.percentile(timings, 95))}
+
+
+def validate_map(model_path, yaml_path, imgsz=640):
+    """
+    mAP of an ONNX model on the dataset's val split, using ultralytics validation.
+    """
+    from ultralytics import YOLO
+
+    results = YOLO(model_path, task="detect").val(data=yaml_path, imgsz=imgsz, batch=1, device="cpu", plots=False,
+                                                  verbose=False)
+    return {"map50": float(results.box.map50), "map50_95": float(results.box.map)}
+
+
+def build_variants(model_path, yaml_path, variants=("int8",), calibration_images=100, imgsz=640, validate=True,
+                   latency_runs=20):
+    """
+    Build reduced-precision variants next to an FP32 ONNX model and compare them with it.
+
+    A report is written next to the model as <stem>_quantization_report.json and .md.
+
+    Args:
+        model_path (str): FP32 ONNX model.
+        yaml_path (str): Dataset YAML for calibration (train split) and validation (val split).
+        variants (tuple): Any of "int8", "dynamic" and "fp16". Default is ("int8",).
+        calibration_images (int): Number of calibration images for the static INT8 variant. Default is 100.
+        imgsz (int): Validation image size. Default is 640.
+        validate (bool): Measure mAP on the val split. Default is True.
+        latency_runs (int): Timed forward passes per model. Default is 20.
+    Returns:
+        dict: {variant: path}, including "fp32" for the baseline.
+        dict: The report, one entry per variant.
+    """
+    unknown = set(variants) - set(VARIANTS)
+    if unknown:
+        raise ValueError(f"Unknown quantization variants: {sorted(unknown)}")
+
+    stem, _ = os.path.splitext(model_path)
+    paths = {"fp32": model_path}
+    for variant in variants:
+        output_path = f"{stem}_{variant}.onnx"
+        print(f"Building {variant} variant: {output_path}")
+        if variant == "int8":
+            quantize_static_int8(model_path, output_path, yaml_path, num_images=calibration_images)
+        elif variant == "dynamic":
+            quantize_dynamic_int8(model_path, output_path)
+        else:
+            convert_fp16(model_path, output_path)
+        paths[variant] = output_path
+
+    report = {}
+    for variant, path in paths.items():
+        entry = {"path": path, "size_mb": os.path.getsize(path) / 2 ** 20}
+        try:
+            entry.update(measure_latency(path, runs=latency_runs))
+        except Exception as exc:  # e.g. an operator without an INT8/FP16 CPU kernel
+            entry["error"] = f"latency: {exc!r}"
+        if validate and "error" not in entry:
+            try:
+                entry.update(validate_map(path, yaml_path, imgsz=imgsz))
+            except Exception as exc:
+                entry["error"] = f"validation: {exc!r}"
+        report[variant] = entry
+
+    baseline = report["fp32"]
+    for entry in report.values():
+        if "latency_ms_p50" in entry and "latency_ms_p50" in baseline:
+            entry["speedup"] = baseline["latency_ms_p50"] / entry["latency_ms_p50"]
+        if "map50_95" in entry and "map50_95" in baseline:
+            entry["map50_95_delta"] = entry["map50_95"] - baseline["map50_95"]
+
+    write_report(report, f"{stem}_quantization_report")
+    return paths, report
+
+
+def write_report(report, path_stem):
+    """
+    Write the report as JSON and as a Markdown table, and print the table.
+    """
+    with open(f"{path_stem}.json", "w") as file:
+        json.dump(report, file, indent=2)
+
+    columns = [("size_mb", "Size (MB)", "{:.1f}"), ("latency_ms_p50", "p50 (ms)", "{:.1f}"),
+               ("latency_ms_p95", "p95 (ms)", "{:.1f}"), ("speedup", "Speedup", "{:.2f}x"),
+               ("map50", "mAP50", "{:.4f}"), ("map50_95", "mAP50-95", "{:.4f}"),
+               ("map50_95_delta", "ΔmAP50-95", "{:+.4f}")]
+    lines = ["| Variant | " + " | ".join(title for _, title, _ in columns) + " | Notes |",
+             "|---" * (len(columns) + 2) + "|"]
+    for variant, entry in report.items():
+        cells = [fmt.format(entry[key]) if key in entry else "-" for key, _, fmt in columns]
+        lines.append(f"| {variant} | " + " | ".join(cells) + f" | {entry.get('error', '')} |")
+    table = "\n".join(lines) + "\n"
+    with open(f"{path_stem}.md", "w", encoding="utf-8") as file:
+        file.write(table)
+    print(table)
+    print(f"Quantization report saved to: {path_stem}.json")
@@ -0,0 +1,297 @@
+import importlib.util
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from instrumentation import get_instrumentation
+
+
+class Words(NamedTuple):
+    """
+    Word-level OCR output for one page, in tesseract reading order.
+
+    Attributes:
+        texts (list): Recognized word strings.
+        boxes (np.ndarray): float32 array of shape [W, 4] in (x1, y1, x2, y2) pixel coordinates.
+        line_ids (np.ndarray): int64 array of shape [W]; words on the same text line share an id.
+    """
+    texts: list
+    boxes: np.ndarray
+    line_ids: np.ndarray
+
+
+class TesserocrEngine:
+    def __init__(self, lang: str = "eng", config: str = ""):
+        """
+        In-process tesseract engine. The language data is loaded once and reused for every crop.
+
+        Args:
+            lang (str): Tesseract language code. Default is "eng".
+            config (str): Extra "name=value" tesseract variables separated by spaces. Default is "".
+        """
+        import tesserocr
+
+        self.tesserocr = tesserocr
+        self.api = tesserocr.PyTessBaseAPI(lang=lang)
+        for option in config.split():
+            name, _, value = option.partition("=")
+            self.api.SetVariable(name, value)
+
+    def recognize(self, crop):
+        self.api.SetImage(_to_pil(crop))
+        return self.api.GetUTF8Text().strip()
+
+    def recognize_words(self, image):
+        self.api.SetImage(_to_pil(image))
+        self.api.Recognize()
+        texts, boxes, line_ids = [], [], []
+        line_id = -1
+        iterator = self.api.GetIterator()
+        word_level, line_level = self.tesserocr.RIL.WORD, self.tesserocr.RIL.TEXTLINE
+        for word in self.tesserocr.iterate_level(iterator, word_level):
+            if word.IsAtBeginningOf(line_level):
+                line_id += 1
+            text = word.GetUTF8Text(word_level)
+            if text and text.strip():
+                texts.append(text.strip())
+                boxes.append(word.BoundingBox(word_level))
+                line_ids.append(line_id)
+        return _make_words(texts, boxes, line_ids)
+
+    def close(self):
+        self.api.End()
+
+
+class PytesseractEngine:
+    def __init__(self, lang: str = "eng", config: str = ""):
+        """
+        Fallback engine on top of pytesseract. Each call still starts a tesseract process, but the pool
+        runs several of them in parallel.
+        """
+        import pytesseract
+
+        self.pytesseract = pytesseract
+        self.lang = lang
+        self.config = config
+
+    def recognize(self, crop):
+        return self.pytesseract.image_to_string(_to_pil(crop), lang=self.lang, config=self.config).strip()
+
+    def recognize_words(self, image):
+        data = self.pytesseract.image_to_data(
+            _to_pil(image), lang=self.lang, config=self.config, output_type=self.pytesseract.Output.DICT
+        )
+        texts, boxes, line_ids = [], [], []
+        line_keys = {}
+        for i, text in enumerate(data["text"]):
+            if not text or not text.strip():
+                continue
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            left, top = data["left"][i], data["top"][i]
+            texts.append(text.strip())
+            boxes.append((left, top, left + data["width"][i], top + data["height"][i]))
+            line_ids.append(line_keys.setdefault(key, len(line_keys)))
+        return _make_words(texts, boxes, line_ids)
+
+    def close(self):
+        pass
+
+
+def _make_words(texts, boxes, line_ids):
+    return Words(
+        texts,
+        np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+        np.asarray(line_ids, dtype=np.int64),
+    )
+
+
+def _to_pil(crop):
+    return crop if isinstance(crop, Image.Image) else Image.fromarray(crop)
+
+
+def resolve_backend(backend: str = "auto"):
+    """
+    Backend create_engine uses for backend: "auto" becomes "tesserocr" when installed, else "pytesseract".
+    """
+    if backend == "auto":
+        # Both backends are imported by their engines, so importing this module stays cheap.
+        # Optional: falls back to pytesseract (one tesseract process per call)
+        return "tesserocr" if importlib.util.find_spec("tesserocr") is not None else "pytesseract"
+    return backend
+
+
+def ocr_settings(backend: str = "auto", lang: str = "eng", config: str = ""):
+    """
+    Settings that change the recognized text, e.g. for cache keys; the default is the shared pool's.
+    """
+    return {"backend": resolve_backend(backend), "lang": lang, "config": config}
+
+
+def pool_settings(ocr_pool=None):
+    """
+    ocr_settings of ocr_pool, or of the shared pool for None (without starting its engines).
+    """
+    return ocr_pool.settings if ocr_pool is not None else ocr_settings()
+
+
+def create_engine(backend: str = "auto", lang: str = "eng", config: str = ""):
+    """
+    Create an OCR engine.
+
+    Args:
+        backend (str): "tesserocr", "pytesseract" or "auto" (tesserocr when installed). Default is "auto".
+        lang (str): Tesseract language code. Default is "eng".
+        config (str): Extra tesseract configuration. Default is "".
+    Returns:
+        TesserocrEngine | PytesseractEngine: Initialized engine.
+    """
+    backend = resolve_backend(backend)
+    if backend == "tesserocr":
+        if importlib.util.find_spec("tesserocr") is None:
+            raise ImportError("The tesserocr backend requires the tesserocr package")
+        return TesserocrEngine(lang, config)
+    if backend == "pytesseract":
+        return PytesseractEngine(lang, config)
+    raise ValueError(f"Unknown OCR backend: {backend}")
+
+
+# Engine owned by each worker process of a process-mode pool
+_worker_engine = None
+
+
+def _init_worker(backend, lang, config):
+    global _worker_engine
+    _worker_engine = create_engine(backend, lang, config)
+
+
+def _recognize_in_worker(crop):
+    # The span is timed here and reported by the parent, which owns the instrumentation
+    start = time.perf_counter()
+    return _worker_engine.recognize(crop), time.perf_counter() - start
+
+
+def _recognize_words_in_worker(image):
+    start = time.perf_counter()
+    return _worker_engine.recognize_words(image), time.perf_counter() - start
+
+
+class OCREnginePool:
+    def __init__(self, size: int = None, backend: str = "auto", mode: str = "thread", lang: str = "eng",
+                 config: str = ""):
+        """
+        Pool of persistent, already-initialized OCR engines that recognizes crops in parallel.
+
+        Args:
+            size (int, optional): Number of engines. Default is the number of CPU cores.
+            backend (str): Engine backend passed to create_engine. Default is "auto".
+            mode (str): "thread" keeps the engines in this process (tesserocr releases the GIL while
+                recognizing); "process" runs one engine per long-lived worker process. Default is "thread".
+            lang (str): Tesseract language code. Default is "eng".
+            config (str): Extra tesseract configuration. Default is "".
+        """
+        self.size = size or os.cpu_count() or 1
+        self.mode = mode
+        self.settings = ocr_settings(backend, lang, config)
+        if mode == "thread":
+            self._engines = queue.Queue()
+            for _ in range(self.size):
+                self._engines.put(create_engine(backend, lang, config))
+            self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="OCR")
+        elif mode == "process":
+            self._engines = None
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.size, initializer=_init_worker, initargs=(backend, lang, config)
+            )
+        else:
+            raise ValueError(f"Unknown OCR pool mode: {mode}")
+
+    def _recognize_with_engine(self, crop):
+        engine = self._engines.get()
+        try:
+            with get_instrumentation().span("ocr"):
+                return engine.recognize(crop)
+        except Exception:
+            get_instrumentation().count("ocr_failures_total", reason="error")
+            raise
+        finally:
+            self._engines.put(engine)
+
+    def _collect_from_workers(self, stage, future):
+        metrics = get_instrumentation()
+        try:
+            result, elapsed = future.result()
+        except Exception:
+            metrics.count("ocr_failures_total", reason="error")
+            raise
+        metrics.observe("stage_seconds", elapsed, stage=stage)
+        return result
+
+    def recognize(self, crops):
+        """
+        Recognize text in several crops in parallel.
+
+        Args:
+            crops (list): Crops as uint8 NumPy arrays or PIL images.
+        Returns:
+            list: Recognized text for each crop, in input order.
+        """
+        if self.mode == "process":
+            # Send raw pixel buffers to the workers rather than encoded image files
+            futures = [self._executor.submit(_recognize_in_worker, np.asarray(crop)) for crop in crops]
+            return [self._collect_from_workers("ocr", future) for future in futures]
+        return list(self._executor.map(self._recognize_with_engine, crops))
+
+    def recognize_page(self, image):
+        """
+        Run a single full-page OCR pass with word-level boxes.
+
+        Args:
+            image (np.ndarray | PIL.Image): The whole receipt image.
+        Returns:
+            Words: Recognized words with their boxes and line ids.
+        """
+        if self.mode == "process":
+            future = self._executor.submit(_recognize_words_in_worker, np.asarray(image))
+            return self._collect_from_workers("ocr_page", future)
+        engine = self._engines.get()
+        try:
+            with get_instrumentation().span("ocr_page"):
+                return engine.recognize_words(image)
+        except Exception:
+            get_instrumentation().count("ocr_failures_total", reason="error")
+            raise
+        finally:
+            self._engines.put(engine)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._engines is not None:
+            while not self._engines.empty():
+                self._engines.get().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_ocr_pool():
+    """
+    Return the shared thread-mode OCREnginePool, creating it on first use.
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = OCREnginePool()
+    return _default_pool
@@ -0,0 +1,191 @@
+from typing import NamedTuple
+
+import numpy as np
+
+
+class Detections(NamedTuple):
+    """
+    Compact detection arrays for a single image.
+
+    Attributes:
+        boxes (np.ndarray): float32 array of shape [K, 4] in (x1, y1, x2, y2) pixel coordinates.
+        scores (np.ndarray): float32 array of shape [K] with the final class confidences.
+        class_ids (np.ndarray): int64 array of shape [K] with the predicted class indices.
+    """
+    boxes: np.ndarray
+    scores: np.ndarray
+    class_ids: np.ndarray
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.scores)
+
+    def take(self, indices):
+        """
+        Select a subset of detections by index (e.g. the output of batched_nms).
+        """
+        return Detections(self.boxes[indices], self.scores[indices], self.class_ids[indices])
+
+    def to_regions(self, labels):
+        """
+        Convert to the list-of-dicts format used by the OCR stage.
+
+        Args:
+            labels (list): List of class labels indexed by class id.
+        Returns:
+            list: Regions with "label", "confidence" and integer "box" entries.
+        """
+        boxes = self.boxes.astype(np.int64).tolist()
+        regions = []
+        for box, score, class_id in zip(boxes, self.scores.tolist(), self.class_ids.tolist()):
+            label = labels[class_id] if class_id < len(labels) else str(class_id)
+            regions.append({"label": label, "confidence": score, "box": box})
+        return regions
+
+
+def _resolve_layout(pred, num_classes, layout):
+    """
+    Bring raw model output to [N, C] rows and work out which head layout produced it.
+
+    YOLOv8/11 exports are channels-first ([4 + nc, N], no objectness column), while the
+    legacy YOLOv5-style exports are channels-last ([N, 5 + nc], with objectness).
+    """
+    if pred.ndim != 2:
+        raise ValueError(f"Expected a 2D prediction array per image, got shape {pred.shape}")
+
+    rows, cols = pred.shape
+    channels_first = rows < cols
+    if num_classes:
+        if rows in (4 + num_classes, 5 + num_classes) and cols not in (4 + num_classes, 5 + num_classes):
+            channels_first = True
+        elif cols in (4 + num_classes, 5 + num_classes):
+            channels_first = False
+    if channels_first:
+        pred = pred.T
+
+    if layout == "auto":
+        channels = pred.shape[1]
+        if num_classes and channels == 5 + num_classes:
+            layout = "legacy"
+        elif num_classes and channels == 4 + num_classes:
+            layout = "v8"
+        else:
+            layout = "v8" if channels_first else "legacy"
+    if layout not in ("v8", "legacy"):
+        raise ValueError(f"Unknown output layout: {layout}")
+    return pred, layout
+
+
+def decode_predictions(output, conf_threshold=0.1, num_classes=None, input_size=(640, 640), image_size=None,
+                       layout="auto"):
+    """
+    Decode raw YOLO output for one image into score-filtered boxes, without any per-row Python loop.
+
+    Args:
+        output (np.ndarray): Raw model output for one image, either [4 + nc, N] (YOLOv8/11),
+            [N, 5 + nc] (legacy objectness head) or the same with a leading batch axis of 1.
+        conf_threshold (float): Confidence threshold for filtering detections.
+        num_classes (int, optional): Number of classes, used to disambiguate the layout.
+        input_size (tuple): Model input size (width, height) the boxes are expressed in.
+        image_size (tuple, optional): Original image size (width, height) to scale boxes to.
+            Boxes stay in model input coordinates if omitted.
+        layout (str): "auto", "v8" or "legacy".
+    Returns:
+        Detections: Candidate detections before NMS.
+    """
+    pred = np.asarray(output)
+    if pred.ndim == 3:
+        if pred.shape[0] != 1:
+            raise ValueError("decode_predictions expects a single image; slice the batch first")
+        pred = pred[0]
+    pred, layout = _resolve_layout(pred, num_classes, layout)
+
+    if layout == "legacy":
+        # Objectness bounds the final score, so it is a cheap first filter
+        pred = pred[pred[:, 4] > conf_threshold]
+        class_scores = pred[:, 5:] * pred[:, 4:5]
+    else:
+        class_scores = pred[:, 4:]
+
+    if class_scores.shape[1] == 0 or len(pred) == 0:
+        return Detections.empty()
+
+    class_ids = class_scores.argmax(axis=1)
+    scores = np.take_along_axis(class_scores, class_ids[:, None], axis=1)[:, 0]
+    mask = scores > conf_threshold
+    xywh = pred[mask, :4].astype(np.float32)
+    scores = scores[mask].astype(np.float32)
+    class_ids = class_ids[mask].astype(np.int64)
+
+    boxes = np.empty_like(xywh)
+    half_wh = xywh[:, 2:4] / 2
+    boxes[:, :2] = xywh[:, :2] - half_wh
+    boxes[:, 2:] = xywh[:, :2] + half_wh
+
+    if image_size is not None and len(boxes):
+        image_w, image_h = image_size
+        if xywh.max() <= 1.0 + 1e-3:
+            # Normalized coordinates: scale straight to the original image
+            scale = np.array([image_w, image_h, image_w, image_h], dtype=np.float32)
+        else:
+            input_w, input_h = input_size
+            scale = np.array([image_w / input_w, image_h / input_h] * 2, dtype=np.float32)
+        boxes *= scale
+        np.clip(boxes, 0, [image_w, image_h, image_w, image_h], out=boxes)
+
+    return Detections(boxes, scores, class_ids)
+
+
+def batched_nms(boxes, scores, class_ids, iou_threshold=0.5, max_det=300):
+    """
+    Class-aware greedy Non-Maximum Suppression.
+
+    Boxes of different classes never suppress each other: each class is shifted to its own
+    disjoint coordinate range so a single NMS pass handles every class at once.
+
+    Args:
+        boxes (np.ndarray): [K, 4] boxes in (x1, y1, x2, y2) format.
+        scores (np.ndarray): [K] confidences.
+        class_ids (np.ndarray): [K] class indices.
+        iou_threshold (float): IOU threshold for NMS.
+        max_det (int): Maximum number of detections to keep.
+    Returns:
+        np.ndarray: Indices of the kept boxes, sorted by descending score.
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    boxes = np.asarray(boxes, dtype=np.float32)
+    offsets = np.asarray(class_ids, dtype=np.float32)[:, None] * (boxes.max() - boxes.min() + 1)
+    shifted = boxes + offsets
+    x1, y1, x2, y2 = shifted.T
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    keep = []
+    while order.size and len(keep) < max_det:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        inter_w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        inter_h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = inter_w * inter_h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-7)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def postprocess(output, conf_threshold=0.1, iou_threshold=0.5, num_classes=None, input_size=(640, 640),
+                image_size=None, layout="auto", max_det=300):
+    """
+    Decode one image's raw output and apply class-aware NMS.
+
+    Returns:
+        Detections: Final detections sorted by descending score.
+    """
+    candidates = decode_predictions(output, conf_threshold, num_classes, input_size, image_size, layout)
+    keep = batched_nms(candidates.boxes, candidates.scores, candidates.class_ids, iou_threshold, max_det)
+    return candidates.take(keep)
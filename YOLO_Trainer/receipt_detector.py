@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+
+import numpy as np
+import onnxruntime as ort
+
+from instrumentation import get_instrumentation
+from postprocess import postprocess
+from result_cache import model_digest
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+
+class ReceiptDetector:
+    def __init__(self, model_path: str, intra_op_num_threads: int = 0, inter_op_num_threads: int = 0,
+                 graph_optimization_level: str = "all", optimized_model_dir: str = None, providers: list = None,
+                 warmup_runs: int = 2):
+        """
+        Long-lived wrapper around an ONNX Runtime session for the receipt detection model.
+
+        Args:
+            model_path (str): Path to the ONNX object detection model.
+            intra_op_num_threads (int): Threads used inside a single operator. 0 lets ONNX Runtime decide.
+            inter_op_num_threads (int): Threads used to run independent operators in parallel.
+                Values above 1 switch the session to parallel execution mode. 0 lets ONNX Runtime decide.
+            graph_optimization_level (str): One of "disable", "basic", "extended" or "all".
+            optimized_model_dir (str, optional): Directory for the on-disk optimized-model cache. The graph is
+                optimized once, saved there and reloaded on later startups without re-optimizing. At level "all"
+                the cached graph may use hardware-specific kernels, so keep it local to the machine. Default is None.
+            providers (list, optional): Execution providers. Default is CPU only.
+            warmup_runs (int): Number of dummy inferences run at startup. Default is 2.
+        """
+        if graph_optimization_level not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"Unknown graph optimization level: {graph_optimization_level}")
+
+        self.model_path = model_path
+        self.graph_optimization_level = graph_optimization_level
+        self.providers = providers or ["CPUExecutionProvider"]
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_num_threads
+        options.inter_op_num_threads = inter_op_num_threads
+        if inter_op_num_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[graph_optimization_level]
+
+        load_path = model_path
+        if optimized_model_dir:
+            cached_path = self._optimized_model_path(optimized_model_dir)
+            if os.path.exists(cached_path) and os.path.getmtime(cached_path) >= os.path.getmtime(model_path):
+                # The cached graph is already optimized; skip the optimizer passes on load
+                load_path = cached_path
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            else:
+                os.makedirs(optimized_model_dir, exist_ok=True)
+                options.optimized_model_filepath = cached_path
+
+        start = time.perf_counter()
+        self.session = ort.InferenceSession(load_path, sess_options=options, providers=self.providers)
+        self.load_time = time.perf_counter() - start
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_shape = model_input.shape
+        self.output_name = self.session.get_outputs()[0].name
+
+        # Static spatial dims come from the graph; dynamic ones fall back to the training size
+        height, width = self.input_shape[2:4]
+        self.input_size = (width if isinstance(width, int) else 640, height if isinstance(height, int) else 640)
+        # A static batch dim (the ultralytics default export) fixes how many images go into one run
+        self.fixed_batch = self.input_shape[0] if isinstance(self.input_shape[0], int) else None
+
+        self.warmup(warmup_runs)
+
+    def _optimized_model_path(self, optimized_model_dir):
+        # Every ultralytics export is called best.onnx: key the cache on the model contents, not just its name
+        stem = os.path.splitext(os.path.basename(self.model_path))[0]
+        digest = model_digest(self.model_path)[:16]
+        return os.path.join(optimized_model_dir, f"{stem}.{digest}.{self.graph_optimization_level}.optimized.onnx")
+
+    def warmup(self, runs: int = 2):
+        """
+        Run dummy inferences so allocations and kernel selection happen before the first real request.
+        """
+        width, height = self.input_size
+        dummy = np.zeros((self.fixed_batch or 1, 3, height, width), dtype=np.float32)
+        for _ in range(runs):
+            self.run(dummy)
+
+    def run(self, input_data):
+        """
+        Run the forward pass on a preprocessed [N, 3, H, W] float32 tensor and return the raw output.
+        """
+        with get_instrumentation().span("inference"):
+            return self.session.run([self.output_name], {self.input_name: input_data})[0]
+
+    def detect(self, input_data, image_size, num_classes=None, conf_threshold=0.1, iou_threshold=0.5):
+        """
+        Run inference on one preprocessed image and decode the detections.
+
+        Args:
+            input_data (np.ndarray): Preprocessed [1, 3, H, W] input tensor.
+            image_size (tuple): Original image size (width, height) to scale boxes to.
+            num_classes (int, optional): Number of classes, used to disambiguate the output layout.
+            conf_threshold (float): Confidence threshold for filtering detections.
+            iou_threshold (float): IOU threshold for NMS.
+        Returns:
+            Detections: Boxes, scores and class ids in original image coordinates.
+        """
+        outputs = self.run(input_data)
+        with get_instrumentation().span("postprocess"):
+            return postprocess(
+                outputs[0],
+                conf_threshold=conf_threshold,
+                iou_threshold=iou_threshold,
+                num_classes=num_classes,
+                input_size=(input_data.shape[3], input_data.shape[2]),
+                image_size=image_size,
+            )
+
+    def detect_batch(self, input_data, image_sizes, num_classes=None, conf_threshold=0.1, iou_threshold=0.5):
+        """
+        Run inference on a stacked batch of preprocessed images and split the detections per image.
+
+        Models exported with a dynamic batch axis run the whole batch in one session call. Models with a
+        static batch axis are run in chunks of that size, padding the last chunk.
+
+        Args:
+            input_data (np.ndarray): Preprocessed [N, 3, H, W] input tensor.
+            image_sizes (list): Original (width, height) of each image in the batch.
+            num_classes (int, optional): Number of classes, used to disambiguate the output layout.
+            conf_threshold (float): Confidence threshold for filtering detections.
+            iou_threshold (float): IOU threshold for NMS.
+        Returns:
+            list: One Detections per image, in input order.
+        """
+        count = len(image_sizes)
+        if self.fixed_batch is None or self.fixed_batch == count:
+            outputs = self.run(input_data[:count])
+        else:
+            chunks = []
+            for start in range(0, count, self.fixed_batch):
+                chunk = input_data[start:start + self.fixed_batch]
+                if len(chunk) < self.fixed_batch:
+                    padding = np.zeros((self.fixed_batch - len(chunk),) + chunk.shape[1:], dtype=chunk.dtype)
+                    chunk = np.concatenate([chunk, padding])
+                chunks.append(self.run(chunk))
+            outputs = np.concatenate(chunks)[:count]
+
+        input_size = (input_data.shape[3], input_data.shape[2])
+        metrics = get_instrumentation()
+        results = []
+        for i in range(count):
+            with metrics.span("postprocess"):
+                results.append(postprocess(
+                    outputs[i],
+                    conf_threshold=conf_threshold,
+                    iou_threshold=iou_threshold,
+                    num_classes=num_classes,
+                    input_size=input_size,
+                    image_size=image_sizes[i],
+                ))
+        return results
+
+
+def get_detector(model_path: str, **options):
+    """
+    Return the shared ReceiptDetector for a model path, creating it on first use.
+
+    Args:
+        model_path (str): Path to the ONNX object detection model.
+        **options: Keyword arguments forwarded to ReceiptDetector. Different options get different detectors.
+    Returns:
+        ReceiptDetector: Cached detector instance.
+    """
+    key = (os.path.abspath(model_path), tuple(sorted((name, repr(value)) for name, value in options.items())))
+    with _detectors_lock:
+        detector = _detectors.get(key)
+        if detector is None:
+            detector = ReceiptDetector(model_path, **options)
+            _detectors[key] = detector
+    return detector
+
+
+def clear_detectors():
+    """
+    Drop all cached detectors (e.g. after a model file has been replaced).
+    """
+    with _detectors_lock:
+        _detectors.clear()
@@ -0,0 +1,112 @@
+"""
+Inference-only entry point: receipt image in, labelled regions out.
+
+Importing this module loads NumPy and ONNX Runtime and nothing else heavy; no OCR engine, OpenCV,
+ultralytics or torch. Pillow is imported on the first call that has to decode an image, and callers
+that pass a ready [N, 3, H, W] float32 tensor never load it. Use it for detection-only workers and
+scripts where startup time and resident memory matter; main_prediction adds OCR and parsing on top.
+
+benchmarks/import_budget.py measures the import time and RSS of this module and fails when they
+exceed the budget.
+
+Usage (from the YOLO_Trainer directory):
+    python receipt_inference.py receipt.jpg --model model/train15/weights/best.onnx --labels labels_item.txt
+"""
+import argparse
+import json
+
+import numpy as np
+
+from receipt_detector import get_detector
+
+
+def load_labels(labels_path):
+    """
+    Read one class label per line.
+    """
+    with open(labels_path, "r") as file:
+        return file.read().splitlines()
+
+
+def prepare_input(source, input_size=(640, 640)):
+    """
+    Decode and preprocess one receipt the way main_prediction.preprocess_image does (grayscale, contrast x2,
+    resize), writing straight into the model input.
+
+    Args:
+        source (str | bytes | file | PIL.Image | np.ndarray): Image path, encoded bytes, file-like object, PIL
+            image, HxW / HxWx3 uint8 array, or an already preprocessed [1, 3, H, W] float32 tensor.
+        input_size (tuple): Model input size (width, height).
+    Returns:
+        np.ndarray: [1, 3, H, W] float32 model input.
+        tuple: Original image size (width, height), or None for a preprocessed tensor (boxes then stay in
+        input coordinates).
+    """
+    if isinstance(source, np.ndarray) and source.ndim == 4:
+        return source, None
+
+    import io
+
+    from PIL import Image, ImageEnhance  # Only decoding needs Pillow
+
+    if isinstance(source, np.ndarray):
+        image = Image.fromarray(source)
+    elif isinstance(source, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(source))
+    elif isinstance(source, Image.Image):
+        image = source
+    else:
+        image = Image.open(source)
+    image = ImageEnhance.Contrast(image.convert("L")).enhance(2)
+
+    width, height = input_size
+    input_data = np.empty((1, 3, height, width), dtype=np.float32)
+    np.divide(np.asarray(image.resize(input_size)), np.float32(255), out=input_data[0], casting="unsafe")
+    return input_data, image.size
+
+
+def detect(source, model_path, labels, conf_threshold=0.1, iou_threshold=0.5, **detector_options):
+    """
+    Detect the labelled regions of one receipt.
+
+    Args:
+        source: Anything prepare_input accepts.
+        model_path (str): Path to the ONNX object detection model.
+        labels (list): List of class labels.
+        conf_threshold (float): Confidence threshold for filtering detections.
+        iou_threshold (float): IOU threshold for NMS.
+        **detector_options: Keyword arguments for the shared ReceiptDetector (threads, providers, ...).
+    Returns:
+        list: Regions with "label", "confidence" and "box" entries, highest confidence first.
+    """
+    detector = get_detector(model_path, **detector_options)
+    input_data, image_size = prepare_input(source, detector.input_size)
+    detections = detector.detect(
+        input_data,
+        image_size=image_size,
+        num_classes=len(labels),
+        conf_threshold=conf_threshold,
+        iou_threshold=iou_threshold,
+    )
+    return detections.to_regions(labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+", help="Receipt images")
+    parser.add_argument("--model", default="model/train15/weights/best.onnx", help="ONNX detection model")
+    # main.py writes the label files crosswise: labels_item.txt holds the whole-receipt classes
+    parser.add_argument("--labels", default="labels_item.txt", help="Class labels of the model")
+    parser.add_argument("--conf", type=float, default=0.1, help="Confidence threshold")
+    parser.add_argument("--iou", type=float, default=0.5, help="NMS IOU threshold")
+    parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime intra-op threads (0 = auto)")
+    args = parser.parse_args()
+
+    labels = load_labels(args.labels)
+    for image in args.images:
+        regions = detect(image, args.model, labels, args.conf, args.iou, intra_op_num_threads=args.threads)
+        print(json.dumps({"image": image, "regions": regions}))
+
+
+if __name__ == "__main__":
+    main()
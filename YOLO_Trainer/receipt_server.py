@@ -0,0 +1,305 @@
+"""
+Asyncio HTTP service around the receipt pipeline.
+
+POST /receipts with the image as the raw request body or as a multipart/form-data file field
+("image" or the first file) and the response is the parse_receipt_data JSON:
+    {"items": [{"name": ..., "price": ...}], "total": ..., "address": ...}
+GET /health reports the number of requests in flight.
+
+Requests are decoded on a thread pool, then a MicroBatcher groups them for a few milliseconds (or
+until batch_size images are waiting) into one batched ONNX call, and OCR/parsing fans out to a worker
+pool. Above max_pending requests in flight the server answers 503 instead of queueing, and requests
+that take longer than request_timeout get a 504.
+
+Usage (from the YOLO_Trainer directory):
+    python receipt_server.py --model model/train15/weights/best.onnx --port 8080
+    python receipt_server.py --standin   # random-weight model with the train15 interface, for local testing
+    curl --data-binary @receipt.jpg http://localhost:8080/receipts
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from batching import MicroBatcher
+from main_prediction import extract_text_from_regions, parse_receipt_data, preprocess_image
+from receipt_detector import ReceiptDetector, get_detector
+
+logger = logging.getLogger(__name__)
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ReceiptServer:
+    def __init__(self, detection_model, labels, conf_threshold=0.1, batch_size=8, batch_timeout=0.005,
+                 max_pending=64, request_timeout=10.0, max_body_size=20 * 1024 * 1024, preprocess_workers=2,
+                 ocr_workers=4, ocr_mode="crop", fast_preprocess=False, ocr_pool=None):
+        """
+        Receipt processing service with dynamic micro-batching.
+
+        Args:
+            detection_model (str | ReceiptDetector): Path to the ONNX object detection model, or a detector instance.
+            labels (list): List of class labels.
+            conf_threshold (float): Confidence threshold for filtering detections.
+            batch_size (int): Maximum number of images per inference call. Default is 8.
+            batch_timeout (float): Seconds a partial batch waits for more images. Default is 0.005.
+            max_pending (int): Requests in flight before new ones are rejected with 503. Default is 64.
+            request_timeout (float): Seconds before a request is answered with 504. Default is 10.
+            max_body_size (int): Largest accepted upload in bytes. Default is 20 MB.
+            preprocess_workers (int): Decode/preprocess threads. Default is 2.
+            ocr_workers (int): OCR/parse threads, each fanning crops out to the OCR pool. Default is 4.
+            ocr_mode (str): "crop" or "page", see extract_text_from_regions. Default is "crop".
+            fast_preprocess (bool): Use the fast grayscale decode of preprocess_image. Default is False.
+            ocr_pool (OCREnginePool, optional): OCR engines to use. Default is the shared pool.
+        """
+        if not isinstance(detection_model, ReceiptDetector):
+            detection_model = get_detector(detection_model)
+        self.detector = detection_model
+        self.labels = labels
+        self.conf_threshold = conf_threshold
+        self.max_pending = max_pending
+        self.request_timeout = request_timeout
+        self.max_body_size = max_body_size
+        self.ocr_mode = ocr_mode
+        self.fast_preprocess = fast_preprocess
+        self.ocr_pool = ocr_pool
+        self.pending = 0
+
+        self._preprocess_executor = ThreadPoolExecutor(preprocess_workers, thread_name_prefix="preprocess")
+        self._ocr_executor = ThreadPoolExecutor(ocr_workers, thread_name_prefix="ocr")
+        self._batcher = MicroBatcher(self._detect_batch, batch_size=batch_size, timeout=batch_timeout)
+        self._server = None
+
+    def _preprocess(self, data):
+        try:
+            input_data, image = preprocess_image(io.BytesIO(data), input_size=self.detector.input_size,
+                                                 fast=self.fast_preprocess)
+        except Exception as exc:
+            raise HTTPError(400, f"Unreadable image: {exc}")
+        return input_data[0], image
+
+    def _detect_batch(self, items):
+        batch_detections = self.detector.detect_batch(
+            np.stack([input_data for input_data, _ in items]),
+            image_sizes=[image.size for _, image in items],
+            num_classes=len(self.labels),
+            conf_threshold=self.conf_threshold,
+        )
+        return [detections.to_regions(self.labels) for detections in batch_detections]
+
+    def _ocr(self, image, regions):
+        extracted_data = extract_text_from_regions(image, regions, ocr_pool=self.ocr_pool, mode=self.ocr_mode)
+        return parse_receipt_data(extracted_data)
+
+    async def process(self, data):
+        """
+        Run one image through decode, batched detection, OCR and parsing.
+
+        Args:
+            data (bytes): Encoded image.
+        Returns:
+            dict: Parsed receipt data.
+        """
+        loop = asyncio.get_running_loop()
+        input_data, image = await loop.run_in_executor(self._preprocess_executor, self._preprocess, data)
+        regions = await asyncio.wrap_future(self._batcher.submit((input_data, image)))
+        return await loop.run_in_executor(self._ocr_executor, self._ocr, image, regions)
+
+    async def _admit(self, data):
+        if self.pending >= self.max_pending:
+            raise HTTPError(503, "Server busy, retry later")
+        self.pending += 1
+        # The slot is released when the work finishes, even if the client has already timed out
+        task = asyncio.ensure_future(self.process(data))
+        task.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.request_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(504, f"Processing took longer than {self.request_timeout}s")
+
+    def _release(self, task):
+        self.pending -= 1
+        if not task.cancelled() and task.exception() is not None and not isinstance(task.exception(), HTTPError):
+            logger.error("Receipt processing failed", exc_info=task.exception())
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                method, path, headers, body = await asyncio.wait_for(self._read_request(reader), self.request_timeout)
+                status, payload = 200, await self._route(method, path, headers, body)
+            except HTTPError as exc:
+                status, payload = exc.status, {"error": exc.message}
+            except asyncio.TimeoutError:
+                status, payload = 504, {"error": "Timed out reading the request"}
+            except Exception as exc:
+                status, payload = 500, {"error": repr(exc)}
+            await self._respond(writer, status, payload)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        try:
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "Malformed Content-Length header")
+        if length < 0:
+            raise HTTPError(400, "Negative Content-Length header")
+        if length > self.max_body_size:
+            raise HTTPError(413, f"Upload larger than {self.max_body_size} bytes")
+        body = await reader.readexactly(length) if length else b""
+        return method, path.split("?", 1)[0], headers, body
+
+    async def _route(self, method, path, headers, body):
+        if path == "/health":
+            return {"status": "ok", "pending": self.pending, "max_pending": self.max_pending}
+        if path != "/receipts":
+            raise HTTPError(404, f"No route for {path}")
+        if method != "POST":
+            raise HTTPError(405, "Use POST with the image as the body")
+        data = _extract_upload(headers, body)
+        if not data:
+            raise HTTPError(400, "No image in the request body")
+        return await self._admit(data)
+
+    async def _respond(self, writer, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", "Content-Type: application/json",
+                f"Content-Length: {len(body)}", "Connection: close"]
+        if status == 503:
+            head.append("Retry-After: 1")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """
+        Start listening and return the asyncio server.
+        """
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    async def serve_forever(self, host="127.0.0.1", port=8080):
+        server = await self.start(host, port)
+        logger.info("Serving on %s", ", ".join(str(sock.getsockname()) for sock in server.sockets))
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        self._batcher.close()
+        self._preprocess_executor.shutdown(wait=True)
+        self._ocr_executor.shutdown(wait=True)
+
+
+def _extract_upload(headers, body):
+    """
+    Return the image bytes from a raw body or from a multipart/form-data upload.
+    """
+    content_type = headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        return body
+
+    boundary = None
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary":
+            boundary = value.strip('"')
+    if not boundary:
+        raise HTTPError(400, "Multipart upload without a boundary")
+
+    files = []
+    for part in body.split(b"--" + boundary.encode("latin-1"))[1:]:
+        head, separator, content = part.partition(b"\r\n\r\n")
+        if not separator:
+            continue
+        if content.endswith(b"\r\n"):
+            content = content[:-2]
+        if b'name="image"' in head:
+            return content
+        if b"filename=" in head:
+            files.append(content)
+    return files[0] if files else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="model/train15/weights/best.onnx", help="ONNX detection model")
+    # main.py writes the label files crosswise: labels_item.txt holds the classes of the train15 model above
+    parser.add_argument("--labels", default="labels_item.txt", help="Class labels of the model")
+    parser.add_argument("--standin", action="store_true", help="Serve a random-weight stand-in model instead")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--conf", type=float, default=0.1, help="Confidence threshold")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per inference call")
+    parser.add_argument("--batch-timeout", type=float, default=0.005, help="Seconds a partial batch waits")
+    parser.add_argument("--max-pending", type=int, default=64, help="Requests in flight before answering 503")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Per-request timeout in seconds")
+    parser.add_argument("--ocr-workers", type=int, default=4, help="OCR/parse threads")
+    parser.add_argument("--ocr-mode", choices=("crop", "page"), default="crop", help="OCR strategy")
+    parser.add_argument("--fast-decode", action="store_true", help="Use the fast grayscale JPEG decode")
+    parser.add_argument("--log-level", default="INFO", help="Logging level")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+
+    if args.standin:
+        from benchmarks.synthetic import TRAIN15_LABELS, make_standin_model
+
+        model_path = make_standin_model(os.path.join(tempfile.mkdtemp(), "standin.onnx"))
+        labels = TRAIN15_LABELS
+    else:
+        model_path = args.model
+        with open(args.labels, "r") as f:
+            labels = f.read().splitlines()
+
+    server = ReceiptServer(
+        model_path,
+        labels,
+        conf_threshold=args.conf,
+        batch_size=args.batch_size,
+        batch_timeout=args.batch_timeout,
+        max_pending=args.max_pending,
+        request_timeout=args.timeout,
+        ocr_workers=args.ocr_workers,
+        ocr_mode=args.ocr_mode,
+        fast_preprocess=args.fast_decode,
+    )
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
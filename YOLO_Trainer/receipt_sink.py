@@ -0,0 +1,235 @@
+"""
+Columnar sink for parsed receipts.
+
+Pipeline records (as written to the batch_pipeline JSONL) are flattened into three Parquet datasets
+under one root, all hive-partitioned by receipt date and store:
+    <root>/receipts/date=2024-03-12/store=kedai_abc/part-....parquet   one row per receipt
+    <root>/items/...                                                   one row per parsed item
+    <root>/detections/...                                              one row per detected region
+Rows are buffered in memory per partition and written as one row group once row_group_size rows
+have accumulated (or when max_buffered_rows is reached overall, or on flush/close). Files are only
+ever added: each writer is named after the sink's run id and stays hidden (leading "_") until it is
+finalized by flush() or close(), so readers never see a file without its footer and a crashed run
+leaves no half-written data. Rows not yet flushed when a process is killed are lost, so callers that
+checkpoint progress must flush before recording it: batch_pipeline writes a receipt to its JSONL
+checkpoint only after the sink flush that made its rows durable, and a resumed run redoes the rest.
+
+Read back with pyarrow.dataset (or pandas/DuckDB/Spark) using hive partitioning, e.g.
+    pyarrow.dataset.dataset("results/items", partitioning="hive").to_table(columns=["store", "price"])
+
+Usage (from the YOLO_Trainer directory):
+    python batch_pipeline.py receipts/ --output results.jsonl --parquet results/
+    python receipt_sink.py results.jsonl results/
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+UNKNOWN_PARTITION = "unknown"
+
+SCHEMAS = {
+    "receipts": pa.schema([
+        ("source", pa.string()),
+        ("store_name", pa.string()),
+        ("address", pa.string()),
+        ("total", pa.float64()),
+        ("item_count", pa.int32()),
+        ("items_sum", pa.float64()),
+        ("detection_count", pa.int32()),
+    ]),
+    "items": pa.schema([
+        ("source", pa.string()),
+        ("line", pa.int32()),
+        ("name", pa.string()),
+        ("price", pa.float64()),
+    ]),
+    "detections": pa.schema([
+        ("source", pa.string()),
+        ("label", pa.dictionary(pa.int8(), pa.string())),
+        ("confidence", pa.float32()),
+        ("x1", pa.int32()),
+        ("y1", pa.int32()),
+        ("x2", pa.int32()),
+        ("y2", pa.int32()),
+    ]),
+}
+
+
+def partition_values(receipt):
+    """
+    Partition (date, store) of a parsed receipt; missing or unreadable values go to "unknown".
+    """
+    receipt = receipt or {}
+    store = re.sub(r"[^0-9a-z]+", "_", (receipt.get("store") or "").lower()).strip("_")[:64]
+    return receipt.get("date") or UNKNOWN_PARTITION, store or UNKNOWN_PARTITION
+
+
+def flatten_record(record):
+    """
+    Split one pipeline record into rows of the receipts, items and detections tables.
+
+    Args:
+        record (dict): {"source", "regions", "receipt"}, as produced by ReceiptPipeline.
+    Returns:
+        dict: {table: list of row dicts}, partition columns excluded.
+    """
+    source = record["source"]
+    receipt = record.get("receipt") or {}
+    items = receipt.get("items") or []
+    regions = record.get("regions") or []
+    prices = [item["price"] for item in items if item.get("price") is not None]
+    return {
+        "receipts": [{
+            "source": source,
+            "store_name": receipt.get("store"),
+            "address": receipt.get("address"),
+            "total": receipt.get("total"),
+            "item_count": len(items),
+            "items_sum": sum(prices) if prices else None,
+            "detection_count": len(regions),
+        }],
+        "items": [{"source": source, "line": line, "name": item.get("name"), "price": item.get("price")}
+                  for line, item in enumerate(items)],
+        "detections": [{"source": source, "label": region["label"], "confidence": region["confidence"],
+                        "x1": region["box"][0], "y1": region["box"][1], "x2": region["box"][2],
+                        "y2": region["box"][3]}
+                       for region in regions],
+    }
+
+
+class ReceiptSink:
+    def __init__(self, root, row_group_size=10000, max_buffered_rows=200000, max_open_files=64,
+                 compression="zstd"):
+        """
+        Buffered, append-only Parquet writer for pipeline records. Thread-safe.
+
+        Args:
+            root (str): Dataset root; the receipts, items and detections datasets are created below it.
+            row_group_size (int): Rows buffered per partition before they are written as one row group.
+                Default is 10000.
+            max_buffered_rows (int): Rows buffered across all partitions before everything is written.
+                Default is 200000.
+            max_open_files (int): Open partition files; the least recently used is closed (finalized) beyond
+                this, and later rows of its partition go to a new file. Default is 64.
+            compression (str): Parquet compression codec. Default is "zstd".
+        """
+        self.root = root
+        self.row_group_size = row_group_size
+        self.max_buffered_rows = max_buffered_rows
+        self.max_open_files = max_open_files
+        self.compression = compression
+        self.run_id = time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        self.rows_written = 0
+        self._buffers = {}  # (table, date, store) -> list of rows
+        self._buffered = 0
+        self._writers = {}  # (table, date, store) -> (writer, temporary path, final path); insertion = LRU order
+        self._file_counter = 0
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        """
+        Buffer one pipeline record; full partitions are written out as row groups. Failed records (with an
+        "error") are skipped: they stay in the JSONL and are retried on the next run.
+        """
+        if "error" in record:
+            return
+        date, store = partition_values(record.get("receipt"))
+        with self._lock:
+            for table, rows in flatten_record(record).items():
+                if not rows:
+                    continue
+                key = (table, date, store)
+                buffer = self._buffers.setdefault(key, [])
+                buffer.extend(rows)
+                self._buffered += len(rows)
+                if len(buffer) >= self.row_group_size:
+                    self._flush_partition(key)
+            if self._buffered >= self.max_buffered_rows:
+                self._flush_all()
+
+    def flush(self):
+        """
+        Write every buffered row and finalize all open files, so everything written so far is durable and
+        visible to readers. Later rows of the same partitions go to new part files.
+        """
+        with self._lock:
+            self._flush_all()
+            for key in list(self._writers):
+                self._close_writer(key)
+
+    def close(self):
+        """
+        Flush and finalize all open files.
+        """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _flush_all(self):
+        for key in list(self._buffers):
+            self._flush_partition(key)
+
+    def _flush_partition(self, key):
+        rows = self._buffers.pop(key, None)
+        if not rows:
+            return
+        self._buffered -= len(rows)
+        table = pa.Table.from_pylist(rows, schema=SCHEMAS[key[0]])
+        self._writer(key).write_table(table, row_group_size=len(rows))
+        self.rows_written += len(rows)
+
+    def _writer(self, key):
+        entry = self._writers.pop(key, None)
+        if entry is None:
+            if len(self._writers) >= self.max_open_files:
+                self._close_writer(next(iter(self._writers)))
+            table, date, store = key
+            directory = os.path.join(self.root, table, f"date={date}", f"store={store}")
+            os.makedirs(directory, exist_ok=True)
+            self._file_counter += 1
+            name = f"part-{self.run_id}-{self._file_counter:05d}.parquet"
+            temporary = os.path.join(directory, "_" + name)  # Hidden from dataset readers until closed
+            writer = pq.ParquetWriter(temporary, SCHEMAS[table], compression=self.compression)
+            entry = (writer, temporary, os.path.join(directory, name))
+        self._writers[key] = entry  # Re-inserted: most recently used last
+        return entry[0]
+
+    def _close_writer(self, key):
+        writer, temporary, final = self._writers.pop(key)
+        writer.close()
+        os.replace(temporary, final)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("jsonl", help="batch_pipeline JSONL results to convert")
+    parser.add_argument("root", help="Parquet dataset root")
+    parser.add_argument("--row-group-size", type=int, default=10000, help="Rows per row group and partition")
+    args = parser.parse_args()
+
+    count = 0
+    with ReceiptSink(args.root, row_group_size=args.row_group_size) as sink, \
+            open(args.jsonl, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # Truncated by a crash mid-write, as in load_checkpoint
+            sink.write(record)
+            count += 1
+    print(f"Wrote {count} receipts ({sink.rows_written} rows) to {args.root}")
+
+
+if __name__ == "__main__":
+    main()
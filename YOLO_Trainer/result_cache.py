@@ -0,0 +1,150 @@
+"""
+Content-addressed cache for receipt processing results.
+
+Entries are keyed by what produced them, never by file name: the SHA-256 of the image bytes, the
+SHA-256 of the model file and every setting that changes the output. Detections and OCR text are
+stored as separate entries, so re-parsing a receipt (e.g. after a parser change) reuses the cached
+OCR, and changing only the OCR mode or engine settings reuses the cached detections.
+
+A bounded in-memory LRU sits in front of an optional SQLite file that survives restarts.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+_model_digests = {}
+_model_digests_lock = threading.Lock()
+
+
+def bytes_digest(data):
+    """
+    SHA-256 hex digest of raw image bytes.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def model_digest(model_path):
+    """
+    SHA-256 hex digest of a model file, memoized until the file's mtime or size changes.
+    """
+    stat = os.stat(model_path)
+    key = (os.path.abspath(model_path), stat.st_mtime_ns, stat.st_size)
+    with _model_digests_lock:
+        digest = _model_digests.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(model_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        digest = sha.hexdigest()
+        with _model_digests_lock:
+            _model_digests[key] = digest
+    return digest
+
+
+def _combine(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def detection_key(image_digest, model_hash, labels, conf_threshold, iou_threshold, input_size, fast_preprocess):
+    """
+    Key of the detections for one image under one model and detection configuration.
+    """
+    return _combine("detections", image_digest, model_hash, list(labels), float(conf_threshold),
+                    float(iou_threshold), list(input_size), bool(fast_preprocess))
+
+
+def ocr_key(detections_key, ocr_mode, ocr_settings):
+    """
+    Key of the OCR text for the regions identified by detections_key, read with the OCR backend, language
+    and tesseract config in ocr_settings (see ocr_backend.ocr_settings).
+    """
+    return _combine("ocr", detections_key, ocr_mode, dict(ocr_settings))
+
+
+class ResultCache:
+    def __init__(self, path: str = None, max_entries: int = 1024):
+        """
+        Two-tier result cache: an in-memory LRU backed by an optional SQLite database.
+
+        Args:
+            path (str, optional): SQLite file for the persistent tier. Default is None (memory only).
+            max_entries (int): Maximum number of entries kept in memory. Default is 1024.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            import sqlite3  # Only the persistent tier needs it
+
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (kind TEXT, key TEXT, value TEXT, PRIMARY KEY (kind, key))"
+            )
+            self._db.commit()
+
+    def get(self, kind, key):
+        """
+        Look up an entry of the given kind ("detections" or "ocr"). Returns None on a miss.
+        """
+        with self._lock:
+            value = self._memory.get((kind, key))
+            if value is not None:
+                self._memory.move_to_end((kind, key))
+                self.hits += 1
+                return value
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM results WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember((kind, key), value)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, kind, key, value):
+        """
+        Store a JSON-serializable entry in both tiers.
+        """
+        with self._lock:
+            self._remember((kind, key), value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (kind, key, value) VALUES (?, ?, ?)", (kind, key, json.dumps(value))
+                )
+                self._db.commit()
+
+    def _remember(self, cache_key, value):
+        self._memory[cache_key] = value
+        self._memory.move_to_end(cache_key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
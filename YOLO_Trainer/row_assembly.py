@@ -0,0 +1,115 @@
+"""
+Group itemized detections (Item/Quantity/Price/Sub Price) into receipt rows.
+
+Boxes are sorted once by vertical center and swept top to bottom. A box joins the current row when
+it overlaps the row's vertical band by at least min_overlap of the shorter of the two heights;
+otherwise it starts a new row. Sorting dominates, so assembly is O(n log n) and stays fast on
+receipts with hundreds of lines.
+"""
+import numpy as np
+
+# "Quantitiy" is how the itemized dataset spells it
+ROW_LABELS = ("Item", "Quantity", "Quantitiy", "Price", "Sub Price")
+
+
+def assemble_rows(boxes, class_ids, labels, min_overlap=0.5, row_labels=ROW_LABELS):
+    """
+    Group boxes into rows.
+
+    Args:
+        boxes (np.ndarray): [N, 4] boxes in (x1, y1, x2, y2) pixel coordinates.
+        class_ids (np.ndarray): [N] class ids indexing labels.
+        labels (list): Class labels of the itemized model.
+        min_overlap (float): Minimum vertical overlap, relative to the shorter height, to share a row. Default is 0.5.
+        row_labels (tuple): Labels that belong to rows; other classes (e.g. "Total Price") are ignored.
+    Returns:
+        list: Rows from top to bottom. Each row is a dict mapping a label to the indices of its boxes in left
+        to right order, plus "box": the (x1, y1, x2, y2) union of the row.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    class_ids = np.asarray(class_ids, dtype=np.int64)
+    row_classes = [i for i, label in enumerate(labels) if label in row_labels]
+    candidates = np.flatnonzero(np.isin(class_ids, row_classes))
+    if not len(candidates):
+        return []
+
+    centers = (boxes[candidates, 1] + boxes[candidates, 3]) / 2
+    order = candidates[np.argsort(centers, kind="stable")]
+    tops, bottoms = boxes[order, 1].tolist(), boxes[order, 3].tolist()
+
+    rows = []
+    members = [order[0]]
+    band_top, band_bottom = tops[0], bottoms[0]
+    for position in range(1, len(order)):
+        top, bottom = tops[position], bottoms[position]
+        overlap = min(bottom, band_bottom) - max(top, band_top)
+        shorter = max(min(bottom - top, band_bottom - band_top), 1e-6)
+        if overlap / shorter >= min_overlap:
+            members.append(order[position])
+            # The band follows the members' mean extent so one tall box cannot chain rows together
+            count = len(members)
+            band_top += (top - band_top) / count
+            band_bottom += (bottom - band_bottom) / count
+        else:
+            rows.append(_make_row(members, boxes, class_ids, labels))
+            members = [order[position]]
+            band_top, band_bottom = top, bottom
+    rows.append(_make_row(members, boxes, class_ids, labels))
+    return rows
+
+
+def _make_row(members, boxes, class_ids, labels):
+    members = np.asarray(members)
+    members = members[np.argsort(boxes[members, 0], kind="stable")]  # Left to right
+    row = {}
+    for index in members.tolist():
+        row.setdefault(labels[class_ids[index]], []).append(index)
+    member_boxes = boxes[members]
+    row["box"] = (float(member_boxes[:, 0].min()), float(member_boxes[:, 1].min()),
+                  float(member_boxes[:, 2].max()), float(member_boxes[:, 3].max()))
+    return row
+
+
+def row_crops(pixels, boxes, rows):
+    """
+    Crop every box of every row as a view into the image array (no copies, nothing written to disk).
+
+    Args:
+        pixels (np.ndarray): Image as an [H, W] or [H, W, C] array.
+        boxes (np.ndarray): [N, 4] boxes the rows index into.
+        rows (list): Output of assemble_rows.
+    Returns:
+        list: Per row, a dict mapping each label to the list of crops of its boxes.
+    """
+    height, width = pixels.shape[:2]
+    clipped = np.clip(np.round(np.asarray(boxes)), 0, [width, height, width, height]).astype(np.int64)
+    crops = []
+    for row in rows:
+        crops.append({
+            label: [pixels[clipped[i, 1]:clipped[i, 3], clipped[i, 0]:clipped[i, 2]] for i in indices]
+            for label, indices in row.items() if label != "box"
+        })
+    return crops
+
+
+def rows_to_item_lines(rows, texts, name_label="Item", price_labels=("Sub Price", "Price")):
+    """
+    Join the OCR text of each row into the "name price" lines parse_receipt_data expects.
+
+    Args:
+        rows (list): Output of assemble_rows.
+        texts (list): OCR text per box index.
+        name_label (str): Label of the item name boxes. Default is "Item".
+        price_labels (tuple): Labels tried in order for the row's price; a line total ("Sub Price") wins over
+            a unit price. Default is ("Sub Price", "Price").
+    Returns:
+        list: One line per row with an item name; rows without a price keep just the name.
+    """
+    lines = []
+    for row in rows:
+        if name_label not in row:
+            continue
+        name = " ".join(texts[i] for i in row[name_label] if texts[i])
+        price = next((texts[row[label][-1]] for label in price_labels if label in row and texts[row[label][-1]]), None)
+        lines.append(f"{name} {price}" if price else name)
+    return lines
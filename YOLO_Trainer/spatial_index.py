@@ -0,0 +1,71 @@
+import numpy as np
+
+
+class GridIndex:
+    def __init__(self, boxes, cell_size: float = None):
+        """
+        Uniform-grid spatial index over axis-aligned boxes.
+
+        Each box is registered in every grid cell it touches, so a query only has to test the boxes
+        sharing a cell with it instead of every box on the page.
+
+        Args:
+            boxes (np.ndarray): [R, 4] boxes in (x1, y1, x2, y2) format.
+            cell_size (float, optional): Grid cell edge length in pixels. Default is the median box height,
+                which keeps the number of boxes per cell small on receipts.
+        """
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        if cell_size is None:
+            heights = self.boxes[:, 3] - self.boxes[:, 1]
+            cell_size = float(np.median(heights)) if len(heights) else 1.0
+        self.cell_size = max(cell_size, 1.0)
+
+        self.cells = {}
+        cells = np.floor(self.boxes / self.cell_size).astype(np.int64)
+        for index, (cx1, cy1, cx2, cy2) in enumerate(cells.tolist()):
+            for cy in range(cy1, cy2 + 1):
+                for cx in range(cx1, cx2 + 1):
+                    self.cells.setdefault((cx, cy), []).append(index)
+
+    def candidates(self, box):
+        """
+        Return the indices of indexed boxes that share at least one grid cell with a query box.
+        """
+        cx1, cy1, cx2, cy2 = np.floor(np.asarray(box, dtype=np.float32) / self.cell_size).astype(np.int64).tolist()
+        found = set()
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                found.update(self.cells.get((cx, cy), ()))
+        return sorted(found)
+
+
+def assign_words_to_regions(word_boxes, region_boxes, min_overlap: float = 0.5):
+    """
+    Assign each OCR word to the detected region covering most of it.
+
+    Args:
+        word_boxes (np.ndarray): [W, 4] word boxes in (x1, y1, x2, y2) format.
+        region_boxes (np.ndarray): [R, 4] region boxes in (x1, y1, x2, y2) format.
+        min_overlap (float): Minimum fraction of the word's area that must fall inside a region. Default is 0.5.
+    Returns:
+        np.ndarray: int64 array of shape [W] with the region index of each word, or -1 for unassigned words.
+    """
+    word_boxes = np.asarray(word_boxes, dtype=np.float32).reshape(-1, 4)
+    assignments = np.full(len(word_boxes), -1, dtype=np.int64)
+    if len(word_boxes) == 0 or len(region_boxes) == 0:
+        return assignments
+
+    index = GridIndex(region_boxes)
+    word_areas = np.maximum((word_boxes[:, 2] - word_boxes[:, 0]) * (word_boxes[:, 3] - word_boxes[:, 1]), 1e-7)
+    for word_index, word_box in enumerate(word_boxes):
+        candidates = index.candidates(word_box)
+        if not candidates:
+            continue
+        regions = index.boxes[candidates]
+        inter_w = (np.minimum(word_box[2], regions[:, 2]) - np.maximum(word_box[0], regions[:, 0])).clip(0)
+        inter_h = (np.minimum(word_box[3], regions[:, 3]) - np.maximum(word_box[1], regions[:, 1])).clip(0)
+        overlap = inter_w * inter_h / word_areas[word_index]
+        best = int(overlap.argmax())
+        if overlap[best] >= min_overlap:
+            assignments[word_index] = candidates[best]
+    return assignments
@@ -0,0 +1,19 @@
+"""
+Cold-start budget of receipt_inference, as checked by benchmarks.import_budget.
+
+Run from the YOLO_Trainer directory:
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.import_budget import BUDGETED_MODULE, MAX_RSS_MB, MAX_SECONDS, measure  # noqa: E402
+
+
+def test_receipt_inference_import_budget():
+    result = measure(BUDGETED_MODULE, runs=3)
+    assert result["loaded"] == []
+    assert result["seconds"] <= MAX_SECONDS
+    assert result["rss_mb"] <= MAX_RSS_MB
@@ -0,0 +1,325 @@
+"""
+Threshold sweeps over cached predictions.
+
+Inference over the validation split runs once: the decoded pre-NMS candidates (everything above a very
+low confidence) and the ground truth are stored as .npy files that are memory-mapped on load. NMS,
+matching, precision, recall and AP are then recomputed from the cache for any grid of confidence and
+NMS IOU thresholds, and the best operating point is reported per class.
+
+Greedy NMS commutes with a confidence cut (a box under the cut can only suppress boxes under the cut),
+so NMS and matching run once per IOU value and every confidence threshold is a cumulative-sum lookup.
+
+Usage (from the YOLO_Trainer directory):
+    python threshold_sweep.py build model/train15/weights/best.onnx dataset/data.yaml sweep_cache/
+    python threshold_sweep.py sweep sweep_cache/ --conf 0.05:0.6:0.05 --iou 0.3:0.8:0.1
+"""
+import argparse
+import json
+import os
+from typing import NamedTuple
+
+import numpy as np
+import yaml
+
+from dataset_compiler import IMAGE_EXTENSIONS, label_path, read_labels, resolve_split_dir
+from postprocess import batched_nms, decode_predictions
+
+
+class PredictionCache(NamedTuple):
+    """
+    Memory-mapped candidates and ground truth of one split.
+
+    Attributes:
+        boxes (np.ndarray): float32 [M, 4] candidate boxes in image pixels.
+        scores (np.ndarray): float32 [M] candidate confidences.
+        class_ids (np.ndarray): int16 [M] candidate classes.
+        offsets (np.ndarray): int64 [I + 1]; candidates of image i are offsets[i]:offsets[i + 1].
+        gt_boxes (np.ndarray): float32 [G, 4] ground-truth boxes in image pixels.
+        gt_class_ids (np.ndarray): int16 [G] ground-truth classes.
+        gt_offsets (np.ndarray): int64 [I + 1]; ground truth of image i is gt_offsets[i]:gt_offsets[i + 1].
+        names (list): Class names.
+    """
+    boxes: np.ndarray
+    scores: np.ndarray
+    class_ids: np.ndarray
+    offsets: np.ndarray
+    gt_boxes: np.ndarray
+    gt_class_ids: np.ndarray
+    gt_offsets: np.ndarray
+    names: list
+
+
+def _concatenate(parts, dtype, empty_shape=(0,)):
+    return np.concatenate(parts).astype(dtype) if parts else np.zeros(empty_shape, dtype=dtype)
+
+
+def build_prediction_cache(model_path, yaml_path, cache_dir, split="val", min_conf=0.001, max_candidates=1000):
+    """
+    Run the ONNX model once over a split and store its pre-NMS candidates and the ground truth.
+
+    Images go through the same preprocessing as the receipt pipeline (preprocess_image).
+
+    Args:
+        model_path (str): ONNX detection model.
+        yaml_path (str): Dataset YAML.
+        cache_dir (str): Output directory.
+        split (str): Split key in the YAML. Default is "val".
+        min_conf (float): Lowest confidence kept; the sweep cannot go below it. Default is 0.001.
+        max_candidates (int): Highest-scoring candidates kept per image. Default is 1000.
+    Returns:
+        str: The cache directory.
+    """
+    from main_prediction import preprocess_image
+    from receipt_detector import get_detector
+
+    with open(yaml_path, "r") as file:
+        yaml_data = yaml.safe_load(file)
+    names = list(yaml_data["names"].values()) if isinstance(yaml_data["names"], dict) else yaml_data["names"]
+    image_dir = resolve_split_dir(yaml_path, yaml_data[split])
+    image_paths = sorted(
+        os.path.join(root, name)
+        for root, _, files in os.walk(image_dir)
+        for name in files
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+    detector = get_detector(model_path)
+    boxes, scores, class_ids, counts = [], [], [], []
+    gt_boxes, gt_class_ids, gt_counts = [], [], []
+    for path in image_paths:
+        input_data, image = preprocess_image(path, input_size=detector.input_size)
+        candidates = decode_predictions(
+            detector.run(input_data)[0],
+            conf_threshold=min_conf,
+            num_classes=len(names),
+            input_size=detector.input_size,
+            image_size=image.size,
+        )
+        top = np.argsort(-candidates.scores, kind="stable")[:max_candidates]
+        boxes.append(candidates.boxes[top])
+        scores.append(candidates.scores[top])
+        class_ids.append(candidates.class_ids[top])
+        counts.append(len(top))
+
+        width, height = image.size
+        labels = read_labels(label_path(path))
+        xywh = labels[:, 1:] * np.array([width, height, width, height], dtype=np.float32)
+        gt_boxes.append(np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1))
+        gt_class_ids.append(labels[:, 0])
+        gt_counts.append(len(labels))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    arrays = {
+        "boxes": _concatenate(boxes, np.float32, (0, 4)),
+        "scores": _concatenate(scores, np.float32),
+        "class_ids": _concatenate(class_ids, np.int16),
+        "offsets": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        "gt_boxes": _concatenate(gt_boxes, np.float32, (0, 4)),
+        "gt_class_ids": _concatenate(gt_class_ids, np.int16),
+        "gt_offsets": np.concatenate([[0], np.cumsum(gt_counts)]).astype(np.int64),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(cache_dir, f"{name}.npy"), array)
+    with open(os.path.join(cache_dir, "meta.json"), "w") as file:
+        json.dump({"names": names, "model": os.path.abspath(model_path), "yaml": os.path.abspath(yaml_path),
+                   "split": split, "min_conf": min_conf, "images": len(image_paths)}, file, indent=2)
+    print(f"Cached {len(arrays['scores'])} candidates for {len(image_paths)} images in {cache_dir}")
+    return cache_dir
+
+
+def load_prediction_cache(cache_dir):
+    """
+    Open a cache written by build_prediction_cache, memory-mapping the arrays.
+    """
+    with open(os.path.join(cache_dir, "meta.json"), "r") as file:
+        meta = json.load(file)
+    arrays = {name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r")
+              for name in PredictionCache._fields if name != "names"}
+    return PredictionCache(names=meta["names"], **arrays)
+
+
+def box_iou(a, b):
+    """
+    Pairwise IoU of two sets of [x1, y1, x2, y2] boxes as an [len(a), len(b)] matrix.
+    """
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+
+def _match_image(boxes, scores, class_ids, gt_boxes, gt_class_ids, match_ious):
+    """
+    Greedy COCO-style matching: in descending score order each detection takes the best unmatched
+    ground truth of its class. Returns a [D, len(match_ious)] true-positive table.
+    """
+    tp = np.zeros((len(boxes), len(match_ious)), dtype=bool)
+    if not len(boxes) or not len(gt_boxes):
+        return tp
+    iou = box_iou(boxes, gt_boxes)
+    iou[class_ids[:, None] != gt_class_ids[None, :]] = 0
+    for column, threshold in enumerate(match_ious):
+        taken = np.zeros(len(gt_boxes), dtype=bool)
+        for detection in np.argsort(-scores, kind="stable"):
+            candidates = np.where(taken, 0, iou[detection])
+            best = candidates.argmax()
+            if candidates[best] >= threshold:
+                taken[best] = True
+                tp[detection, column] = True
+    return tp
+
+
+def _average_precision(tp_sorted, num_gt):
+    """
+    AP of one ranked list (101-point interpolation, as in COCO/ultralytics).
+    """
+    if num_gt == 0 or not len(tp_sorted):
+        return 0.0
+    tp_cumulative = np.cumsum(tp_sorted)
+    recall = tp_cumulative / num_gt
+    precision = tp_cumulative / np.arange(1, len(tp_sorted) + 1)
+    envelope = np.maximum.accumulate(precision[::-1])[::-1]
+    points = np.linspace(0, 1, 101)
+    index = np.searchsorted(recall, points, side="left")
+    return float(np.where(index < len(envelope), envelope[np.minimum(index, len(envelope) - 1)], 0).mean())
+
+
+def sweep(cache, conf_thresholds, iou_thresholds, match_ious=(0.5,)):
+    """
+    Precision, recall, F1 and AP for every (confidence, NMS IOU) pair and class.
+
+    Args:
+        cache (PredictionCache): Output of load_prediction_cache.
+        conf_thresholds (list): Confidence thresholds.
+        iou_thresholds (list): NMS IOU thresholds.
+        match_ious (tuple): IOU thresholds for matching to ground truth; AP is averaged over them, precision and
+            recall use the first. Use np.arange(0.5, 0.96, 0.05) for mAP50-95. Default is (0.5,).
+    Returns:
+        dict: Arrays indexed [iou, conf, class]: "precision", "recall", "f1", "ap", plus "map" [iou, conf] and the
+        threshold grids and class names.
+    """
+    conf_thresholds = np.asarray(sorted(conf_thresholds), dtype=np.float32)
+    iou_thresholds = np.asarray(iou_thresholds, dtype=np.float32)
+    num_classes = len(cache.names)
+    gt_class_ids = np.asarray(cache.gt_class_ids)
+    num_gt = np.bincount(gt_class_ids.astype(np.int64), minlength=num_classes)[:num_classes]
+    shape = (len(iou_thresholds), len(conf_thresholds), num_classes)
+    precision, recall, ap = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+
+    for i, iou_threshold in enumerate(iou_thresholds):
+        kept_scores, kept_classes, kept_tp = [], [], []
+        for image in range(len(cache.offsets) - 1):
+            start, end = cache.offsets[image], cache.offsets[image + 1]
+            boxes, scores = np.asarray(cache.boxes[start:end]), np.asarray(cache.scores[start:end])
+            class_ids = np.asarray(cache.class_ids[start:end]).astype(np.int64)
+            keep = batched_nms(boxes, scores, class_ids, float(iou_threshold), max_det=len(boxes))
+            gt_start, gt_end = cache.gt_offsets[image], cache.gt_offsets[image + 1]
+            kept_tp.append(_match_image(boxes[keep], scores[keep], class_ids[keep],
+                                        np.asarray(cache.gt_boxes[gt_start:gt_end]),
+                                        gt_class_ids[gt_start:gt_end].astype(np.int64), match_ious))
+            kept_scores.append(scores[keep])
+            kept_classes.append(class_ids[keep])
+        scores = np.concatenate(kept_scores) if kept_scores else np.zeros(0, np.float32)
+        classes = np.concatenate(kept_classes) if kept_classes else np.zeros(0, np.int64)
+        tp = np.concatenate(kept_tp) if kept_tp else np.zeros((0, len(match_ious)), bool)
+
+        for class_id in range(num_classes):
+            selected = classes == class_id
+            order = np.argsort(-scores[selected], kind="stable")
+            class_scores, class_tp = scores[selected][order], tp[selected][order]
+            # Detections at or above each confidence threshold form a prefix of the ranked list
+            counts = np.searchsorted(-class_scores, -conf_thresholds, side="right")
+            tp_cumulative = np.concatenate([[0], np.cumsum(class_tp[:, 0])])
+            hits = tp_cumulative[counts]
+            precision[i, :, class_id] = np.where(counts > 0, hits / np.maximum(counts, 1), 0)
+            recall[i, :, class_id] = hits / num_gt[class_id] if num_gt[class_id] else 0
+            for j, count in enumerate(counts.tolist()):
+                ap[i, j, class_id] = np.mean([_average_precision(class_tp[:count, column], num_gt[class_id])
+                                              for column in range(len(match_ious))])
+
+    f1 = 2 * precision * recall / np.maximum(precision + recall, 1e-9)
+    present = num_gt > 0
+    return {
+        "names": cache.names,
+        "conf_thresholds": conf_thresholds,
+        "iou_thresholds": iou_thresholds,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "ap": ap,
+        "map": ap[:, :, present].mean(axis=2) if present.any() else np.zeros(shape[:2]),
+        "num_gt": num_gt,
+    }
+
+
+def best_operating_points(results, metric="f1"):
+    """
+    The (confidence, NMS IOU) pair maximizing metric for each class, plus the best shared pair for mAP.
+
+    Returns:
+        dict: {class name: {"conf", "iou", "precision", "recall", "f1", "ap"}} and "all" for the best mAP.
+    """
+    best = {}
+    for class_id, name in enumerate(results["names"]):
+        values = results[metric][:, :, class_id]
+        i, j = np.unravel_index(np.argmax(values), values.shape)
+        best[name] = {"conf": round(float(results["conf_thresholds"][j]), 6),
+                      "iou": round(float(results["iou_thresholds"][i]), 6),
+                      **{key: float(results[key][i, j, class_id]) for key in ("precision", "recall", "f1", "ap")},
+                      "instances": int(results["num_gt"][class_id])}
+    i, j = np.unravel_index(np.argmax(results["map"]), results["map"].shape)
+    best["all"] = {"conf": round(float(results["conf_thresholds"][j]), 6),
+                   "iou": round(float(results["iou_thresholds"][i]), 6),
+                   "map": float(results["map"][i, j])}
+    return best
+
+
+def _parse_grid(text):
+    if ":" in text:
+        start, stop, step = (float(value) for value in text.split(":"))
+        return np.round(np.arange(start, stop + step / 2, step), 6).tolist()
+    return [float(value) for value in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Run inference once and cache the candidates")
+    build.add_argument("model", help="ONNX detection model")
+    build.add_argument("yaml_path", help="Dataset YAML")
+    build.add_argument("cache_dir", help="Output directory")
+    build.add_argument("--split", default="val", help="Split key in the YAML")
+    build.add_argument("--min-conf", type=float, default=0.001, help="Lowest cached confidence")
+    run = commands.add_parser("sweep", help="Sweep thresholds over a cache")
+    run.add_argument("cache_dir", help="Cache directory from the build command")
+    run.add_argument("--conf", default="0.05:0.6:0.05", help="start:stop:step or comma-separated list")
+    run.add_argument("--iou", default="0.3:0.8:0.1", help="start:stop:step or comma-separated list")
+    run.add_argument("--map50-95", action="store_true", help="Average AP over match IOUs 0.5:0.95")
+    run.add_argument("--output", default=None, help="Write the best operating points as JSON")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_prediction_cache(args.model, args.yaml_path, args.cache_dir, args.split, args.min_conf)
+        return
+
+    match_ious = tuple(np.round(np.arange(0.5, 0.96, 0.05), 2)) if args.map50_95 else (0.5,)
+    results = sweep(load_prediction_cache(args.cache_dir), _parse_grid(args.conf), _parse_grid(args.iou), match_ious)
+    best = best_operating_points(results)
+    print(f"{'Class':<14}{'conf':>6}{'iou':>6}{'P':>8}{'R':>8}{'F1':>8}{'AP':>8}{'GT':>6}")
+    for name, point in best.items():
+        if name != "all":
+            print(f"{name:<14}{point['conf']:>6.2f}{point['iou']:>6.2f}{point['precision']:>8.3f}"
+                  f"{point['recall']:>8.3f}{point['f1']:>8.3f}{point['ap']:>8.3f}{point['instances']:>6}")
+    print(f"Best shared thresholds: conf={best['all']['conf']:.2f} iou={best['all']['iou']:.2f} "
+          f"mAP={best['all']['map']:.4f}")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(best, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
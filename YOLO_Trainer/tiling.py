@@ -0,0 +1,150 @@
+"""
+Tiled inference for long receipts.
+
+Squashing a 1:6 receipt into one 640x640 input shrinks its text vertically by 6x. In tiled mode the
+image is cut along its long side into overlapping square tiles (side = the short side of the image),
+each tile is resized to the model input, and the tiles run as batches of at most max_batch through a
+single session. Boxes are mapped back to page coordinates and merged across tiles: besides the usual
+IOU test, a box cut by a tile border is merged with the complete box from the neighbouring tile
+(their union is kept) when most of it lies inside that box.
+
+The number of tiles follows the aspect ratio, so receipts up to max_aspect take a single pass.
+"""
+import numpy as np
+from PIL import Image
+
+from postprocess import Detections
+
+
+def plan_tiles(image_size, overlap=0.2, max_aspect=1.5):
+    """
+    Cut an image into overlapping square tiles along its long side.
+
+    Args:
+        image_size (tuple): (width, height) of the image.
+        overlap (float): Fraction of a tile shared with its neighbour. Default is 0.2.
+        max_aspect (float): Images whose long/short side ratio is at most this take a single tile (the whole
+            image). Default is 1.5.
+    Returns:
+        list: Tiles as (x1, y1, x2, y2) pixel boxes, in reading order.
+    """
+    width, height = image_size
+    short, long = min(width, height), max(width, height)
+    if long <= short * max_aspect:
+        return [(0, 0, width, height)]
+
+    stride = short * (1 - overlap)
+    count = int(np.ceil((long - short) / stride)) + 1
+    # Spread the tiles evenly so the last one ends exactly at the border
+    starts = np.round(np.linspace(0, long - short, count)).astype(int).tolist()
+    if height >= width:
+        return [(0, start, width, start + short) for start in starts]
+    return [(start, 0, start + short, height) for start in starts]
+
+
+def _pairwise_overlaps(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    iou = intersection / np.maximum(area + areas - intersection, 1e-9)
+    ios = intersection / np.maximum(np.minimum(area, areas), 1e-9)  # Intersection over the smaller box
+    return iou, ios
+
+
+def merge_tile_detections(detections, tiles, iou_threshold=0.5, ios_threshold=0.8, max_det=300):
+    """
+    Merge per-tile detections (already in page coordinates) with cross-tile NMS.
+
+    Args:
+        detections (list): One Detections per tile, in page coordinates.
+        tiles (list): The tiles the detections came from.
+        iou_threshold (float): Same-class boxes above this IOU are duplicates. Default is 0.5.
+        ios_threshold (float): Same-class boxes from different tiles are merged into their union when this
+            fraction of the smaller one lies inside the other (a box cut by a tile border). Default is 0.8.
+        max_det (int): Maximum number of detections kept. Default is 300.
+    Returns:
+        Detections: Merged detections, highest score first.
+    """
+    if len(detections) == 1:
+        return detections[0]
+    sizes = [len(d) for d in detections]
+    if not sum(sizes):
+        return Detections.empty()
+    boxes = np.concatenate([d.boxes for d in detections])
+    scores = np.concatenate([d.scores for d in detections])
+    class_ids = np.concatenate([d.class_ids for d in detections])
+    tile_ids = np.repeat(np.arange(len(tiles)), sizes)
+
+    order = np.argsort(-scores, kind="stable")
+    keep, merged = [], []
+    while len(order) and len(keep) < max_det:
+        best, rest = order[0], order[1:]
+        iou, ios = _pairwise_overlaps(boxes[best], boxes[rest])
+        same_class = class_ids[rest] == class_ids[best]
+        cut = same_class & (tile_ids[rest] != tile_ids[best]) & (ios > ios_threshold)
+        # A border-cut box and its complete counterpart describe one object: keep the union of both
+        box = boxes[best].copy()
+        if cut.any():
+            parts = boxes[rest[cut]]
+            box[:2] = np.minimum(box[:2], parts[:, :2].min(axis=0))
+            box[2:] = np.maximum(box[2:], parts[:, 2:].max(axis=0))
+        keep.append(best)
+        merged.append(box)
+        order = rest[~(cut | (same_class & (iou > iou_threshold)))]
+    return Detections(np.asarray(merged, dtype=np.float32).reshape(-1, 4), scores[keep], class_ids[keep])
+
+
+def detect_tiled(detector, image, num_classes=None, conf_threshold=0.1, iou_threshold=0.5, overlap=0.2,
+                 max_aspect=1.5, max_batch=8):
+    """
+    Run a ReceiptDetector over the tiles of a (preprocessed grayscale) receipt image.
+
+    Args:
+        detector (ReceiptDetector): Detector to run; tiles are resized to its input size.
+        image (PIL.Image): Full-resolution grayscale, contrast-enhanced receipt image.
+        num_classes (int, optional): Number of classes, used to disambiguate the output layout.
+        conf_threshold (float): Confidence threshold for filtering detections.
+        iou_threshold (float): IOU threshold for NMS within and across tiles.
+        overlap (float): Fraction of a tile shared with its neighbour. Default is 0.2.
+        max_aspect (float): Aspect ratio up to which a single pass is used. Default is 1.5.
+        max_batch (int): Tiles per session call; bounds the input buffer to max_batch tiles. Default is 8.
+    Returns:
+        Detections: Merged detections in image coordinates.
+        list: The tiles that were run.
+    """
+    tiles = plan_tiles(image.size, overlap, max_aspect)
+    width, height = detector.input_size
+    if detector.fixed_batch:
+        max_batch = detector.fixed_batch
+    buffer = np.empty((min(max_batch, len(tiles)), 3, height, width), dtype=np.float32)
+
+    per_tile = []
+    for start in range(0, len(tiles), max_batch):
+        chunk = tiles[start:start + max_batch]
+        for row, tile in enumerate(chunk):
+            resized = image.crop(tile).resize(detector.input_size)
+            np.divide(np.asarray(resized), np.float32(255), out=buffer[row], casting="unsafe")
+        batch_detections = detector.detect_batch(
+            buffer[:len(chunk)],
+            image_sizes=[(x2 - x1, y2 - y1) for x1, y1, x2, y2 in chunk],
+            num_classes=num_classes,
+            conf_threshold=conf_threshold,
+            iou_threshold=iou_threshold,
+        )
+        for (x1, y1, _, _), detections in zip(chunk, batch_detections):
+            offset = np.array([x1, y1, x1, y1], dtype=np.float32)
+            per_tile.append(Detections(detections.boxes + offset, detections.scores, detections.class_ids))
+    return merge_tile_detections(per_tile, tiles, iou_threshold), tiles
+
+
+def crop_tiles(pixels, tiles):
+    """
+    Cut an image array into tiles as views (for models that take whole images, like ultralytics predict).
+    """
+    if isinstance(pixels, Image.Image):
+        pixels = np.asarray(pixels)
+    return [pixels[y1:y2, x1:x2] for x1, y1, x2, y2 in tiles]
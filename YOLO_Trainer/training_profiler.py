@@ -0,0 +1,279 @@
+"""
+Training throughput profiler built on ultralytics trainer callbacks.
+
+Every training batch is split into the time the loop waited for the dataloader (from the end of the
+previous batch, or the start of the epoch, to on_train_batch_start) and the time spent on the batch
+itself (forward, backward and optimizer step, up to on_train_batch_end). With CPU and RSS samples of
+the trainer and its dataloader workers, each batch becomes one row of profile.csv next to the run's
+results.csv, and each epoch ends with a one-line verdict: dataloader-bound or compute-bound.
+
+probe_settings() runs a few batches for each batch/worker combination and recommends the fastest.
+ultralytics trains on CPU (and MPS) with 0 dataloader workers whatever was requested; the probe reports
+the worker count the trainer actually used and then skips worker counts that would be overridden the same way.
+
+Usage (from the YOLO_Trainer directory):
+    python training_profiler.py yolo11n.pt dataset/data.yaml --batch 8 16 32 --workers 2 4 8
+"""
+import argparse
+import csv
+import os
+import statistics
+import tempfile
+import time
+
+import psutil
+
+CSV_COLUMNS = ("epoch", "batch", "images", "wait_s", "compute_s", "images_per_s", "cpu_percent",
+               "system_cpu_percent", "rss_mb")
+# A batch spending more than this fraction waiting for data means more workers (or a compiled dataset) will help
+DATALOADER_BOUND_FRACTION = 0.3
+
+
+class _ProbeFinished(Exception):
+    """
+    Raised from a callback to end a probe run after its batches.
+    """
+
+
+class TrainingProfiler:
+    def __init__(self, csv_name="profile.csv", sync_cuda=True, max_batches=None):
+        """
+        Per-batch dataloader/compute timings of an ultralytics training run.
+
+        Args:
+            csv_name (str): File written in the run directory, next to results.csv. Default is "profile.csv".
+            sync_cuda (bool): Synchronize CUDA at batch boundaries so GPU work is attributed to the batch that
+                queued it. Default is True.
+            max_batches (int, optional): Stop training after this many batches (used by probe_settings).
+        """
+        self.csv_name = csv_name
+        self.sync_cuda = sync_cuda
+        self.max_batches = max_batches
+        self.rows = []
+        self.csv_path = None
+        self.workers = None  # Dataloader workers the trainer actually used
+        self._process = psutil.Process()
+        self._epoch_rows = 0
+        self._ready = None  # When the loop started waiting for the next batch
+        self._batch_start = None
+        self._batch_index = 0
+        self._file = None
+        self._writer = None
+        self._model = None
+        self._callbacks = ()
+
+    def attach(self, model):
+        """
+        Register the callbacks on an ultralytics YOLO model for its next train() call only; they are removed
+        again when that training ends (or by close()).
+        """
+        self._model = model
+        self._callbacks = (
+            ("on_train_epoch_start", self.on_train_epoch_start),
+            ("on_train_batch_start", self.on_train_batch_start),
+            ("on_train_batch_end", self.on_train_batch_end),
+            ("on_train_epoch_end", self.on_train_epoch_end),
+            ("on_train_end", self.on_train_end),
+            ("teardown", self.on_train_end),
+        )
+        for event, callback in self._callbacks:
+            model.add_callback(event, callback)
+        return self
+
+    def close(self):
+        """
+        Close profile.csv and remove the callbacks from the model. Safe to call more than once.
+        """
+        if self._file is not None:
+            self._file.close()
+            print(f"Training profile saved to: {self.csv_path}")
+        self._file = None
+        self._writer = None
+        if self._model is not None:
+            for event, callback in self._callbacks:
+                # Rebind rather than mutate: the trainer may be iterating the current list right now
+                self._model.callbacks[event] = [other for other in self._model.callbacks[event]
+                                                if other != callback]
+        self._model = None
+        self._callbacks = ()
+
+    def _sync(self, trainer):
+        if self.sync_cuda and trainer.device.type == "cuda":
+            import torch
+
+            torch.cuda.synchronize(trainer.device)
+
+    def on_train_epoch_start(self, trainer):
+        if self._writer is None:
+            self.csv_path = os.path.join(str(trainer.save_dir), self.csv_name)
+            self._file = open(self.csv_path, "w", newline="")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(CSV_COLUMNS)
+            self.workers = trainer.train_loader.num_workers
+        self._batch_index = 0
+        self._epoch_rows = len(self.rows)
+        self._process.cpu_percent(None)  # Start the CPU counters for this epoch
+        psutil.cpu_percent(None)
+        self._ready = time.perf_counter()
+
+    def on_train_batch_start(self, trainer):
+        self._sync(trainer)
+        self._batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, trainer):
+        self._sync(trainer)
+        end = time.perf_counter()
+        wait, compute = self._batch_start - self._ready, end - self._batch_start
+
+        # The last batch of an epoch holds the remainder of the dataset
+        dataset_size = len(trainer.train_loader.dataset)
+        images = min(trainer.batch_size, dataset_size - self._batch_index * trainer.batch_size)
+        rss = self._process.memory_info().rss
+        for worker in self._process.children(recursive=True):  # Dataloader workers
+            try:
+                rss += worker.memory_info().rss
+            except psutil.Error:
+                pass
+        row = (trainer.epoch, self._batch_index, images, round(wait, 6), round(compute, 6),
+               round(images / max(wait + compute, 1e-9), 2), self._process.cpu_percent(None),
+               psutil.cpu_percent(None), round(rss / 2 ** 20, 1))
+        self.rows.append(row)
+        self._writer.writerow(row)
+        self._batch_index += 1
+        if self.max_batches and len(self.rows) >= self.max_batches:
+            raise _ProbeFinished()
+        self._ready = time.perf_counter()  # Time spent in the callbacks above is not charged to the loader
+
+    def on_train_epoch_end(self, trainer):
+        self._file.flush()
+        summary = summarize(self.rows[self._epoch_rows:])
+        if summary:
+            print(f"Epoch {trainer.epoch + 1} profile: {summary['images_per_s']:.1f} img/s, "
+                  f"{summary['wait_fraction']:.0%} of batch time waiting for data ({summary['bound']}), "
+                  f"peak RSS {summary['peak_rss_mb']:.0f} MB")
+
+    def on_train_end(self, trainer):
+        self.close()
+
+    def summary(self, skip_batches=0):
+        """
+        Summarize the recorded batches; see summarize.
+        """
+        return summarize(self.rows[skip_batches:])
+
+
+def summarize(rows):
+    """
+    Aggregate profile rows.
+
+    Returns:
+        dict: Total "images", overall "images_per_s", "wait_fraction" of batch time spent waiting for the
+        dataloader, median "wait_s" and "compute_s" per batch, "peak_rss_mb" and "bound" ("dataloader" or
+        "compute"). Empty for no rows.
+    """
+    if not rows:
+        return {}
+    images = sum(row[2] for row in rows)
+    wait = sum(row[3] for row in rows)
+    compute = sum(row[4] for row in rows)
+    wait_fraction = wait / max(wait + compute, 1e-9)
+    return {
+        "batches": len(rows),
+        "images": images,
+        "images_per_s": images / max(wait + compute, 1e-9),
+        "wait_fraction": wait_fraction,
+        "wait_s": statistics.median(row[3] for row in rows),
+        "compute_s": statistics.median(row[4] for row in rows),
+        "peak_rss_mb": max(row[8] for row in rows),
+        "bound": "dataloader" if wait_fraction > DATALOADER_BOUND_FRACTION else "compute",
+    }
+
+
+def probe_settings(model_path, data_yaml_path, batch_sizes=(8, 16, 32), workers=(2, 4, 8), batches=20,
+                   warmup_batches=3, img_size=640, **train_args):
+    """
+    Time a few training batches for every batch/worker combination and recommend the fastest.
+
+    Each combination trains a fresh copy of the model in a temporary directory and is stopped after
+    warmup_batches + batches batches; the warmup batches (worker start-up, first allocations) are not counted.
+    ultralytics forces 0 dataloader workers on CPU and MPS devices, so there only one worker count per batch
+    size is run and "workers" reports what the trainer actually used.
+
+    Args:
+        model_path (str): Model to train (.pt weights or a model .yaml).
+        data_yaml_path (str): Dataset YAML.
+        batch_sizes (tuple): Batch sizes to try. Default is (8, 16, 32).
+        workers (tuple): Dataloader worker counts to try. Default is (2, 4, 8).
+        batches (int): Timed batches per combination. Default is 20.
+        warmup_batches (int): Untimed batches per combination. Default is 3.
+        img_size (int): Training image size. Default is 640.
+        **train_args: Extra arguments for model.train (e.g. device, cache).
+    Returns:
+        list: One dict per combination run ("batch", "workers" actually used, "requested_workers" and the
+        summarize fields, or "error"), fastest first.
+    """
+    from ultralytics import YOLO
+
+    results = []
+    overridden_to = None  # Worker count the trainer substituted for the requested one, if it did
+    with tempfile.TemporaryDirectory() as project:
+        for batch in batch_sizes:
+            for worker_count in workers:
+                if overridden_to is not None and any(entry["batch"] == batch for entry in results):
+                    continue  # Would run with overridden_to workers again
+                print(f"Probing batch={batch} workers={worker_count}...")
+                model = YOLO(model_path)
+                profiler = TrainingProfiler(max_batches=warmup_batches + batches).attach(model)
+                entry = {"batch": batch, "workers": worker_count, "requested_workers": worker_count}
+                try:
+                    model.train(data=data_yaml_path, epochs=1, imgsz=img_size, batch=batch, workers=worker_count,
+                                project=project, name=f"b{batch}_w{worker_count}", plots=False, val=False,
+                                save=False, verbose=False, **train_args)
+                except _ProbeFinished:
+                    pass
+                except RuntimeError as error:  # e.g. out of memory at a large batch size
+                    entry["error"] = str(error).splitlines()[0]
+                finally:
+                    profiler.close()
+                if profiler.workers is not None and profiler.workers != worker_count:
+                    # 0 means the device override; fewer than requested means capped at the CPU count
+                    entry["workers"] = profiler.workers
+                    print(f"ultralytics ran with {profiler.workers} dataloader workers instead of {worker_count}")
+                    if profiler.workers == 0:
+                        print("It uses 0 workers on CPU/MPS devices; skipping the other worker counts")
+                        overridden_to = 0
+                if "error" not in entry:
+                    entry.update(profiler.summary(skip_batches=warmup_batches))
+                if not any(other["batch"] == batch and other["workers"] == entry["workers"] for other in results):
+                    results.append(entry)  # Overridden runs can repeat a setting already probed
+
+    results.sort(key=lambda entry: -entry.get("images_per_s", 0))
+    print(f"{'batch':>6}{'workers':>9}{'img/s':>9}{'wait %':>8}{'RSS MB':>9}  bound")
+    for entry in results:
+        if "error" in entry:
+            print(f"{entry['batch']:>6}{entry['workers']:>9}  failed: {entry['error']}")
+        else:
+            print(f"{entry['batch']:>6}{entry['workers']:>9}{entry['images_per_s']:>9.1f}"
+                  f"{entry['wait_fraction']:>8.0%}{entry['peak_rss_mb']:>9.0f}  {entry['bound']}")
+    if results and "error" not in results[0]:
+        print(f"Recommended: batch={results[0]['batch']} workers={results[0]['workers']}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", help="Model weights (.pt) or model YAML")
+    parser.add_argument("data", help="Dataset YAML")
+    parser.add_argument("--batch", type=int, nargs="+", default=[8, 16, 32], help="Batch sizes to try")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8], help="Dataloader worker counts to try")
+    parser.add_argument("--batches", type=int, default=20, help="Timed batches per combination")
+    parser.add_argument("--imgsz", type=int, default=640, help="Training image size")
+    parser.add_argument("--device", default=None, help="Training device, e.g. cpu or 0")
+    args = parser.parse_args()
+
+    train_args = {"device": args.device} if args.device else {}
+    probe_settings(args.model, args.data, args.batch, args.workers, args.batches, img_size=args.imgsz, **train_args)
+
+
+if __name__ == "__main__":
+    main()
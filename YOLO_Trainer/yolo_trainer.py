@@ -1,10 +1,79 @@
 from ultralytics import YOLO
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils.plotting import Annotator, colors, save_one_box
 import yaml
 import os
+from pathlib import Path
 import tempfile  # To create temporary YAML files
-import matplotlib.pyplot as plt
+import numpy as np
 from PIL import Image, ImageEnhance
 
+from adaptive import AdaptiveDecision, EscalationPolicy, record_decision, summarize_decisions
+from dataset_compiler import compile_dataset, is_compiled, load_split_cache
+from model_quantization import VARIANTS, build_variants
+from postprocess import Detections
+from threshold_sweep import best_operating_points, build_prediction_cache, load_prediction_cache, sweep
+from tiling import crop_tiles, merge_tile_detections, plan_tiles
+from training_profiler import TrainingProfiler, probe_settings
+
+
+class MmapYOLODataset(YOLODataset):
+    """
+    YOLODataset that reads pre-letterboxed images from a compiled split's memory-mapped images.npy
+    instead of decoding and resizing the JPEGs every epoch.
+    """
+    mmap_path = None
+    mmap_rows = None
+    mmap_dir = None
+    mmap_imgsz = None
+    _mmap_images = None
+
+    def __getstate__(self):
+        # Dataloader workers reopen the map themselves instead of receiving a pickled copy of the array
+        state = self.__dict__.copy()
+        state.pop('_mmap_images', None)
+        return state
+
+    def load_image(self, i, rect_mode=True, **kwargs):
+        row = self.mmap_rows.get(os.path.relpath(self.im_files[i], self.mmap_dir))
+        if row is None or self.mmap_imgsz != self.imgsz:
+            return super().load_image(i, rect_mode, **kwargs)
+        if self._mmap_images is None:
+            self._mmap_images = np.load(self.mmap_path, mmap_mode='r')
+
+        im = np.array(self._mmap_images[row])  # Copy: augmentations modify images in place
+        hw = im.shape[:2]
+        if self.augment:
+            # Keep the mosaic buffer populated like the base class does
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                self.buffer.pop(0)
+        return im, hw, hw
+
+
+class MmapDetectionTrainer(DetectionTrainer):
+    """
+    DetectionTrainer whose datasets use the memory-mapped cache of a compiled dataset when one exists.
+    """
+    def build_dataset(self, img_path, mode='train', batch=None):
+        dataset = super().build_dataset(img_path, mode, batch)
+        images, rows = load_split_cache(img_path)
+        if images is None or type(dataset) is not YOLODataset:
+            return dataset
+        if images.shape[1] != dataset.imgsz:
+            print(f"Ignoring memory-mapped cache {images.filename}: compiled at imgsz={images.shape[1]}, "
+                  f"training at imgsz={dataset.imgsz}")
+            return dataset
+        dataset.__class__ = MmapYOLODataset
+        dataset.mmap_path = images.filename
+        dataset.mmap_rows = rows
+        dataset.mmap_dir = os.path.normpath(img_path)
+        dataset.mmap_imgsz = images.shape[1]
+        print(f"Reading {mode} images from memory-mapped cache: {images.filename}")
+        return dataset
+
+
 class YOLOTrainer:
     def __init__(self, model_path: str, yaml_path: str = None, train_images: str = None, val_images: str = None, class_names: list = None):
         """
@@ -39,11 +108,21 @@ class YOLOTrainer:
         # Initialize the YOLO model
         self.model = YOLO(self.model_path)
 
-    def prepare_data(self):
+    def prepare_data(self, compiled_dir: str = None, img_size: int = 640):
         """
         Prepares the dataset configuration for YOLO training.
         Returns the path to the temporary YAML file containing dataset paths and class metadata.
+
+        Args:
+            compiled_dir (str, optional): Compile the dataset into this directory (images letterboxed once to
+                img_size, memory-mapped image cache, binary label index) and return the compiled YAML instead.
+                Default is None.
+            img_size (int): Image size used when compiling. Default is 640.
         """
+        if compiled_dir and self.yaml_path:
+            # Relative split paths resolve against the original YAML, so compile straight from it
+            return compile_dataset(self.yaml_path, compiled_dir, imgsz=img_size)
+
         data_config = {
             'train': self.train_images,
             'val': self.val_images,
@@ -56,10 +135,17 @@ class YOLOTrainer:
         with open(temp_yaml_path, 'w') as file:
             yaml.dump(data_config, file)
 
+        if compiled_dir:
+            try:
+                return compile_dataset(temp_yaml_path, compiled_dir, imgsz=img_size)
+            finally:
+                os.remove(temp_yaml_path)  # Replaced by the compiled data.yaml
+
         print(f"Temporary dataset YAML saved to: {temp_yaml_path}")
         return temp_yaml_path
 
-    def train(self, data_yaml_path=None, epochs: int = 50, img_size: int = 640, batch_size: int = 16):
+    def train(self, data_yaml_path=None, epochs: int = 50, img_size: int = 640, batch_size: int = 16,
+              compiled_dir: str = None, use_mmap_cache: bool = False, workers: int = None, profile: bool = False):
         """
         Train the YOLO model.
 
@@ -68,19 +154,67 @@ class YOLOTrainer:
             epochs (int): Number of training epochs. Default is 50.
             img_size (int): Image size for training. Default is 640.
             batch_size (int): Batch size for training. Default is 16.
+            compiled_dir (str, optional): Compile the dataset into this directory first (see prepare_data).
+                Ignored when data_yaml_path is given. Default is None.
+            use_mmap_cache (bool): Read training images from the compiled memory-mapped cache. Needs a compiled
+                dataset (compiled_dir, or a data_yaml_path written by dataset_compiler); raises ValueError otherwise.
+                Default is False.
+            workers (int, optional): Dataloader workers. Default is the ultralytics default. Note that ultralytics
+                silently trains with 0 workers on CPU and MPS devices, whatever is passed here.
+            profile (bool): Record per-batch dataloader wait, compute time, images/sec, CPU and RSS to
+                profile.csv next to results.csv (see training_profiler). Default is False.
         """
         if not data_yaml_path:
             # Generate dataset YAML dynamically if not provided
-            data_yaml_path = self.prepare_data()
+            data_yaml_path = self.prepare_data(compiled_dir=compiled_dir, img_size=img_size)
 
         print(f"Starting training with dataset YAML: {data_yaml_path}")
-        self.model.train(
-            data=data_yaml_path,
-            epochs=epochs,
-            imgsz=img_size,
-            batch=batch_size
-        )
+        train_args = {}
+        if use_mmap_cache:
+            if not is_compiled(data_yaml_path):
+                raise ValueError(f"use_mmap_cache needs a compiled dataset YAML (see compiled_dir), "
+                                 f"got: {data_yaml_path}")
+            train_args['trainer'] = MmapDetectionTrainer
+        if workers is not None:
+            train_args['workers'] = workers
+        profiler = TrainingProfiler().attach(self.model) if profile else None
+        try:
+            self.model.train(
+                data=data_yaml_path,
+                epochs=epochs,
+                imgsz=img_size,
+                batch=batch_size,
+                **train_args
+            )
+        finally:
+            if profiler is not None:
+                profiler.close()  # Also when training fails, so the next train() is not profiled into a closed file
         print("Training completed!")
+        if profiler is not None:
+            summary = profiler.summary()
+            if summary:
+                print(f"Throughput: {summary['images_per_s']:.1f} img/s, {summary['wait_fraction']:.0%} of batch time "
+                      f"waiting for data ({summary['bound']}-bound)")
+
+    def probe_loader_settings(self, data_yaml_path=None, batch_sizes=(8, 16, 32), workers=(2, 4, 8),
+                              batches: int = 20, img_size: int = 640):
+        """
+        Try a few batch size / dataloader worker combinations for some batches each and recommend the fastest.
+
+        Args:
+            data_yaml_path (str, optional): Path to the dataset YAML file. Default is None (generated).
+            batch_sizes (tuple): Batch sizes to try. Default is (8, 16, 32).
+            workers (tuple): Worker counts to try. Default is (2, 4, 8). On CPU and MPS ultralytics always uses 0
+                workers, so only one worker count per batch size is run there (see probe_settings).
+            batches (int): Timed batches per combination. Default is 20.
+            img_size (int): Image size for training. Default is 640.
+
+        Returns:
+            list: Throughput per combination, fastest first.
+        """
+        if not data_yaml_path:
+            data_yaml_path = self.prepare_data()
+        return probe_settings(self.model_path, data_yaml_path, batch_sizes, workers, batches, img_size=img_size)
 
     def evaluate(self):
         """
@@ -91,53 +225,232 @@ class YOLOTrainer:
         print(f"Evaluation results:\n{results}")
         return results
 
-    def predict(self, image_path, save_crop: bool = False, save_results: bool = False, conf: float = 0.1):
+    def sweep_thresholds(self, onnx_model: str, cache_dir: str, conf_thresholds=None, iou_thresholds=None,
+                         rebuild: bool = False):
         """
-        Run inference on a given image with preprocessing.
+        Pick confidence and NMS IOU thresholds from one cached inference pass over the validation set.
 
         Args:
-            image_path (str): Path to the input image.
-            save_results (bool): Whether to save the inference results. Default is False.
-            conf (float): Confidence threshold for detections. Default is 0.1.
+            onnx_model (str): Exported ONNX model to evaluate (the model the pipeline serves).
+            cache_dir (str): Prediction cache directory; built on first use.
+            conf_thresholds (list, optional): Confidence grid. Default is 0.05 to 0.6 in steps of 0.05.
+            iou_thresholds (list, optional): NMS IOU grid. Default is 0.3 to 0.8 in steps of 0.1.
+            rebuild (bool): Re-run inference even if the cache exists.
 
         Returns:
-            annotated_images (List[np.ndarray]): List of images with bounding boxes drawn.
+            dict: Best operating point per class and the best shared thresholds ("all").
         """
-        print(f"Running inference on: {image_path}")
+        if rebuild or not os.path.exists(os.path.join(cache_dir, "meta.json")):
+            build_prediction_cache(onnx_model, self.yaml_path or self.prepare_data(), cache_dir)
+        conf_thresholds = conf_thresholds if conf_thresholds is not None else np.arange(0.05, 0.625, 0.05)
+        iou_thresholds = iou_thresholds if iou_thresholds is not None else np.arange(0.3, 0.85, 0.1)
+        best = best_operating_points(sweep(load_prediction_cache(cache_dir), conf_thresholds, iou_thresholds))
+        for name, point in best.items():
+            print(f"{name}: {point}")
+        return best
 
-        # Preprocess the image
-        img = Image.open(image_path).convert("L")  # Convert to grayscale
+    @staticmethod
+    def preprocess_image(source):
+        """
+        Apply the receipt preprocessing (grayscale + contrast enhancement) in memory.
+
+        Args:
+            source (str | PIL.Image | np.ndarray): Image path, PIL image, or HxWx3 BGR / HxW grayscale array.
+
+        Returns:
+            np.ndarray: HxWx3 uint8 array ready for self.model.predict.
+        """
+        if isinstance(source, np.ndarray):
+            # Arrays follow the OpenCV/ultralytics BGR convention
+            img = Image.fromarray(source[..., ::-1] if source.ndim == 3 else source)
+        elif isinstance(source, Image.Image):
+            img = source
+        else:
+            img = Image.open(source)
+        img = img.convert("L")  # Convert to grayscale
         enhancer = ImageEnhance.Contrast(img)
         img = enhancer.enhance(2)  # Enhance contrast
-        preprocessed_path = "preprocessed_receipt.png"
-        img.save(preprocessed_path)
+        return np.repeat(np.asarray(img)[..., None], 3, axis=2)
 
-        # Perform object detection
-        results = self.model.predict(source=preprocessed_path, conf=conf, imgsz=640,save_crop=save_crop)
+    def predict(self, source, save_crop: bool = False, save_results: bool = False, conf: float = 0.1,
+                img_size: int = 640, plot: bool = False, tiled: bool = False, tile_overlap: float = 0.2,
+                adaptive=False, low_img_size: int = 320):
+        """
+        Run inference on one or more images with in-memory preprocessing.
+
+        Args:
+            source (str | PIL.Image | np.ndarray | list): Image path, PIL image or array, or a list of them.
+                Lists are preprocessed and predicted as one batch.
+            save_crop (bool): Whether to save the cropped detections under <save dir>/crops/<class>/. Default is False.
+            save_results (bool): Whether to save the annotated images as <save dir>/prediction_<n>.jpg, where the
+                save dir is the ultralytics predict run directory (runs/detect/predict*). Default is False.
+            conf (float): Confidence threshold for detections. Default is 0.1.
+            img_size (int): Inference image size. Default is 640.
+            plot (bool): Whether to also return annotated images. Default is False.
+            tiled (bool): Cut long receipts into overlapping square tiles along their long side, predict the tiles
+                in batches of up to 8 and merge the boxes across tiles. Receipts up to 1.5:1 still take one pass.
+                Default is False.
+            tile_overlap (float): Fraction of a tile shared with its neighbour in tiled mode. Default is 0.2.
+            adaptive (bool | EscalationPolicy): Predict at low_img_size first and re-run only the images whose result
+                the policy rejects, at img_size or tiled. True uses the default EscalationPolicy. Default is False.
+            low_img_size (int): Image size of the first adaptive pass. Default is 320.
+
+        Returns:
+            detections (List[Detections]): Boxes, scores and class ids for each image, in input order.
+            annotated_images (List[np.ndarray]): Images with bounding boxes drawn, only when plot is True.
+        """
+        sources = source if isinstance(source, list) else [source]
+        print(f"Running inference on {len(sources)} image(s)")
 
-        annotated_images = []
+        # Preprocess in memory and hand the arrays straight to the model
+        images = [self.preprocess_image(item) for item in sources]
+        if adaptive:
+            policy = adaptive if isinstance(adaptive, EscalationPolicy) else EscalationPolicy()
+            detections = self._predict_adaptive(images, conf, img_size, low_img_size, policy, tile_overlap)
+            return self._annotate(images, detections, save_crop, save_results, plot)
+        if tiled:
+            detections = self._predict_tiled(images, conf, img_size, tile_overlap)
+            return self._annotate(images, detections, save_crop, save_results, plot)
+        results = self.model.predict(source=images, conf=conf, imgsz=img_size, save_crop=save_crop, verbose=False)
 
-        # Process results
-        for result in results:
-            print(result.boxes)  # Debug: Print detection boxes
-            annotated_image = result.plot()  # Generate annotated image
-            annotated_images.append(annotated_image)
+        detections = [self._to_detections(result) for result in results]
 
         if save_results:
             # Save annotated images
-            saved_dir = results[0].save()
-            print(f"Annotated results saved to: {saved_dir}")
+            for number, result in enumerate(results):
+                saved_path = result.save(os.path.join(self._save_dir(), f"prediction_{number}.jpg"))
+                print(f"Annotated results saved to: {saved_path}")
+
+        if plot:
+            return detections, [result.plot() for result in results]
+        return detections
+
+    @staticmethod
+    def _to_detections(result):
+        return Detections(
+            result.boxes.xyxy.cpu().numpy().astype(np.float32),
+            result.boxes.conf.cpu().numpy().astype(np.float32),
+            result.boxes.cls.cpu().numpy().astype(np.int64),
+        )
+
+    def _predict_adaptive(self, images, conf, img_size, low_img_size, policy, tile_overlap):
+        labels = [self.model.names[i] for i in range(len(self.model.names))]
+        low_results = self.model.predict(source=images, conf=conf, imgsz=low_img_size, verbose=False)
+        detections = [self._to_detections(result) for result in low_results]
+        reasons = [policy.check(image_detections, labels) for image_detections in detections]
+        targets = [policy.target((image.shape[1], image.shape[0])) if reason else "low"
+                   for image, reason in zip(images, reasons)]
+
+        full = [i for i, target in enumerate(targets) if target == "full"]
+        if full:
+            results = self.model.predict(source=[images[i] for i in full], conf=conf, imgsz=img_size, verbose=False)
+            for i, result in zip(full, results):
+                detections[i] = self._to_detections(result)
+        tiled = [i for i, target in enumerate(targets) if target == "tiled"]
+        if tiled:
+            for i, image_detections in zip(tiled, self._predict_tiled([images[i] for i in tiled], conf, img_size,
+                                                                      tile_overlap)):
+                detections[i] = image_detections
+
+        decisions = []
+        for image, reason, target in zip(images, reasons, targets):
+            pixels = low_img_size ** 2
+            if target == "full":
+                pixels += img_size ** 2
+            elif target == "tiled":
+                pixels += len(plan_tiles((image.shape[1], image.shape[0]), tile_overlap)) * img_size ** 2
+            decisions.append(AdaptiveDecision(target, reason, pixels, img_size ** 2))
+            record_decision(decisions[-1])
+        summary = summarize_decisions(decisions)
+        print(f"Adaptive inference: escalated {summary['escalation_rate']:.0%} of images {summary['reasons']}, "
+              f"{summary['compute_saved']:.0%} of full-resolution compute saved")
+        return detections
 
-        # Return the annotated image(s)
-        return annotated_images
+    def _predict_tiled(self, images, conf, img_size, tile_overlap, max_batch=8):
+        # Tiles of all images go through the model in chunks of max_batch, as in tiling.detect_tiled,
+        # so a very long receipt does not put all of its tiles in memory at once
+        plans = [plan_tiles((image.shape[1], image.shape[0]), tile_overlap) for image in images]
+        jobs = [(index, tile) for index, plan in enumerate(plans) for tile in plan]
+        per_tile = [[] for _ in images]
+        for start in range(0, len(jobs), max_batch):
+            chunk = jobs[start:start + max_batch]
+            tiles = [crop_tiles(images[index], [tile])[0] for index, tile in chunk]
+            results = self.model.predict(source=tiles, conf=conf, imgsz=img_size, verbose=False)
+            for (index, (x1, y1, _, _)), result in zip(chunk, results):
+                tile_detections = self._to_detections(result)
+                offset = np.array([x1, y1, x1, y1], dtype=np.float32)
+                per_tile[index].append(Detections(tile_detections.boxes + offset, tile_detections.scores,
+                                                  tile_detections.class_ids))
+        return [merge_tile_detections(tile_detections, plan) for tile_detections, plan in zip(per_tile, plans)]
 
-    def export_model(self, export_format: str = 'onnx'):
+    def _save_dir(self):
+        # The run directory of the last predict call, where ultralytics also puts its own crops
+        save_dir = str(self.model.predictor.save_dir)
+        os.makedirs(save_dir, exist_ok=True)
+        return save_dir
+
+    def _annotate(self, images, detections, save_crop, save_results, plot):
+        if save_crop:
+            # Same layout as ultralytics' save_crop: <save dir>/crops/<class>/image<n>.jpg
+            crops_dir = Path(self._save_dir()) / 'crops'
+            for number, (image, image_detections) in enumerate(zip(images, detections)):
+                for box, class_id in zip(image_detections.boxes, image_detections.class_ids.tolist()):
+                    save_one_box(box, image, file=crops_dir / self.model.names[class_id] / f"image{number}.jpg",
+                                 BGR=True)
+        if not (save_results or plot):
+            return detections
+        annotated = []
+        for number, (image, image_detections) in enumerate(zip(images, detections)):
+            annotator = Annotator(image.copy())
+            for box, score, class_id in zip(image_detections.boxes.tolist(), image_detections.scores.tolist(),
+                                            image_detections.class_ids.tolist()):
+                annotator.box_label(box, f"{self.model.names[class_id]} {score:.2f}", color=colors(class_id, True))
+            annotated.append(annotator.result())
+            if save_results:
+                saved_path = os.path.join(self._save_dir(), f"prediction_{number}.jpg")
+                Image.fromarray(annotated[-1][..., ::-1]).save(saved_path)
+                print(f"Annotated results saved to: {saved_path}")
+        if plot:
+            return detections, annotated
+        return detections
+
+    def export_model(self, export_format: str = 'onnx', dynamic: bool = False, batch: int = 1, quantize: tuple = None,
+                     calibration_images: int = 100, img_size: int = 640, validate: bool = True):
         """
         Export the trained model to a specific format.
 
         Args:
             export_format (str): Format to export the model. Default is 'onnx'.
+            dynamic (bool): Export with a dynamic batch axis so several images can run in one call. Default is False.
+            batch (int): Batch size baked into the export when dynamic is False. Default is 1.
+            quantize (tuple, optional): ONNX only. Reduced-precision variants to build next to the FP32 export:
+                any of 'int8' (static, calibrated on the train split of the dataset YAML), 'dynamic' and 'fp16'.
+                Each variant is validated against the FP32 baseline and a mAP/latency report is written next
+                to the model. Default is None.
+            calibration_images (int): Number of calibration images for 'int8'. Default is 100.
+            img_size (int): Export and validation image size. Default is 640.
+            validate (bool): Measure mAP on the val split for the report. Default is True.
+
+        Returns:
+            str: Path to the exported model, or {variant: path} including 'fp32' when quantize is given.
         """
+        # Check the quantization arguments before spending minutes on the export
+        if isinstance(quantize, str):
+            quantize = (quantize,)
+        if quantize:
+            if export_format != 'onnx':
+                raise ValueError("Quantized variants are only built for ONNX exports")
+            unknown = set(quantize) - set(VARIANTS)
+            if unknown:
+                raise ValueError(f"Unknown quantization variants: {sorted(unknown)}")
+
         print(f"Exporting model to {export_format} format...")
-        self.model.export(format=export_format)
+        exported_path = self.model.export(format=export_format, dynamic=dynamic, batch=batch, imgsz=img_size)
         print(f"Model exported to {export_format} format successfully!")
+        if not quantize:
+            return exported_path
+
+        data_yaml_path = self.yaml_path or self.prepare_data()
+        paths, _ = build_variants(exported_path, data_yaml_path, quantize, calibration_images=calibration_images,
+                                  imgsz=img_size, validate=validate)
+        return paths